@@ -1,27 +1,112 @@
 from pathlib import Path
-import subprocess
-from lib.install_helpers import apply_dotfiles, select_package_user, vefity_internet
+import argparse
+import os
+import sys
+from lib.install_helpers import apply_dotfiles, preflight_aur_groups, select_package_user, vefity_internet
 from lib.process_helpers import *
-from lib.models import Disk, PackageGroup, PackageInstaller, SystemSettings
+from lib.models import Disk, InstallOptions, PackageGroup, PackageInstaller, SystemSettings
 from lib.picker import pick_setup
 from lib.loader import load_setup_yaml
-from lib.partitioner import partition_disks
+from lib.block_inventory import get_block_snapshot, refresh_block_snapshot
+from lib.loopdev import attach_images
+from lib.partitioner import partition_disks, validate_disks
+from lib.aur_rpc import AurRpcClient
+from lib.journal import InstallJournal
+from lib.chroot_script import ChrootScript
+from lib.chroot_session import ChrootSession
+from lib.models.packages import collect_packages
+from lib.package_phases import PackageCoordinator
+from lib.mirrors import MIRRORLIST_PATH, rotate_mirrorlist, write_ranked_mirrorlist
+from lib.phases import (
+    DEFAULT_MAX_PARALLEL,
+    RESOURCE_CHROOT,
+    RESOURCE_DISK,
+    RESOURCE_NETWORK,
+    RESOURCE_PACMAN,
+    PhaseScheduler,
+)
+from lib.pkgcache import SharedPackageCache
+from lib.retry import STEP_PACSTRAP, describe_targets, get_attempt_log, remove_stale_db_lock, run_with_retry
+from lib.runner import RecordingRunner, ReplayRunner, get_runner, set_runner
+from lib.target_fs import TargetFilesystem
+from lib.tracing import CATEGORY_CHROOT, CATEGORY_COMMAND, get_tracer
+from lib.prefetch import PackagePrefetcher
+from lib.syncdb import load_sync_index, preflight_package_groups
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Install Arch Linux from a setup.yaml.")
+    parser.add_argument(
+        "--max-parallel",
+        type=int,
+        default=DEFAULT_MAX_PARALLEL,
+        help=f"install phases to run concurrently (default: {DEFAULT_MAX_PARALLEL}; 1 runs them in order)",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        default=LOG_DIR / "trace.json",
+        help="write a Chrome trace (chrome://tracing, Perfetto) of every phase and command here",
+    )
+    parser.add_argument(
+        "--record",
+        type=Path,
+        help="run normally but save every command with its output, exit code and timing to this file",
+    )
+    parser.add_argument(
+        "--replay",
+        type=Path,
+        help="serve commands from a --record file instead of running them (benchmarks, regression tests)",
+    )
+    parser.add_argument(
+        "--replay-latency",
+        type=float,
+        default=None,
+        help="simulated seconds per replayed command (default: the recorded durations)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="remount an interrupted install and continue from its first unfinished phase",
+    )
+    args = parser.parse_args()
+
+    if args.max_parallel < 1:
+        parser.error("--max-parallel must be at least 1")
+
+    if args.record and args.replay:
+        parser.error("--record and --replay cannot be combined")
+
+    # A replay writes the target's files for real, so it needs a directory
+    # of its own rather than the default mount point (or /).
+    if args.replay and ("ARCHY_TARGET_ROOT" not in os.environ or TARGET_ROOT.resolve() in (Path("/"), Path("/mnt"))):
+        parser.error("--replay needs ARCHY_TARGET_ROOT set to a scratch directory")
+
+    return args
 
 
 def main():
+    args = parse_args()
+
+    if args.record:
+        set_runner(RecordingRunner(args.record, target_root=TARGET_ROOT))
+    elif args.replay:
+        set_runner(ReplayRunner(args.replay, target_root=TARGET_ROOT, latency=args.replay_latency))
+    runner = get_runner()
 
     # 1. Pick setup
 
     # Keyboard layout
-    subprocess.run(["loadkeys", "us"])
+    run_captured(["loadkeys", "us"])
 
-    # check_efi
-    with open("/sys/firmware/efi/fw_platform_size") as f:
-        value = f.read().strip()
+    # check_efi (a replay may run on any machine)
+    if not runner.simulated:
+        with open("/sys/firmware/efi/fw_platform_size") as f:
+            value = f.read().strip()
 
-    if value != "64":
-        print("architecture not supported by this install script.")
-        exit()
+        if value != "64":
+            print("architecture not supported by this install script.")
+            exit()
 
     # 2. Load raw YAML
 
@@ -44,6 +129,7 @@ def main():
 
     disks = Disk.from_storage(raw["storage"])
     system = SystemSettings.from_config(machine_config)
+    options = InstallOptions.from_config(raw.get("install"))
     resource_roots = [base_dir, setups_root, repo_root]
     package_root = repo_root / "packages"
 
@@ -61,23 +147,298 @@ def main():
         for partition in disk.partitions:
             print(f"  {partition}")
 
+    # Catch a missing, read-only or too small disk before any prompt.
+    if not runner.simulated:
+        try:
+            validate_disks(disks)
+        except ValueError as exc:
+            print(f"Invalid storage configuration: {exc}")
+            exit()
+
     print(f"Package groups: {package_groups}")
 
+    if options.rank_mirrors:
+        if runner.simulated:
+            # Probing mirrors measures this machine's network, not the recorded one.
+            print("Skipping mirror ranking in a replay")
+        else:
+            write_ranked_mirrorlist(MIRRORLIST_PATH, count=options.mirror_count)
+
+    aur_client = AurRpcClient(options.aur_rpc_url, ttl=options.aur_rpc_ttl)
+
+    packages_resolved = preflight_package_groups(package_groups)
+    packages_resolved = preflight_aur_groups(package_groups, aur_client) and packages_resolved
+    if not packages_resolved:
+        if not input("Continue with unresolved packages? (yes or y): ").lower() in ["yes", "y"]:
+            print("Exiting!!!")
+            exit()
+
+    prefetcher = None
+    if options.prefetch and runner.allow_direct:
+        # Downloads straight into the on-disk cache that pacstrap will use.
+        prefetcher = PackagePrefetcher(
+            [*options.pacstrap, *collect_packages(package_groups, "pacman")],
+            options.package_cache,
+        )
+        prefetcher.start()
+
     if not input("Ready to install? (yes or y): ").lower() in ["yes", "y"]:
         print("Exiting!!!")
         exit()
 
-    root_password = prompt_password("Root password")
+    # Only names the sync index resolves are folded into pacstrap; the rest
+    # are left to the package phase, which installs and reports them per batch.
+    index = load_sync_index() if options.fold_pacman else None
+    if options.fold_pacman and index is None:
+        print("No sync database index; pacman groups are installed after pacstrap instead of folded into it")
+    pacstrap_packages = options.pacstrap_packages(package_groups, index)
+    folded = set(pacstrap_packages) if index is not None else set()
+    pacman_packages = [pkg for pkg in collect_packages(package_groups, "pacman") if pkg not in folded]
+    aur_packages = collect_packages(package_groups, "aur")
+    flatpak_packages = collect_packages(package_groups, "flatpak")
+    dotfiles = raw.get("dotfiles", [])
+
+    # Journal fingerprints: a phase reruns on resume when its inputs change.
+    phase_inputs = {
+        "partition": disks,
+        "pacstrap": pacstrap_packages,
+        "locale": system.locale,
+        "timezone": system.timezone,
+        "hostname": system.hostname,
+        "bootloader": [disks, system.secure_boot],
+        "users": system.users,
+        "configure": [system, disks],
+        "dotfiles": dotfiles,
+        "pacman-packages": pacman_packages,
+        "flatpak-packages": flatpak_packages,
+        "aur-packages": aur_packages,
+    }
+
+    journal = InstallJournal(TARGET_ROOT)
+    if args.resume:
+        mount_target(disks)
+        if not journal.load():
+            print(f"No install journal at {journal.path}; run without --resume.")
+            exit()
+        if not journal.is_done("partition", phase_inputs["partition"]):
+            print("The storage layout changed since the interrupted install; run without --resume.")
+            exit()
+
+    # Only ask for passwords whose phases still have to run.
+    root_password = None
+    password_phase = "configure" if options.chroot_script else "root-password"
+    if not journal.is_done(password_phase, phase_inputs.get(password_phase)):
+        root_password = prompt_password("Root password")
+
     user_passwords: dict[str, str] = {}
-    for user in system.users:
-        user_passwords[user.username] = prompt_password(f"Password for {user.username}")
+    users_phase = "configure" if options.chroot_script else "users"
+    if not journal.is_done(users_phase, phase_inputs[users_phase]):
+        for user in system.users:
+            user_passwords[user.username] = prompt_password(f"Password for {user.username}")
+
+    package_cache = SharedPackageCache(TARGET_ROOT, options.package_cache)
+    chroot_session = ChrootSession(TARGET_ROOT)
+    package_user = select_package_user(system)
+    installer = PackageInstaller(
+        package_user,
+        TARGET_ROOT,
+        aur_client=aur_client,
+        retry_policies=options.retry,
+    )
+    coordinator = PackageCoordinator(
+        installer,
+        pacman=pacman_packages,
+        aur=aur_packages,
+        flatpak=flatpak_packages,
+    )
+
+    def partition():
+        partition_disks(disks, dry_run=False)
+
+    def mount():
+        mount_target(disks)
+        journal.attach()
+
+    def prepare_package_cache():
+        package_cache.prepare()
+        if options.package_seed:
+            package_cache.seed_from(options.package_seed)
+
+        if prefetcher:
+            prefetcher.wait()
+
+    def pacstrap():
+        process = ["pacstrap", "-K", str(TARGET_ROOT), *pacstrap_packages]
+        policy = options.retry[STEP_PACSTRAP]
+
+        # With a timeout only the download runs under it: pacstrap killed
+        # while pacman commits would leave packages half unpacked. The
+        # install then comes from the cache the download filled.
+        attempt = process
+        if policy.timeout is not None:
+            attempt = ["pacstrap", "-K", str(TARGET_ROOT), "--downloadonly", *pacstrap_packages]
+        print(f"Running command: {' '.join(attempt)}")
+
+        # pacstrap downloads through the host's mirrorlist; a replay must
+        # not reorder the mirrors of the machine it runs on.
+        result = run_with_retry(
+            lambda: run_streaming(policy.wrap(attempt), log_name="pacstrap"),
+            policy,
+            step=STEP_PACSTRAP,
+            target=describe_targets(pacstrap_packages),
+            switch_mirror=None if runner.simulated else lambda: rotate_mirrorlist(MIRRORLIST_PATH),
+            after_timeout=lambda: remove_stale_db_lock(TARGET_ROOT),
+        )
+        if result.returncode == 0 and attempt is not process:
+            print(f"Running command: {' '.join(process)}")
+            result = run_streaming(process, log_name="pacstrap")
+        if result.returncode != 0:
+            report_failure(process, result)
+            sys.exit(1)
+
+    def copy_mirrorlist():
+        if options.rank_mirrors and runner.exists(MIRRORLIST_PATH):
+            TargetFilesystem(TARGET_ROOT).write_text(MIRRORLIST_PATH, runner.read_text(MIRRORLIST_PATH))
+
+    def fstab():
+        # Keep the cache bind mount out of the generated fstab. Overwrite
+        # rather than append so a resumed install cannot duplicate entries.
+        package_cache.release()
+        run_process_exit_on_fail(["bash", "-lc", f"genfstab -U {TARGET_ROOT} > {TARGET_ROOT}/etc/fstab"])
+        package_cache.prepare()
+
+    def configure():
+        with ChrootScript(TARGET_ROOT) as script:
+            configure_system(system, disks, root_password=root_password, user_passwords=user_passwords)
+        script.run_or_exit()
+
+    scheduler = PhaseScheduler(max_parallel=args.max_parallel, journal=journal)
+    scheduler.add("partition", partition, resources={RESOURCE_DISK}, inputs=phase_inputs["partition"])
+    # Mounts, bind mounts and the chroot session are runtime state that
+    # every run, including a resume, has to set up again.
+    scheduler.add("mount", mount, requires=["partition"], resources={RESOURCE_DISK}, checkpoint=False)
+    scheduler.add(
+        "package-cache",
+        prepare_package_cache,
+        requires=["mount"],
+        resources={RESOURCE_DISK},
+        checkpoint=False,
+    )
+    scheduler.add(
+        "pacstrap",
+        pacstrap,
+        requires=["package-cache"],
+        resources={RESOURCE_PACMAN, RESOURCE_NETWORK},
+        inputs=phase_inputs["pacstrap"],
+    )
+    scheduler.add("mirrorlist", copy_mirrorlist, requires=["pacstrap"], checkpoint=False)
+    scheduler.add("fstab", fstab, requires=["pacstrap"], resources={RESOURCE_DISK})
+    # One arch-chroot serves the chroot commands of every later phase.
+    scheduler.add(
+        "chroot-session",
+        chroot_session.start,
+        requires=["fstab"],
+        resources={RESOURCE_CHROOT},
+        checkpoint=False,
+    )
+
+    if options.chroot_script:
+        # A recorded script is one ordered unit; it cannot be split into phases.
+        scheduler.add(
+            "configure",
+            configure,
+            requires=["chroot-session"],
+            resources={RESOURCE_CHROOT},
+            inputs=phase_inputs["configure"],
+        )
+    else:
+        scheduler.add("hostname", lambda: configure_hostname(system), requires=["pacstrap"], inputs=phase_inputs["hostname"])
+        scheduler.add(
+            "locale",
+            lambda: configure_locale(system),
+            requires=["chroot-session"],
+            resources={RESOURCE_CHROOT},
+            inputs=phase_inputs["locale"],
+        )
+        scheduler.add(
+            "timezone",
+            lambda: configure_timezone(system),
+            requires=["chroot-session"],
+            resources={RESOURCE_CHROOT},
+            inputs=phase_inputs["timezone"],
+        )
+        scheduler.add(
+            "root-password",
+            lambda: set_root_password(password=root_password),
+            requires=["chroot-session"],
+            resources={RESOURCE_CHROOT},
+        )
+        scheduler.add(
+            "bootloader",
+            lambda: install_bootloader(disks, enable_secure_boot=system.secure_boot),
+            requires=["chroot-session"],
+            resources={RESOURCE_CHROOT},
+            inputs=phase_inputs["bootloader"],
+        )
+        scheduler.add(
+            "users",
+            lambda: setup_users(system, user_passwords=user_passwords),
+            requires=["chroot-session"],
+            resources={RESOURCE_CHROOT},
+            inputs=phase_inputs["users"],
+        )
+
+    scheduler.add(
+        "dotfiles",
+        lambda: apply_dotfiles(dotfiles, resource_roots, users=system.users, root_path=TARGET_ROOT),
+        requires=[users_phase],
+        resources={RESOURCE_CHROOT},
+        inputs=phase_inputs["dotfiles"],
+    )
+    # Every group is merged per backend so each backend installs in one
+    # batch; the backends run side by side and share only the pacman lock.
+    # AUR builds run as the package user. Packages such as linux or
+    # nvidia-dkms run mkinitcpio/dkms hooks that must not race bootctl,
+    # sbctl key creation and signing, or the signing hook being written,
+    # so the lanes wait for the bootloader.
+    bootloader_phase = "configure" if options.chroot_script else "bootloader"
+    coordinator.add_phases(
+        scheduler,
+        requires=["chroot-session", "mirrorlist", bootloader_phase],
+        aur_requires=[users_phase],
+        inputs=phase_inputs,
+    )
+
+    try:
+        scheduler.run_or_exit()
+    except SystemExit:
+        print_retry_summary()
+        raise
+    finally:
+        write_trace(args.trace)
+        # A failed or interrupted run must not leave the arch-chroot's
+        # mounts or the cache bind mount behind in the target.
+        chroot_session.close()
+        package_cache.release()
 
-    partition_disks(disks, dry_run=False)
+    coordinator.print_failures()
+    print_retry_summary()
+
+    runner.close()
+
+    print("Install complete. Please reboot.")
+
+
+def mount_target(disks: list[Disk]):
+    """Mount the root and boot partitions under TARGET_ROOT and enable swap, skipping what is already active."""
 
     roots = []
     boots = []
     swaps = []
 
+    # A resumed install mounts image disks through their loop devices.
+    attach_images(disks)
+
     for disk in disks:
         for partition in disk.partitions:
             if partition.is_root():
@@ -91,63 +452,69 @@ def main():
         raise RuntimeError("No root partition found to mount")
 
     root = roots[0]
-    run_process_exit_on_fail(["mount", root.dev_path, "/mnt"])
+    boot_path = TARGET_ROOT / "boot"
+    snapshot = get_block_snapshot()
+    if not snapshot.is_mounted(TARGET_ROOT):
+        run_process_exit_on_fail(["mount", root.dev_path, str(TARGET_ROOT)])
 
-    if boots:
-        run_process_exit_on_fail(["mkdir", "-p", "/mnt/boot"])
+    if boots and not snapshot.is_mounted(boot_path):
+        run_process_exit_on_fail(["mkdir", "-p", str(boot_path)])
         for boot in boots:
-            run_process_exit_on_fail(["mount", boot.dev_path, "/mnt/boot"])
+            run_process_exit_on_fail(["mount", boot.dev_path, str(boot_path)])
 
     for swap in swaps:
-        run_process_exit_on_fail(["swapon", swap.dev_path])
+        if not snapshot.is_swap(swap.dev_path):
+            run_process_exit_on_fail(["swapon", swap.dev_path])
 
-    run_process_exit_on_fail(
-        "pacstrap -K /mnt base linux linux-firmware linux-headers base-devel sbctl networkmanager"
-    )
+    refresh_block_snapshot()
 
-    run_process_exit_on_fail(["bash", "-lc", "genfstab -U /mnt >> /mnt/etc/fstab"])
 
-    chroot_process(["sed", "-i", f's/^#\\s*{system.locale}/{system.locale}/', "/etc/locale.gen"])
-    chroot_process(f"ln -sf /usr/share/zoneinfo/{system.timezone} /etc/localtime")
-    chroot_process("hwclock --systohc")
-    chroot_process("locale-gen")
-    chroot_process(["/bin/sh", "-c", f'echo "LANG={system.locale}" > /etc/locale.conf'])
-    chroot_process(["/bin/sh", "-c", f'echo "{system.hostname}" > /etc/hostname'])
+def print_retry_summary():
+    summary = get_attempt_log().summary()
+    if summary:
+        print(summary)
+
+
+def write_trace(path: Path):
+    tracer = get_tracer()
+    print("\nSlowest commands:")
+    print(tracer.summary(categories={CATEGORY_COMMAND, CATEGORY_CHROOT}))
+    print(f"Timing trace: {tracer.write_chrome_trace(path)}")
+
+
+def configure_system(
+    system: SystemSettings,
+    disks: list[Disk],
+    *,
+    root_password: str | None = None,
+    user_passwords: dict[str, str] | None = None,
+):
+    configure_locale(system)
+    configure_timezone(system)
+    configure_hostname(system)
 
     set_root_password(password=root_password)
     install_bootloader(disks, enable_secure_boot=system.secure_boot)
 
     setup_users(system, user_passwords=user_passwords)
 
-    apply_dotfiles(raw.get("dotfiles", []), resource_roots, users=system.users)
 
-    package_user = select_package_user(system)
-    installer = PackageInstaller(package_user)
-
-    pacman_failures: list[str] = []
-    aur_failures: list[str] = []
-    flatpak_failures: list[str] = []
-
-    for group in package_groups:
-        if group.pacman:
-            pacman_failures.extend(installer.install_pacman_file(group.pacman))
-        if group.aur:
-            aur_failures.extend(installer.install_aur_file(group.aur))
-        if group.flatpak:
-            flatpak_failures.extend(installer.install_flatpak_file(group.flatpak))
-
-    if pacman_failures or aur_failures or flatpak_failures:
-        print("Package installation completed with some failures:")
-        if pacman_failures:
-            print(f"  Pacman: {', '.join(pacman_failures)}")
-        if aur_failures:
-            print(f"  AUR: {', '.join(aur_failures)}")
-        if flatpak_failures:
-            print(f"  Flatpak: {', '.join(flatpak_failures)}")
-    else:
-        print("All package installations completed successfully.")
+def configure_locale(system: SystemSettings):
+    target = TargetFilesystem(TARGET_ROOT)
+    target.enable_locale(system.locale)
+    target.write_text("/etc/locale.conf", f"LANG={system.locale}\n")
+    chroot_process("locale-gen", name="locale-gen")
+
+
+def configure_timezone(system: SystemSettings):
+    TargetFilesystem(TARGET_ROOT).symlink("/etc/localtime", f"/usr/share/zoneinfo/{system.timezone}")
+    chroot_process("hwclock --systohc", name="hwclock")
+
+
+def configure_hostname(system: SystemSettings):
+    TargetFilesystem(TARGET_ROOT).write_text("/etc/hostname", f"{system.hostname}\n")
+
 
-    print("Install complete. Please reboot.")
 def setup_users(
     system: SystemSettings,
     *,
@@ -178,12 +545,9 @@ def install_bootloader(disks: list[Disk], *, enable_secure_boot: bool = False):
     if not root_partition:
         raise ValueError("No root partition found for bootloader configuration")
 
-    result = subprocess.run(
-        ["blkid", "-s", "UUID", "-o", "value", root_partition.dev_path],
-        capture_output=True,
-        text=True,
-    )
-
+    # Read the superblock rather than udev's by-uuid links, which can still
+    # name the previous filesystem right after mkfs.
+    result = run_captured(["blkid", "-s", "UUID", "-o", "value", root_partition.dev_path])
     if result.returncode != 0:
         raise RuntimeError(f"Unable to read UUID for {root_partition.dev_path}: {result.stderr}")
 
@@ -191,23 +555,18 @@ def install_bootloader(disks: list[Disk], *, enable_secure_boot: bool = False):
     if not root_uuid:
         raise RuntimeError(f"Missing UUID for {root_partition.dev_path}")
 
-    chroot_process(["bootctl", "install"])
-    chroot_process(["mkdir", "-p", "/boot/loader/entries"])
+    chroot_process(["bootctl", "install"], name="bootctl-install")
 
     loader_conf = """default arch.conf\ntimeout 3\neditor no\n"""
     entry_conf = f"""title Arch Linux\nlinux /vmlinuz-linux\ninitrd /initramfs-linux.img\noptions root=UUID={root_uuid} rw\n"""
 
-    chroot_process([
-        "/bin/sh", "-c",
-        f"cat > /boot/loader/loader.conf <<'EOF'\n{loader_conf}\nEOF"
-    ])
+    # bootctl install keeps an existing loader.conf, so these are safe to
+    # write before a recorded chroot script runs it.
+    target = TargetFilesystem(TARGET_ROOT)
+    target.write_text("/boot/loader/loader.conf", loader_conf)
+    target.write_text("/boot/loader/entries/arch.conf", entry_conf)
 
-    chroot_process([
-        "/bin/sh", "-c",
-        f"cat > /boot/loader/entries/arch.conf <<'EOF'\n{entry_conf}\nEOF"
-    ])
-
-    chroot_process(["systemctl", "enable", "NetworkManager.service"])
+    chroot_process(["systemctl", "enable", "NetworkManager.service"], name="enable-networkmanager")
 
     if enable_secure_boot:
         setup_secure_boot()
@@ -216,11 +575,13 @@ def install_bootloader(disks: list[Disk], *, enable_secure_boot: bool = False):
 def setup_secure_boot():
     clear_immutable_efivars()
 
-    keys_dir = Path("/mnt/usr/share/secureboot/keys")
-    if not keys_dir.exists():
-        chroot_process(["sbctl", "create-keys"])
+    chroot_process(
+        ["sbctl", "create-keys"],
+        name="sbctl-create-keys",
+        unless=["test", "-d", "/usr/share/secureboot/keys"],
+    )
 
-    chroot_process(["sbctl", "enroll-keys", "--microsoft"])
+    chroot_process(["sbctl", "enroll-keys", "--microsoft"], name="sbctl-enroll-keys")
 
     binaries = [
         "/boot/EFI/systemd/systemd-bootx64.efi",
@@ -229,7 +590,7 @@ def setup_secure_boot():
     ]
 
     for binary in binaries:
-        chroot_process(["sbctl", "sign", "-s", binary])
+        chroot_process(["sbctl", "sign", "-s", binary], name=f"sbctl-sign-{Path(binary).name}")
 
     configure_secure_boot_hook()
 
@@ -249,9 +610,6 @@ def clear_immutable_efivars():
 
 
 def configure_secure_boot_hook():
-    hook_path = Path("/mnt/etc/pacman.d/hooks/90-secure-boot-sign.hook")
-    hook_path.parent.mkdir(parents=True, exist_ok=True)
-
     hook_contents = """[Trigger]
 Operation = Install
 Operation = Upgrade
@@ -267,7 +625,7 @@ When = PostTransaction
 Exec = /usr/bin/sbctl sign-all
 """
 
-    hook_path.write_text(hook_contents)
+    TargetFilesystem(TARGET_ROOT).write_text("/etc/pacman.d/hooks/90-secure-boot-sign.hook", hook_contents)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Compare one arch-chroot per command against a persistent chroot session."""
+
+from pathlib import Path
+import argparse
+import os
+import sys
+import time
+
+repo_root = Path(__file__).resolve().parent.parent
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+from lib.chroot_session import ChrootSession
+from lib.process_helpers import run_streaming
+
+
+def ensure_root():
+    if os.geteuid() != 0:
+        sys.exit("This script must be run as root.")
+
+
+def bench_per_call(root: str, command: list[str], count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        result = run_streaming(["arch-chroot", root, *command])
+        if result.returncode != 0:
+            sys.exit(f"Command failed with exit code {result.returncode}")
+    return time.perf_counter() - start
+
+
+def bench_session(root: str, command: list[str], count: int) -> float:
+    start = time.perf_counter()
+    with ChrootSession(root) as session:
+        for _ in range(count):
+            result = session.run(command)
+            if result is None or result.returncode != 0:
+                sys.exit("Command failed inside the chroot session")
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--root", default="/mnt", help="installed system to chroot into")
+    parser.add_argument("--count", type=int, default=50, help="commands per approach")
+    parser.add_argument("command", nargs="*", default=["true"], help="command to run (default: true)")
+    args = parser.parse_args()
+
+    ensure_root()
+
+    per_call = bench_per_call(args.root, args.command, args.count)
+    session = bench_session(args.root, args.command, args.count)
+
+    print(f"\n{args.count} x {' '.join(args.command)} in {args.root}")
+    print(f"  arch-chroot per command: {per_call:8.3f}s ({per_call / args.count * 1000:.1f} ms/command)")
+    print(f"  chroot session:          {session:8.3f}s ({session / args.count * 1000:.1f} ms/command)")
+    if session > 0:
+        print(f"  speedup:                 {per_call / session:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
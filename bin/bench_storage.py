@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Time each storage stage (attach, partition table, partprobe, mkfs, mount) per filesystem on a loop-attached sparse image."""
+
+from pathlib import Path
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+repo_root = Path(__file__).resolve().parent.parent
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+from lib.loopdev import attach_images, detach
+from lib.models import Disk, Partition
+from lib.models.partition import VALID_FS
+from lib.partitioner import build_partition_actions, run_disk_actions, run_partition_action
+from lib.process_helpers import run_captured
+
+STAGES = ("attach", "table", "partprobe", "mkfs", "mount", "umount", "detach")
+
+
+def ensure_root():
+    if os.geteuid() != 0:
+        sys.exit("This script must be run as root.")
+
+
+def wait_for_device(path: str, timeout: float = 10.0):
+    # udev creates the partition node shortly after partprobe returns.
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            sys.exit(f"{path} did not appear after partprobe")
+        time.sleep(0.01)
+
+
+def image_disk(image: Path, size: str, fs: str) -> Disk:
+    # The installer only formats vfat for the EFI partition.
+    mount = "/boot" if fs == "vfat" else "/"
+    config = {"mount": mount, "fs": fs, "size": "fill"}
+    return Disk(
+        device=str(image),
+        wipe=True,
+        image_size=size,
+        partitions=[Partition.from_config(config, str(image), 1)],
+    )
+
+
+def bench_fs(fs: str, image: Path, size: str, mountpoint: Path) -> dict[str, float]:
+    timings = {}
+    disk = image_disk(image, size, fs)
+    partition = disk.partitions[0]
+
+    def timed(stage, func):
+        start = time.perf_counter()
+        func()
+        timings[stage] = time.perf_counter() - start
+
+    try:
+        timed("attach", lambda: attach_images([disk]))
+        table, partprobe, *mkfs = build_partition_actions(disk)
+        timed("table", lambda: run_partition_action(table))
+
+        def reload():
+            run_partition_action(partprobe)
+            wait_for_device(partition.dev_path)
+
+        timed("partprobe", reload)
+        timed("mkfs", lambda: run_disk_actions(mkfs))
+        timed("mount", lambda: run_captured(["mount", partition.dev_path, str(mountpoint)], check=True))
+        timed("umount", lambda: run_captured(["umount", str(mountpoint)], check=True))
+        timed("detach", lambda: detach(disk.block_device))
+    except subprocess.CalledProcessError as exc:
+        sys.exit(f"{fs}: {' '.join(exc.cmd)} failed with exit code {exc.returncode}")
+    finally:
+        if os.path.ismount(mountpoint):
+            run_captured(["umount", str(mountpoint)])
+        if disk.block_device and "detach" not in timings:
+            run_captured(["losetup", "--detach", disk.block_device])
+        image.unlink(missing_ok=True)
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", default="4G", help="size of the sparse image (default: 4G)")
+    parser.add_argument("--dir", default="/var/tmp", help="directory for the image (default: /var/tmp)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per filesystem; the mean is reported")
+    parser.add_argument("--fs", action="append", choices=sorted(VALID_FS), help="filesystem to time (repeatable; default: all)")
+    args = parser.parse_args()
+
+    ensure_root()
+
+    filesystems = args.fs or sorted(VALID_FS)
+    image = Path(args.dir) / "archy-bench.img"
+    if image.exists():
+        sys.exit(f"{image} already exists; remove it or pick another --dir")
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="archy-bench-") as mountpoint:
+        for fs in filesystems:
+            runs = [bench_fs(fs, image, args.size, Path(mountpoint)) for _ in range(args.repeat)]
+            results[fs] = {stage: sum(run[stage] for run in runs) / len(runs) for stage in STAGES}
+
+    print(f"\nMean seconds per stage, {args.size} image in {args.dir}, {args.repeat} run(s) each")
+    print(f"  {'fs':<6}" + "".join(f"{stage:>11}" for stage in STAGES) + f"{'total':>11}")
+    for fs, stages in results.items():
+        row = "".join(f"{stages[stage]:>11.3f}" for stage in STAGES)
+        print(f"  {fs:<6}{row}{sum(stages.values()):>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
 """Capture installed packages and separate native, AUR, and Flatpak lists."""
 
 from pathlib import Path
-import subprocess
+import sys
+
+repo_root = Path(__file__).resolve().parent.parent
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+from lib.process_helpers import run_captured
 
 
 def capture_packages(args: list[str]) -> list[str]:
-    result = subprocess.run(args, capture_output=True, text=True)
+    result = run_captured(args)
     if result.returncode != 0:
         raise RuntimeError(f"Failed to run {' '.join(args)}: {result.stderr}")
 
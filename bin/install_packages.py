@@ -10,10 +10,15 @@ repo_root = Path(__file__).resolve().parent.parent
 if str(repo_root) not in sys.path:
     sys.path.insert(0, str(repo_root))
 
-from lib.install_helpers import select_package_user, vefity_internet
+from lib.install_helpers import preflight_aur_groups, select_package_user, vefity_internet
 from lib.loader import load_setup_yaml
-from lib.models import PackageGroup, PackageInstaller, SystemSettings
+from lib.models import InstallOptions, PackageGroup, PackageInstaller, SystemSettings
 from lib.picker import pick_setup
+from lib.aur_rpc import AurRpcClient
+from lib.models.packages import collect_packages
+from lib.package_phases import PackageCoordinator
+from lib.retry import get_attempt_log
+from lib.syncdb import preflight_package_groups
 
 
 def ensure_root():
@@ -47,39 +52,45 @@ def main():
         raise KeyError("Setup file missing 'system' configuration")
 
     system = SystemSettings.from_config(machine_config)
+    options = InstallOptions.from_config(raw.get("install"))
     package_groups = PackageGroup.from_entries(raw.get("packages", []), base_dir=package_root)
 
     if not package_groups:
         print("No package groups configured; nothing to install.")
         return
 
+    aur_client = AurRpcClient(options.aur_rpc_url, ttl=options.aur_rpc_ttl)
+
+    packages_resolved = preflight_package_groups(package_groups)
+    packages_resolved = preflight_aur_groups(package_groups, aur_client) and packages_resolved
+    if not packages_resolved:
+        if not input("Continue with unresolved packages? (yes or y): ").lower() in ["yes", "y"]:
+            sys.exit("Aborted by user")
+
     package_user = select_package_user(system)
     ensure_user_exists(package_user)
 
-    installer = PackageInstaller(package_user, root_path="/")
-
-    pacman_failures: list[str] = []
-    aur_failures: list[str] = []
-    flatpak_failures: list[str] = []
-
-    for group in package_groups:
-        if group.pacman:
-            pacman_failures.extend(installer.install_pacman_file(group.pacman))
-        if group.aur:
-            aur_failures.extend(installer.install_aur_file(group.aur))
-        if group.flatpak:
-            flatpak_failures.extend(installer.install_flatpak_file(group.flatpak))
-
-    if pacman_failures or aur_failures or flatpak_failures:
-        print("Package installation completed with some failures:")
-        if pacman_failures:
-            print(f"  Pacman: {', '.join(pacman_failures)}")
-        if aur_failures:
-            print(f"  AUR: {', '.join(aur_failures)}")
-        if flatpak_failures:
-            print(f"  Flatpak: {', '.join(flatpak_failures)}")
-    else:
-        print("All package installations completed successfully.")
+    installer = PackageInstaller(
+        package_user,
+        root_path="/",
+        aur_client=aur_client,
+        retry_policies=options.retry,
+    )
+
+    # Merge every group per backend so each backend installs in one batch;
+    # the three backends run side by side.
+    coordinator = PackageCoordinator(
+        installer,
+        pacman=collect_packages(package_groups, "pacman"),
+        aur=collect_packages(package_groups, "aur"),
+        flatpak=collect_packages(package_groups, "flatpak"),
+    )
+    coordinator.run()
+    coordinator.print_failures()
+
+    retry_summary = get_attempt_log().summary()
+    if retry_summary:
+        print(retry_summary)
 
 
 if __name__ == "__main__":
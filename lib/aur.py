@@ -0,0 +1,268 @@
+"""Helpers for scheduling AUR builds from their ``.SRCINFO`` metadata."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import json
+import os
+from pathlib import Path
+import re
+import shutil
+import time
+
+from lib.target_fs import atomic_write_text
+
+# Memory budget assumed per concurrent makepkg when sizing the worker pool.
+BUILD_MEMORY_BYTES = 2 * 1024**3
+
+# Default upper bound for the persistent clone/build cache.
+DEFAULT_CACHE_LIMIT_BYTES = 20 * 1024**3
+
+_DEPENDENCY_KEYS = ("depends", "makedepends", "checkdepends")
+_VERSION_CONSTRAINT = re.compile(r"(<=|>=|=|<|>).*$")
+
+
+def strip_version(dependency: str) -> str:
+    """Turn ``foo>=1.2`` or ``libfoo.so=1-64`` into the bare name."""
+
+    return _VERSION_CONSTRAINT.sub("", dependency.strip())
+
+
+@dataclass
+class SrcInfo:
+    pkgbase: str
+    pkgnames: list[str] = field(default_factory=list)
+    pkgver: str = ""
+    pkgrel: str = ""
+    epoch: str = ""
+    depends: list[str] = field(default_factory=list)
+    provides: list[str] = field(default_factory=list)
+
+    @property
+    def version(self) -> str:
+        version = f"{self.pkgver}-{self.pkgrel}"
+        return f"{self.epoch}:{version}" if self.epoch else version
+
+    @classmethod
+    def parse(cls, text: str) -> "SrcInfo":
+        """
+        Parse a ``.SRCINFO`` file. Dependencies and provides from the pkgbase
+        and every split package are merged, and architecture-specific keys
+        such as ``depends_x86_64`` are folded into their generic key.
+        """
+
+        info = cls(pkgbase="")
+
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith("#") or " = " not in line:
+                continue
+
+            key, value = (part.strip() for part in line.split(" = ", 1))
+            base_key = key.removesuffix("_x86_64")
+
+            if key == "pkgbase":
+                info.pkgbase = value
+            elif key == "pkgname":
+                info.pkgnames.append(value)
+            elif key in ("pkgver", "pkgrel", "epoch"):
+                setattr(info, key, value)
+            elif base_key in _DEPENDENCY_KEYS:
+                if value not in info.depends:
+                    info.depends.append(value)
+            elif base_key == "provides":
+                if value not in info.provides:
+                    info.provides.append(value)
+
+        if not info.pkgbase:
+            raise ValueError("SRCINFO is missing pkgbase")
+
+        if not info.pkgnames:
+            info.pkgnames.append(info.pkgbase)
+
+        return info
+
+    @classmethod
+    def from_file(cls, path: Path | str) -> "SrcInfo":
+        return cls.parse(Path(path).read_text())
+
+    def satisfies(self) -> set[str]:
+        return {*self.pkgnames, *(strip_version(p) for p in self.provides)}
+
+
+def dependency_graph(srcinfos: dict[str, SrcInfo]) -> dict[str, set[str]]:
+    """Map each package to the other packages in ``srcinfos`` it depends on."""
+
+    providers: dict[str, set[str]] = {}
+    for pkg, info in srcinfos.items():
+        for name in info.satisfies():
+            providers.setdefault(name, set()).add(pkg)
+
+    graph: dict[str, set[str]] = {}
+    for pkg, info in srcinfos.items():
+        needs: set[str] = set()
+        for dependency in info.depends:
+            needs.update(providers.get(strip_version(dependency), set()))
+        needs.discard(pkg)
+        graph[pkg] = needs
+
+    return graph
+
+
+def external_dependencies(srcinfos: dict[str, SrcInfo], packages: list[str]) -> list[str]:
+    """Dependencies of ``packages`` that no package in ``srcinfos`` provides."""
+
+    provided: set[str] = set()
+    for info in srcinfos.values():
+        provided.update(info.satisfies())
+
+    dependencies: dict[str, None] = {}
+    for pkg in packages:
+        for dependency in srcinfos[pkg].depends:
+            if strip_version(dependency) not in provided:
+                dependencies.setdefault(dependency)
+
+    return list(dependencies)
+
+
+def build_waves(graph: dict[str, set[str]]) -> tuple[list[list[str]], list[str]]:
+    """
+    Group packages into waves where every package only depends on packages
+    from earlier waves. Returns the waves plus any packages caught in a
+    dependency cycle, which cannot be scheduled.
+    """
+
+    remaining = {pkg: set(deps) for pkg, deps in graph.items()}
+    waves: list[list[str]] = []
+
+    while remaining:
+        ready = [pkg for pkg, deps in remaining.items() if not deps]
+        if not ready:
+            break
+
+        waves.append(ready)
+        for pkg in ready:
+            del remaining[pkg]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+    return waves, list(remaining)
+
+
+def _available_memory() -> int | None:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    return None
+
+
+def default_build_jobs() -> int:
+    """Number of concurrent makepkg builds the host's cores and memory allow."""
+
+    jobs = os.cpu_count() or 1
+    memory = _available_memory()
+    if memory is not None:
+        jobs = min(jobs, memory // BUILD_MEMORY_BYTES)
+
+    return max(1, jobs)
+
+
+def _tree_size(path: Path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_blocks * 512
+            except OSError:
+                pass
+
+    return total
+
+
+class AurCache:
+    """
+    Host-side view of the per-user AUR clone directory. Each package keeps its
+    git clone, downloaded sources and built packages between runs; a small
+    manifest records when each clone was last used so the least recently used
+    clones can be evicted once the directory grows past ``limit_bytes``.
+    """
+
+    MANIFEST = ".archy-cache.json"
+
+    def __init__(self, path: Path | str, limit_bytes: int | None = DEFAULT_CACHE_LIMIT_BYTES):
+        self.path = Path(path)
+        self.limit_bytes = limit_bytes
+
+    def has_clone(self, pkg: str) -> bool:
+        return (self.path / pkg / ".git").is_dir()
+
+    def _read_manifest(self) -> dict[str, float]:
+        try:
+            data = json.loads((self.path / self.MANIFEST).read_text())
+        except (OSError, ValueError):
+            return {}
+
+        return data if isinstance(data, dict) else {}
+
+    def _write_manifest(self, manifest: dict[str, float]):
+        manifest_path = self.path / self.MANIFEST
+        atomic_write_text(manifest_path, json.dumps(manifest, indent=2, sort_keys=True))
+
+        # Keep the manifest owned by the build user like the rest of the cache.
+        stat = self.path.stat()
+        try:
+            os.chown(manifest_path, stat.st_uid, stat.st_gid)
+        except OSError:
+            pass
+
+    def touch(self, packages: list[str]):
+        if not self.path.is_dir():
+            return
+
+        manifest = self._read_manifest()
+        now = time.time()
+        for pkg in packages:
+            manifest[pkg] = now
+        self._write_manifest(manifest)
+
+    def evict(self, keep: list[str] | None = None) -> list[str]:
+        """
+        Remove least recently used clones until the cache fits its limit.
+        Packages in ``keep`` are never evicted. Returns the evicted packages.
+        """
+        if self.limit_bytes is None or not self.path.is_dir():
+            return []
+
+        manifest = self._read_manifest()
+        sizes = {
+            entry.name: _tree_size(entry)
+            for entry in self.path.iterdir()
+            if entry.is_dir() and not entry.is_symlink()
+        }
+        total = sum(sizes.values())
+
+        protected = set(keep or [])
+        candidates = sorted(
+            (pkg for pkg in sizes if pkg not in protected),
+            key=lambda pkg: manifest.get(pkg, 0.0),
+        )
+
+        evicted: list[str] = []
+        for pkg in candidates:
+            if total <= self.limit_bytes:
+                break
+
+            shutil.rmtree(self.path / pkg, ignore_errors=True)
+            total -= sizes[pkg]
+            manifest.pop(pkg, None)
+            evicted.append(pkg)
+
+        if evicted:
+            self._write_manifest(manifest)
+
+        return evicted
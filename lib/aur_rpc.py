@@ -0,0 +1,163 @@
+"""Client for the AUR RPC ``info`` endpoint with an on-disk response cache."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import json
+from pathlib import Path
+import time
+from urllib.error import URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from lib.target_fs import atomic_write_text
+
+DEFAULT_RPC_URL = "https://aur.archlinux.org/rpc/v5/info"
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "archy" / "aur-rpc.json"
+DEFAULT_TTL_SECONDS = 3600
+
+# The AUR rejects request URIs longer than roughly 4400 characters.
+MAX_QUERY_LENGTH = 4000
+
+
+class AurRpcError(RuntimeError):
+    pass
+
+
+@dataclass
+class AurPackageInfo:
+    name: str
+    package_base: str
+    version: str
+    depends: list[str] = field(default_factory=list)
+    make_depends: list[str] = field(default_factory=list)
+    out_of_date: int | None = None
+
+    @classmethod
+    def from_result(cls, result: dict) -> "AurPackageInfo":
+        return cls(
+            name=result["Name"],
+            package_base=result.get("PackageBase") or result["Name"],
+            version=result.get("Version", ""),
+            depends=list(result.get("Depends") or []),
+            make_depends=list(result.get("MakeDepends") or []),
+            out_of_date=result.get("OutOfDate"),
+        )
+
+
+class AurRpcClient:
+    """
+    Resolve AUR package metadata with as few requests as possible. Every name
+    is sent as an ``arg[]`` of a single multi-info request (split only when the
+    query string would get too long), and both hits and misses are cached on
+    disk for ``ttl`` seconds so repeated lookups stay offline.
+    """
+
+    def __init__(
+        self,
+        url: str = DEFAULT_RPC_URL,
+        *,
+        cache_path: Path | str | None = DEFAULT_CACHE_PATH,
+        ttl: float = DEFAULT_TTL_SECONDS,
+        timeout: float = 30,
+    ):
+        self.url = url
+        self.cache_path = Path(cache_path) if cache_path is not None else None
+        self.ttl = ttl
+        self.timeout = timeout
+        self._cache: dict[str, dict] | None = None
+
+    # -------------------------
+    # Cache
+    # -------------------------
+
+    def _load_cache(self) -> dict[str, dict]:
+        if self._cache is not None:
+            return self._cache
+
+        self._cache = {}
+        if self.cache_path is not None:
+            try:
+                data = json.loads(self.cache_path.read_text())
+            except (OSError, ValueError):
+                data = None
+
+            # Entries from a different endpoint must not leak into this one.
+            if isinstance(data, dict) and data.get("url") == self.url:
+                self._cache = data.get("entries", {})
+
+        return self._cache
+
+    def _save_cache(self):
+        if self.cache_path is None or self._cache is None:
+            return
+
+        payload = {"url": self.url, "entries": self._cache}
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write_text(self.cache_path, json.dumps(payload))
+        except OSError as exc:
+            print(f"Unable to cache AUR metadata at {self.cache_path}: {exc}")
+
+    # -------------------------
+    # Requests
+    # -------------------------
+
+    def _chunks(self, names: list[str]) -> list[list[str]]:
+        chunks: list[list[str]] = []
+        current: list[str] = []
+        length = 0
+
+        for name in names:
+            arg_length = len(urlencode({"arg[]": name})) + 1
+            if current and length + arg_length > MAX_QUERY_LENGTH:
+                chunks.append(current)
+                current, length = [], 0
+            current.append(name)
+            length += arg_length
+
+        if current:
+            chunks.append(current)
+
+        return chunks
+
+    def _request(self, names: list[str]) -> list[dict]:
+        query = urlencode([("arg[]", name) for name in names])
+        try:
+            with urlopen(f"{self.url}?{query}", timeout=self.timeout) as response:
+                data = json.load(response)
+        except (URLError, OSError, ValueError) as exc:
+            raise AurRpcError(f"AUR RPC request failed: {exc}") from exc
+
+        if data.get("type") == "error":
+            raise AurRpcError(f"AUR RPC error: {data.get('error')}")
+
+        return data.get("results", [])
+
+    def info(self, names: list[str]) -> dict[str, AurPackageInfo | None]:
+        """
+        Return metadata for every name in ``names``. Names the AUR does not
+        know map to ``None``. Raises AurRpcError when the endpoint cannot be
+        reached for names that are not cached.
+        """
+        names = list(dict.fromkeys(names))
+        cache = self._load_cache()
+        now = time.time()
+
+        stale = [
+            name for name in names
+            if name not in cache or now - cache[name].get("fetched", 0) > self.ttl
+        ]
+
+        if stale:
+            for chunk in self._chunks(stale):
+                results = {result["Name"]: result for result in self._request(chunk)}
+                for name in chunk:
+                    cache[name] = {"fetched": now, "result": results.get(name)}
+            self._save_cache()
+
+        return {
+            name: AurPackageInfo.from_result(cache[name]["result"])
+            if cache[name]["result"] else None
+            for name in names
+        }
@@ -0,0 +1,218 @@
+"""One snapshot of the host's block devices, mounts and swaps, read from sysfs and procfs."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field, replace
+import os
+from pathlib import Path
+import re
+import threading
+from typing import Optional
+
+from lib.gpt import DiskGeometry
+from lib.runner import get_runner
+
+SYSFS_BLOCK = Path("/sys/block")
+PROC_MOUNTS = Path("/proc/mounts")
+PROC_SWAPS = Path("/proc/swaps")
+# udev's symlinks from filesystem UUIDs to devices; missing without udev
+# and stale until udev has handled a new filesystem, so anything written
+# into the target (boot entries) asks blkid instead.
+DEV_BY_UUID = Path("/dev/disk/by-uuid")
+
+_OCTAL_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+
+def _unescape(field_text: str) -> str:
+    # /proc/mounts and /proc/swaps write spaces, tabs and newlines as \040 etc.
+    return _OCTAL_ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), field_text)
+
+
+def device_name(device: str) -> str:
+    """Kernel name of ``device`` (``/dev/nvme0n1p2`` -> ``nvme0n1p2``), following symlinks."""
+
+    return Path(os.path.realpath(device)).name
+
+
+@dataclass(frozen=True)
+class BlockDevice:
+    """A disk or one of its partitions. ``disk`` is the parent's name for partitions."""
+
+    name: str
+    geometry: DiskGeometry
+    disk: Optional[str] = None
+    partition_number: Optional[int] = None
+    read_only: bool = False
+    mountpoints: tuple[str, ...] = ()
+    swap: bool = False
+    uuid: Optional[str] = None
+
+    @property
+    def path(self) -> str:
+        return f"/dev/{self.name}"
+
+    @property
+    def is_partition(self) -> bool:
+        return self.disk is not None
+
+
+@dataclass(frozen=True)
+class BlockSnapshot:
+    """
+    Every block device with its geometry, partitions, mounts and swap state
+    at one point in time. Reading it costs a few hundred small file reads
+    and no processes; it does not change by itself, so callers that change
+    the devices (attaching a loop device, partprobe, mkfs, mount) refresh it
+    with ``refresh_block_snapshot``.
+    """
+
+    devices: dict[str, BlockDevice] = field(default_factory=dict)
+
+    @classmethod
+    def read(
+        cls,
+        *,
+        sysfs_block: Path | str = SYSFS_BLOCK,
+        mounts: Path | str = PROC_MOUNTS,
+        swaps: Path | str = PROC_SWAPS,
+        by_uuid: Path | str = DEV_BY_UUID,
+    ) -> "BlockSnapshot":
+        sysfs_block = Path(sysfs_block)
+        mountpoints = _read_mounts(Path(mounts))
+        active_swaps = _read_swaps(Path(swaps))
+        uuids = _read_uuids(Path(by_uuid))
+
+        def make(name: str, geometry: DiskGeometry, block: Path, **extra) -> BlockDevice:
+            return BlockDevice(
+                name=name,
+                geometry=geometry,
+                read_only=_read_text(block / "ro") == "1",
+                mountpoints=tuple(sorted(mountpoints.get(name, ()))),
+                swap=name in active_swaps,
+                uuid=uuids.get(name),
+                **extra,
+            )
+
+        devices = {}
+        for block in sorted(sysfs_block.iterdir()) if sysfs_block.is_dir() else ():
+            try:
+                geometry = DiskGeometry.from_sysfs(block.name, sysfs_root=sysfs_block)
+            except ValueError:
+                # Empty devices (unattached loop devices, ejected media).
+                continue
+            if geometry is None:
+                continue
+            devices[block.name] = make(block.name, geometry, block)
+
+            # Partitions are subdirectories with a "partition" file; their
+            # queue limits are the disk's.
+            for child in sorted(block.iterdir()):
+                number = _read_text(child / "partition")
+                size = _read_text(child / "size")
+                if not number or not size:
+                    continue
+                sectors = int(size)
+                if sectors <= 0:
+                    continue
+                part_geometry = replace(geometry, size_bytes=sectors * 512)
+                devices[child.name] = make(
+                    child.name,
+                    part_geometry,
+                    child,
+                    disk=block.name,
+                    partition_number=int(number),
+                )
+
+        return cls(devices)
+
+    def get(self, device: str) -> Optional[BlockDevice]:
+        return self.devices.get(device_name(device))
+
+    def geometry(self, device: str) -> Optional[DiskGeometry]:
+        entry = self.get(device)
+        return entry.geometry if entry else None
+
+    def partitions(self, device: str) -> list[BlockDevice]:
+        """Partitions of the disk ``device`` in partition number order."""
+
+        name = device_name(device)
+        children = [entry for entry in self.devices.values() if entry.disk == name]
+        return sorted(children, key=lambda entry: entry.partition_number)
+
+    def uuid(self, device: str) -> Optional[str]:
+        entry = self.get(device)
+        return entry.uuid if entry else None
+
+    def is_swap(self, device: str) -> bool:
+        entry = self.get(device)
+        return bool(entry and entry.swap)
+
+    def is_mounted(self, path: Path | str) -> bool:
+        """Whether a block device in the snapshot is mounted at ``path``."""
+
+        target = os.path.realpath(path)
+        return any(target in entry.mountpoints for entry in self.devices.values())
+
+
+def _read_text(path: Path) -> str:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return ""
+
+
+def _read_mounts(path: Path) -> dict[str, list[str]]:
+    mounts: dict[str, list[str]] = {}
+    for line in _read_text(path).splitlines():
+        fields = line.split()
+        if len(fields) < 2 or not fields[0].startswith("/dev/"):
+            continue
+        name = device_name(_unescape(fields[0]))
+        mounts.setdefault(name, []).append(_unescape(fields[1]))
+    return mounts
+
+
+def _read_swaps(path: Path) -> set[str]:
+    # The first line is a header; swap files do not live under /dev/.
+    swaps = set()
+    for line in _read_text(path).splitlines()[1:]:
+        fields = line.split()
+        if fields and fields[0].startswith("/dev/"):
+            swaps.add(device_name(_unescape(fields[0])))
+    return swaps
+
+
+def _read_uuids(path: Path) -> dict[str, str]:
+    uuids = {}
+    try:
+        links = list(path.iterdir())
+    except OSError:
+        return uuids
+    for link in links:
+        uuids[device_name(str(link))] = link.name
+    return uuids
+
+
+_snapshot: Optional[BlockSnapshot] = None
+_snapshot_lock = threading.Lock()
+
+
+def refresh_block_snapshot() -> BlockSnapshot:
+    """
+    Re-read the block devices and share the result. A simulated runner gets
+    an empty snapshot, since this machine's devices are not the recorded
+    ones; callers then fall back to asking the runner.
+    """
+    global _snapshot
+    snapshot = BlockSnapshot() if get_runner().simulated else BlockSnapshot.read()
+    with _snapshot_lock:
+        _snapshot = snapshot
+    return snapshot
+
+
+def get_block_snapshot() -> BlockSnapshot:
+    """The shared snapshot, read on first use."""
+
+    with _snapshot_lock:
+        snapshot = _snapshot
+    return snapshot if snapshot is not None else refresh_block_snapshot()
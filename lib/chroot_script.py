@@ -0,0 +1,197 @@
+"""Compile queued chroot commands into one script run by a single arch-chroot."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import os
+from pathlib import Path
+import re
+import secrets
+import shlex
+import sys
+from typing import Optional
+
+from lib.process_helpers import (
+    register_chroot_recorder,
+    report_failure,
+    stream_in_chroot,
+    unregister_chroot_recorder,
+)
+
+SCRIPT_PATH = Path("/root/archy-configure.sh")
+
+
+@dataclass
+class ChrootAction:
+    name: str
+    process: list[str]
+    input: Optional[str] = None
+    unless: Optional[list[str]] = None
+
+
+@dataclass
+class StepResult:
+    name: str
+    status: str
+    returncode: Optional[int] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status in ("ok", "skipped")
+
+
+class ChrootScript:
+    """
+    Record ``chroot_process`` calls as actions and run them as one generated
+    shell script inside a single ``arch-chroot``.
+
+    Every step is wrapped in begin/end markers carrying its exit code, so the
+    script output maps back to per-step results. Steps with an ``unless``
+    check are skipped when the check passes, which keeps the script safe to
+    re-run. Step input (for example ``chpasswd`` secrets) is never written to
+    the script: all inputs are concatenated on the script's stdin and each
+    step reads exactly its own byte count with ``head -c``.
+    """
+
+    def __init__(self, root_path: Path | str = "/mnt"):
+        self.root_path = Path(root_path)
+        self.actions: list[ChrootAction] = []
+        self._marker = f"__ARCHY_STEP_{secrets.token_hex(8)}__"
+
+    def __enter__(self) -> "ChrootScript":
+        self.start_recording()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop_recording()
+
+    def start_recording(self):
+        register_chroot_recorder(self.root_path, self)
+
+    def stop_recording(self):
+        unregister_chroot_recorder(self.root_path)
+
+    def add(
+        self,
+        name: str,
+        process: list[str],
+        *,
+        input: Optional[str] = None,
+        unless: Optional[list[str]] = None,
+    ):
+        print(f"Queued chroot step {name}: {' '.join(process)}")
+        self.actions.append(ChrootAction(name, list(process), input, unless))
+
+    # -------------------------
+    # Rendering
+    # -------------------------
+
+    def render(self) -> str:
+        marker = self._marker
+        lines = [
+            "#!/bin/bash",
+            "# Generated by archy. Each step is idempotent; re-running is safe.",
+            "set -u",
+            "",
+        ]
+
+        # Markers carry the step index so repeated names stay distinct.
+        for index, action in enumerate(self.actions):
+            name = f"{index} {shlex.quote(action.name)}"
+            command = shlex.join(action.process)
+            if action.input is not None:
+                command = f"head -c {len(action.input.encode())} | {command}"
+            else:
+                command = f"{command} </dev/null"
+
+            lines.append(f"printf '%s begin %s %s\\n' {marker} {name}")
+            if action.unless:
+                lines.append(f"if {shlex.join(action.unless)} >/dev/null 2>&1 </dev/null; then")
+                lines.append(f"    printf '%s skip %s %s\\n' {marker} {name}")
+                lines.append("else")
+                lines.append(f"    {command}")
+                lines.append("    rc=$?")
+                lines.append(f"    printf '%s end %s %s %s\\n' {marker} {name} \"$rc\"")
+                lines.append("    [ \"$rc\" -eq 0 ] || exit \"$rc\"")
+                lines.append("fi")
+            else:
+                lines.append(command)
+                lines.append("rc=$?")
+                lines.append(f"printf '%s end %s %s %s\\n' {marker} {name} \"$rc\"")
+                lines.append("[ \"$rc\" -eq 0 ] || exit \"$rc\"")
+            lines.append("")
+
+        return "\n".join(lines)
+
+    def stdin_payload(self) -> str:
+        return "".join(action.input for action in self.actions if action.input is not None)
+
+    # -------------------------
+    # Execution
+    # -------------------------
+
+    def parse_results(self, output: list[str]) -> list[StepResult]:
+        pattern = re.compile(rf"{self._marker} (begin|skip|end) (\d+) \S+(?: (\d+))?")
+        seen: dict[int, StepResult] = {}
+
+        for line in output:
+            match = pattern.search(line)
+            if not match:
+                continue
+
+            event, index, code = match.groups()
+            index = int(index)
+            if index >= len(self.actions):
+                continue
+
+            name = self.actions[index].name
+            if event == "begin":
+                seen[index] = StepResult(name, "incomplete")
+            elif event == "skip":
+                seen[index] = StepResult(name, "skipped", 0)
+            else:
+                seen[index] = StepResult(name, "ok" if code == "0" else "failed", int(code))
+
+        return [
+            seen.get(index, StepResult(action.name, "not run"))
+            for index, action in enumerate(self.actions)
+        ]
+
+    def run(self) -> list[StepResult]:
+        if not self.actions:
+            return []
+
+        host_script = self.root_path / SCRIPT_PATH.relative_to("/")
+        host_script.parent.mkdir(parents=True, exist_ok=True)
+        host_script.write_text(self.render())
+        os.chmod(host_script, 0o700)
+
+        process = ["/bin/bash", str(SCRIPT_PATH)]
+        payload = self.stdin_payload()
+        print(f"Running {len(self.actions)} chroot steps in one script: {SCRIPT_PATH}")
+
+        result = stream_in_chroot(self.root_path, process, input=payload, label="configure")
+
+        # The log keeps every marker even when the in-memory tail does not.
+        output = result.tail
+        if result.log_path and result.log_path.exists():
+            output = result.log_path.read_text(errors="replace").splitlines()
+
+        steps = self.parse_results(output)
+        for step in steps:
+            print(f"  {step.status:>10}  {step.name}")
+
+        if result.returncode != 0:
+            report_failure(["arch-chroot", str(self.root_path), *process], result)
+        else:
+            # Kept on failure so the remaining steps can be inspected or re-run.
+            host_script.unlink(missing_ok=True)
+
+        return steps
+
+    def run_or_exit(self):
+        steps = self.run()
+        if any(not step.ok for step in steps):
+            failed = [step.name for step in steps if step.status in ("failed", "incomplete")]
+            print(f"Chroot configuration failed at: {', '.join(failed) or 'unknown step'}", file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,310 @@
+"""Long-lived ``arch-chroot`` servers that run many commands."""
+
+from __future__ import annotations
+
+import base64
+from pathlib import Path
+import secrets
+import subprocess
+import threading
+import time
+from typing import Callable, Optional
+
+from lib.process_helpers import (
+    OutputSink,
+    StreamResult,
+    register_chroot_session,
+    trace_captured,
+    unregister_chroot_session,
+)
+from lib.runner import get_runner
+
+# Upper bound on concurrently running commands; further callers wait.
+DEFAULT_MAX_SERVERS = 8
+
+# Runs inside the chroot. Each request is one line: "<id> <mode> <argv>
+# <stdin>", where argv is the NUL-joined argument list and stdin the
+# command's input, both base64 encoded so arbitrary bytes (and secrets) never
+# touch argv or a file. In mode "s" stderr is merged onto stdout; in mode "c"
+# it is collected and sent base64 encoded as "<marker>err <data>". Every
+# command is followed by "<marker>cpu <user> <sys>" (from bash's ``time``)
+# and "<marker> <id> <rc>".
+_SERVER_SCRIPT = r"""
+marker="$1"
+TIMEFORMAT="${marker}cpu %3U %3S"
+exec 3>&1
+while IFS=' ' read -r id mode argv input; do
+    mapfile -d '' -t args < <(printf '%s' "$argv" | base64 -d)
+    if [[ $mode == c ]]; then
+        errfile=$(mktemp)
+        { time printf '%s' "$input" | base64 -d | ( "${args[@]}" ) 2>"$errfile" 3>&-; } 2>&3
+        rc=$?
+        printf '%serr %s\n' "$marker" "$(base64 -w0 <"$errfile")"
+        rm -f "$errfile"
+    else
+        { time printf '%s' "$input" | base64 -d | ( "${args[@]}" ) 2>&1 3>&-; } 2>&3
+        rc=$?
+    fi
+    printf '%s %s %s\n' "$marker" "$id" "$rc"
+done
+"""
+
+
+def _encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _parse_cpu(fields: list[str]) -> Optional[tuple[float, float]]:
+    try:
+        # The radix follows the chroot's locale.
+        user, system = (float(value.replace(",", ".")) for value in fields)
+    except ValueError:
+        return None
+    return user, system
+
+
+class _Server:
+    """
+    One shell running the request loop inside the target; runs one command
+    at a time. The session's first server is an ``arch-chroot`` that sets up
+    (and on exit tears down) the target's API filesystems; the others are
+    plain ``chroot`` shells that use those mounts and add none of their own.
+    """
+
+    def __init__(self, root_path: Path, marker: str, *, owner: bool):
+        self.marker = marker
+        self.owner = owner
+        self.process = subprocess.Popen(
+            [
+                "arch-chroot" if owner else "chroot",
+                str(root_path),
+                "/bin/bash",
+                "-c",
+                _SERVER_SCRIPT,
+                "archy-chroot-session",
+                marker,
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+            bufsize=1,
+        )
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(
+        self,
+        request_id: str,
+        process: list[str],
+        *,
+        input: Optional[str],
+        capture: bool,
+        on_output: Callable[[str], None],
+    ) -> tuple[int, Optional[tuple[float, float]], str]:
+        """
+        Send one request and pass its output to ``on_output`` as it arrives.
+        Returns the exit code, CPU times and (when capturing) stderr.
+        """
+        argv = _encode(b"\0".join(arg.encode() for arg in process))
+        stdin = _encode((input or "").encode())
+        mode = "c" if capture else "s"
+
+        self.process.stdin.write(f"{request_id} {mode} {argv} {stdin}\n")
+        self.process.stdin.flush()
+        cpu = None
+        stderr = ""
+
+        for line in self.process.stdout:
+            index = line.find(self.marker)
+            if index == -1:
+                on_output(line)
+                continue
+
+            # Output without a trailing newline shares the marker's line.
+            if index > 0:
+                on_output(line[:index])
+
+            fields = line[index + len(self.marker):].split()
+            if fields and fields[0] == "cpu":
+                cpu = _parse_cpu(fields[1:])
+                continue
+            if fields and fields[0] == "err":
+                stderr = base64.b64decode("".join(fields[1:])).decode(errors="replace")
+                continue
+
+            done_id, returncode = fields
+            if done_id == request_id:
+                return int(returncode), cpu, stderr
+
+        # The server exited mid-command (for example arch-chroot died).
+        return self.process.wait() or 1, cpu, stderr
+
+    def close(self):
+        if self.process.stdin:
+            self.process.stdin.close()
+        self.process.wait()
+
+
+class ChrootSession:
+    """
+    Keep one ``arch-chroot`` (and its proc/sys/dev/tmp/run mounts) alive for
+    the whole configuration stage and feed it commands over pipes.
+
+    While started, ``chroot_process``, ``ChrootScript`` and
+    ``PackageInstaller`` route their commands for ``root_path`` through the
+    session automatically. Each concurrent caller (package lanes, parallel
+    AUR builds, configuration phases) gets a server of its own: an idle one
+    or, up to ``max_servers``, a newly started one; beyond that callers wait.
+    Only the first server is an ``arch-chroot``. Another one would mount a
+    fresh /tmp, /dev/shm and /dev over the running commands' and hide their
+    temporary files, so the others are plain ``chroot`` shells sharing the
+    first one's mounts. Servers only exit in ``close``, once every command
+    has finished, the ``arch-chroot`` last, since its exit unmounts the
+    filesystems every server uses.
+    """
+
+    def __init__(self, root_path: Path | str = "/mnt", *, max_servers: int = DEFAULT_MAX_SERVERS):
+        self.root_path = Path(root_path)
+        self.max_servers = max(1, max_servers)
+        self._marker = f"__ARCHY_DONE_{secrets.token_hex(8)}__"
+        self._servers: list[_Server] = []
+        self._idle: list[_Server] = []
+        self._condition = threading.Condition()
+        self._started = False
+        self._next_id = 0
+
+    def __enter__(self) -> "ChrootSession":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def alive(self) -> bool:
+        with self._condition:
+            return self._started and any(server.alive for server in self._servers)
+
+    def start(self):
+        with self._condition:
+            if self._started:
+                return
+
+            if not get_runner().allow_direct:
+                # Recorded and replayed runs need every command to go through
+                # the runner, so callers fall back to one arch-chroot each.
+                print("Command runner does not allow a persistent chroot session; running commands one by one")
+                return
+
+            server = _Server(self.root_path, self._marker, owner=True)
+            self._servers.append(server)
+            self._idle.append(server)
+            self._started = True
+
+        register_chroot_session(self.root_path, self)
+
+    def _acquire(self) -> Optional[tuple[_Server, str]]:
+        with self._condition:
+            while True:
+                if not self._started:
+                    return None
+
+                while self._idle:
+                    server = self._idle.pop()
+                    if server.alive:
+                        break
+                    self._servers.remove(server)
+                else:
+                    server = None
+
+                if server is None and len(self._servers) < self.max_servers:
+                    # Extra servers rely on the arch-chroot's mounts.
+                    if not any(running.owner and running.alive for running in self._servers):
+                        return None
+                    server = _Server(self.root_path, self._marker, owner=False)
+                    self._servers.append(server)
+
+                if server is not None:
+                    self._next_id += 1
+                    return server, str(self._next_id)
+
+                self._condition.wait()
+
+    def _release(self, server: _Server):
+        with self._condition:
+            if server.alive:
+                self._idle.append(server)
+            else:
+                self._servers.remove(server)
+            self._condition.notify_all()
+
+        if server.owner and not server.alive:
+            # The arch-chroot has torn the mounts down; the other servers
+            # cannot run anything useful without them.
+            unregister_chroot_session(self.root_path)
+
+    def run(
+        self,
+        process: list[str],
+        *,
+        input: Optional[str] = None,
+        label: Optional[str] = None,
+        log_name: Optional[str] = None,
+    ) -> Optional[StreamResult]:
+        """
+        Run ``process`` inside the chroot and stream its output, waiting for a
+        free server. Returns None when the session is not running.
+        """
+        acquired = self._acquire()
+        if acquired is None:
+            return None
+
+        server, request_id = acquired
+        try:
+            sink = OutputSink(["arch-chroot", str(self.root_path), *process], label=label, log_name=log_name)
+            returncode, cpu, _ = server.run(request_id, process, input=input, capture=False, on_output=sink.line)
+            return sink.close(returncode, cpu=cpu)
+        finally:
+            self._release(server)
+
+    def capture(self, process: list[str], *, input: Optional[str] = None) -> Optional[subprocess.CompletedProcess]:
+        """
+        Like ``lib.process_helpers.run_captured`` for a command inside the
+        chroot: stdout and stderr are returned, not shown. Returns None when
+        the session is not running.
+        """
+        acquired = self._acquire()
+        if acquired is None:
+            return None
+
+        server, request_id = acquired
+        chroot_cmd = ["arch-chroot", str(self.root_path), *process]
+        chunks: list[str] = []
+        started = time.perf_counter()
+        try:
+            returncode, cpu, stderr = server.run(request_id, process, input=input, capture=True, on_output=chunks.append)
+        finally:
+            self._release(server)
+
+        stdout = "".join(chunks)
+        trace_captured(chroot_cmd, started, returncode=returncode, cpu=cpu, output=stdout + stderr)
+        return subprocess.CompletedProcess(chroot_cmd, returncode, stdout, stderr)
+
+    def close(self):
+        unregister_chroot_session(self.root_path)
+
+        with self._condition:
+            self._started = False
+            # Let running commands finish before the arch-chroot tears down.
+            while len(self._idle) < len(self._servers):
+                self._condition.wait()
+            servers, self._servers, self._idle = self._servers, [], []
+
+        # The arch-chroot started first and goes last, after every shell
+        # that uses its mounts.
+        for server in reversed(servers):
+            server.close()
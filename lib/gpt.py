@@ -0,0 +1,216 @@
+"""Sector-exact GPT partition layouts computed before anything is written."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from math import lcm
+from pathlib import Path
+from typing import Optional
+
+SYSFS_CLASS_BLOCK = Path("/sys/class/block")
+
+# The kernel reports a block device's size in 512-byte units regardless of
+# its logical sector size.
+SYSFS_SECTOR_BYTES = 512
+
+# Partition starts are aligned to 1 MiB, as sgdisk, parted and fdisk do.
+DEFAULT_ALIGNMENT_BYTES = 1024**2
+
+# A standard GPT: 128 entries of 128 bytes, stored after the primary header
+# and again before the backup header at the end of the disk.
+GPT_ENTRIES = 128
+GPT_ENTRY_BYTES = 128
+
+
+@dataclass(frozen=True)
+class DiskGeometry:
+    """
+    What the planner needs to know about a disk. ``alignment_offset`` is the
+    byte offset of the first naturally aligned sector, which a few drives
+    with 512-byte emulation report as non-zero.
+    """
+
+    size_bytes: int
+    logical_sector_size: int = 512
+    physical_sector_size: int = 4096
+    alignment_offset: int = 0
+    optimal_io_size: int = 0
+
+    @classmethod
+    def from_sysfs(cls, device: str, *, sysfs_root: Path | str = SYSFS_CLASS_BLOCK) -> Optional["DiskGeometry"]:
+        """Read ``/sys/class/block/<name>``; None when the device is not there."""
+
+        block = Path(sysfs_root) / Path(device).name
+
+        def read_int(relative: str, default: int = 0) -> int:
+            try:
+                return int((block / relative).read_text().strip())
+            except (OSError, ValueError):
+                return default
+
+        try:
+            sectors = int((block / "size").read_text().strip())
+        except (OSError, ValueError):
+            return None
+
+        return cls(
+            size_bytes=sectors * SYSFS_SECTOR_BYTES,
+            logical_sector_size=read_int("queue/logical_block_size", 512),
+            physical_sector_size=read_int("queue/physical_block_size", 512),
+            alignment_offset=read_int("alignment_offset"),
+            optimal_io_size=read_int("queue/optimal_io_size"),
+        )
+
+    def __post_init__(self):
+        lss = self.logical_sector_size
+        if lss < 512 or lss & (lss - 1):
+            raise ValueError(f"Invalid logical sector size: {lss}")
+        if self.physical_sector_size < lss or self.physical_sector_size % lss:
+            raise ValueError(f"Invalid physical sector size: {self.physical_sector_size}")
+        if self.size_bytes < lss:
+            raise ValueError(f"Invalid disk size: {self.size_bytes}")
+
+    @property
+    def total_sectors(self) -> int:
+        return self.size_bytes // self.logical_sector_size
+
+    @property
+    def alignment_sectors(self) -> int:
+        """Partition start alignment in logical sectors (1 MiB or a multiple)."""
+
+        alignment = lcm(DEFAULT_ALIGNMENT_BYTES, self.physical_sector_size)
+        # Some RAID and SSD devices advertise an optimal I/O size that 1 MiB
+        # is not a multiple of; honour it unless it is absurd.
+        if self.optimal_io_size and self.optimal_io_size % self.logical_sector_size == 0:
+            combined = lcm(alignment, self.optimal_io_size)
+            if combined <= 16 * DEFAULT_ALIGNMENT_BYTES:
+                alignment = combined
+        return alignment // self.logical_sector_size
+
+    @property
+    def entry_sectors(self) -> int:
+        return -(-GPT_ENTRIES * GPT_ENTRY_BYTES // self.logical_sector_size)
+
+    @property
+    def first_usable(self) -> int:
+        # Protective MBR, primary header, then the entry array.
+        return 2 + self.entry_sectors
+
+    @property
+    def last_usable(self) -> int:
+        # The backup entry array and header occupy the end of the disk.
+        return self.total_sectors - 2 - self.entry_sectors
+
+
+@dataclass(frozen=True)
+class PartitionExtent:
+    number: int
+    partition: object
+    first_lba: int
+    last_lba: int
+
+    @property
+    def sectors(self) -> int:
+        return self.last_lba - self.first_lba + 1
+
+
+@dataclass(frozen=True)
+class GptLayout:
+    geometry: DiskGeometry
+    extents: tuple[PartitionExtent, ...]
+
+    def size_bytes(self, extent: PartitionExtent) -> int:
+        return extent.sectors * self.geometry.logical_sector_size
+
+    def validate(self):
+        """Raise ValueError unless every extent is aligned, in bounds and disjoint."""
+
+        geometry = self.geometry
+        alignment = geometry.alignment_sectors
+        offset = _offset_sectors(geometry)
+        previous_end = geometry.first_usable - 1
+
+        if len(self.extents) > GPT_ENTRIES:
+            raise ValueError(f"A GPT holds at most {GPT_ENTRIES} partitions")
+
+        for extent in sorted(self.extents, key=lambda e: e.first_lba):
+            if extent.first_lba <= previous_end:
+                raise ValueError(f"Partition {extent.number} overlaps the previous partition or GPT header")
+            if extent.last_lba < extent.first_lba:
+                raise ValueError(f"Partition {extent.number} is empty")
+            if extent.last_lba > geometry.last_usable:
+                raise ValueError(f"Partition {extent.number} ends past the last usable sector {geometry.last_usable}")
+            if (extent.first_lba + offset) % alignment:
+                raise ValueError(f"Partition {extent.number} start {extent.first_lba} is not aligned")
+            previous_end = extent.last_lba
+
+
+def _offset_sectors(geometry: DiskGeometry) -> int:
+    return geometry.alignment_offset // geometry.logical_sector_size
+
+
+def _align_up(lba: int, alignment: int, offset: int) -> int:
+    return -(-(lba + offset) // alignment) * alignment - offset
+
+
+def _align_down(lba: int, alignment: int, offset: int) -> int:
+    return (lba + offset) // alignment * alignment - offset
+
+
+def plan_layout(geometry: DiskGeometry, sizes: list[tuple[object, Optional[int]]]) -> GptLayout:
+    """
+    Place ``sizes`` (``(partition, bytes)`` pairs, bytes None for the single
+    fill partition) on the disk in order, numbered from 1. Every partition
+    starts on an alignment boundary and gets exactly its requested size
+    rounded up to whole sectors. Partitions after the fill one are packed
+    against the end of the disk, and the fill partition takes everything
+    between. Raises ValueError when the layout does not fit.
+    """
+    lss = geometry.logical_sector_size
+    alignment = geometry.alignment_sectors
+    offset = _offset_sectors(geometry)
+
+    fills = [index for index, (_, size) in enumerate(sizes) if size is None]
+    if len(fills) > 1:
+        raise ValueError("Only one 'fill' partition is allowed on a disk")
+    fill_index = fills[0] if fills else len(sizes)
+
+    extents: list[Optional[PartitionExtent]] = [None] * len(sizes)
+
+    # Partitions before the fill partition, from the front.
+    cursor = geometry.first_usable
+    for index in range(fill_index):
+        partition, size = sizes[index]
+        if size <= 0:
+            raise ValueError(f"Partition {index + 1} has no size")
+        first = _align_up(cursor, alignment, offset)
+        last = first + -(-size // lss) - 1
+        extents[index] = PartitionExtent(index + 1, partition, first, last)
+        cursor = last + 1
+
+    # Partitions after it, from the back, so their sizes stay exact.
+    end = geometry.last_usable
+    for index in range(len(sizes) - 1, fill_index, -1):
+        partition, size = sizes[index]
+        if size <= 0:
+            raise ValueError(f"Partition {index + 1} has no size")
+        first = _align_down(end + 1 - -(-size // lss), alignment, offset)
+        last = first + -(-size // lss) - 1
+        extents[index] = PartitionExtent(index + 1, partition, first, last)
+        end = first - 1
+
+    if fills:
+        partition = sizes[fill_index][0]
+        first = _align_up(cursor, alignment, offset)
+        if first > end:
+            raise ValueError("No space left for 'fill' partition")
+        extents[fill_index] = PartitionExtent(fill_index + 1, partition, first, end)
+    elif cursor - 1 > geometry.last_usable:
+        raise ValueError("Partition sizes exceed disk size")
+
+    if fills and any(e.first_lba < geometry.first_usable for e in extents[fill_index + 1:]):
+        raise ValueError("Partition sizes exceed disk size")
+
+    layout = GptLayout(geometry, tuple(extents))
+    layout.validate()
+    return layout
@@ -2,17 +2,19 @@ from __future__ import annotations
 
 from pathlib import Path
 import shutil
-import subprocess
+import time
 
-from lib.models import SystemSettings
-from lib.process_helpers import chroot_process, run_process_exit_on_fail
+from lib.aur_rpc import AurRpcClient, AurRpcError
+from lib.models import PackageGroup, SystemSettings
+from lib.models.packages import read_package_file
+from lib.process_helpers import chroot_process, run_captured, run_process_exit_on_fail
 
 
 def vefity_internet() -> bool:
     """Check whether the host has Internet connectivity."""
 
     command = ["ping", "-c", "1", "archlinux.org"]
-    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    result = run_captured(command)
     return result.returncode == 0
 
 
@@ -29,6 +31,37 @@ def select_package_user(system: SystemSettings) -> str:
     return system.users[0].username
 
 
+def preflight_aur_groups(groups: list[PackageGroup], client: AurRpcClient) -> bool:
+    """
+    Resolve the AUR packages of every group in one batch and print missing or
+    out-of-date packages. Returns False only when packages are missing from
+    the AUR; an unreachable endpoint skips the check.
+    """
+    names = [name for group in groups if group.aur for name in read_package_file(group.aur)]
+    if not names:
+        return True
+
+    try:
+        infos = client.info(names)
+    except AurRpcError as exc:
+        print(f"{exc}; skipping AUR package check.")
+        return True
+
+    missing = [name for name, info in infos.items() if info is None]
+    outdated = [info for info in infos.values() if info and info.out_of_date]
+
+    for info in outdated:
+        flagged = time.strftime("%Y-%m-%d", time.gmtime(info.out_of_date))
+        print(f"AUR package {info.name} {info.version} was flagged out of date on {flagged}")
+
+    if missing:
+        print(f"Packages not found in the AUR: {', '.join(missing)}")
+        return False
+
+    print(f"All {len(infos)} AUR packages resolve against the AUR.")
+    return True
+
+
 def apply_dotfiles(
     entries: list[dict],
     base_dirs: list[Path],
@@ -0,0 +1,90 @@
+"""Persistent record of finished install phases, kept on the target disk."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+import threading
+import time
+from typing import Optional
+
+from lib.target_fs import atomic_write_text
+
+JOURNAL_PATH = Path("var/lib/archy/journal.json")
+JOURNAL_VERSION = 1
+
+
+def fingerprint(inputs: object) -> str:
+    """A stable digest of a phase's inputs (any JSON-able or repr-able value)."""
+
+    payload = json.dumps(inputs, sort_keys=True, default=repr)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class InstallJournal:
+    """
+    Phases finished so far, with a fingerprint of the inputs each one ran
+    with, stored in ``<root>/var/lib/archy/journal.json``.
+
+    The target root is only mounted a few phases into an install, so entries
+    are kept in memory until ``attach`` is called after mounting; from then
+    on every change is written through atomically.
+    """
+
+    def __init__(self, root_path: Path | str = "/mnt"):
+        self.root_path = Path(root_path)
+        self.path = self.root_path / JOURNAL_PATH
+        self.phases: dict[str, dict] = {}
+        self.attached = False
+        self._lock = threading.Lock()
+
+    def load(self) -> bool:
+        """Read an existing journal. Returns False when there is none."""
+
+        try:
+            data = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as exc:
+            print(f"Ignoring unreadable install journal {self.path}: {exc}")
+            return False
+
+        if data.get("version") != JOURNAL_VERSION:
+            print(f"Ignoring install journal {self.path} with unknown version {data.get('version')}")
+            return False
+
+        with self._lock:
+            self.phases = {**data.get("phases", {}), **self.phases}
+            self.attached = True
+        return True
+
+    def attach(self):
+        """Start persisting; call once the target root is mounted."""
+
+        with self._lock:
+            if self.attached:
+                return
+            self.attached = True
+            self._save()
+
+    def is_done(self, name: str, inputs: object = None) -> bool:
+        with self._lock:
+            entry = self.phases.get(name)
+        return entry is not None and entry.get("inputs") == fingerprint(inputs)
+
+    def mark_done(self, name: str, inputs: object = None, *, duration: Optional[float] = None):
+        with self._lock:
+            self.phases[name] = {
+                "inputs": fingerprint(inputs),
+                "finished": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "duration": round(duration, 3) if duration is not None else None,
+            }
+            self._save()
+
+    def _save(self):
+        if not self.attached:
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(self.path, json.dumps({"version": JOURNAL_VERSION, "phases": self.phases}, indent=2))
@@ -0,0 +1,87 @@
+"""Disk images attached to loop devices, so the storage path runs without a spare disk."""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import subprocess
+from typing import Optional
+
+from lib.block_inventory import refresh_block_snapshot
+from lib.models.disk import Disk
+from lib.models.partition import parse_size
+from lib.process_helpers import run_captured
+from lib.runner import get_runner
+
+
+def create_image(path: str | Path, size: str):
+    """Create a sparse image of ``size`` (e.g. ``8G``); blocks are only allocated when written."""
+
+    path = Path(path)
+    with open(path, "xb"):
+        pass
+    os.truncate(path, parse_size(size))
+    print(f"Created sparse image {path} ({size})")
+
+
+def find_loop(path: str | Path) -> Optional[str]:
+    """The loop device ``path`` is already attached to, if any."""
+
+    result = run_captured(["losetup", "--associated", str(path)])
+    if result.returncode != 0:
+        return None
+    for line in result.stdout.splitlines():
+        device = line.split(":", 1)[0].strip()
+        if device.startswith("/dev/"):
+            return device
+    return None
+
+
+def attach_image(path: str | Path) -> str:
+    """
+    Attach ``path`` to a free loop device with partition scanning, so its
+    partitions show up as ``/dev/loopNpM`` after ``partprobe``. An image that
+    is already attached keeps its loop device.
+    """
+    device = find_loop(path)
+    if device:
+        return device
+
+    try:
+        result = run_captured(["losetup", "--find", "--show", "--partscan", str(path)], check=True)
+    except subprocess.CalledProcessError as exc:
+        raise RuntimeError(f"Failed to attach {path}: {exc.stderr.strip()}") from exc
+
+    device = result.stdout.strip()
+    if not device.startswith("/dev/"):
+        raise RuntimeError(f"losetup did not report a loop device for {path}")
+    print(f"Attached {path} to {device}")
+    return device
+
+
+def detach(device: str):
+    run_captured(["losetup", "--detach", device], check=True)
+
+
+def attach_images(disks: list[Disk]):
+    """
+    Attach every image disk that is not attached yet, creating missing
+    images from their ``image_size``. Block devices are left alone.
+    """
+    attached = False
+    for disk in disks:
+        if not disk.is_image or disk.block_device:
+            continue
+
+        # A replayed install answers losetup from the recording and must
+        # not create files on this machine.
+        if not Path(disk.device).exists() and not get_runner().simulated:
+            if not disk.image_size:
+                raise RuntimeError(f"Disk image {disk.device} does not exist and has no image_size")
+            create_image(disk.device, disk.image_size)
+
+        disk.attach(attach_image(disk.device))
+        attached = True
+
+    if attached:
+        refresh_block_snapshot()
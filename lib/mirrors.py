@@ -0,0 +1,186 @@
+"""Rank pacman mirrors by measured latency and download speed."""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+import time
+from urllib.error import URLError
+from urllib.request import urlopen
+
+from lib.runner import get_runner
+
+MIRRORLIST_PATH = Path("/etc/pacman.d/mirrorlist")
+PROBE_REPO = "core"
+PROBE_ARCH = "x86_64"
+
+
+@dataclass
+class MirrorResult:
+    server: str
+    latency: float | None = None
+    download: float | None = None
+    size: int = 0
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.latency is not None
+
+    @property
+    def score(self) -> float:
+        """Seconds spent on the probes; lower is better."""
+
+        if not self.ok:
+            return float("inf")
+        return self.latency + (self.download if self.download is not None else 0.0)
+
+
+def parse_mirrorlist(text: str) -> list[str]:
+    """Return every ``Server =`` URL, including commented-out candidates."""
+
+    servers: dict[str, None] = {}
+    for line in text.splitlines():
+        line = line.strip().lstrip("#").strip()
+        key, sep, value = line.partition("=")
+        if sep and key.strip() == "Server":
+            servers.setdefault(value.strip())
+
+    return list(servers)
+
+
+def _mirror_root(server: str) -> str:
+    root = server.split("$repo", 1)[0]
+    return root if root.endswith("/") else f"{root}/"
+
+
+def _database_url(server: str) -> str:
+    url = server.replace("$repo", PROBE_REPO).replace("$arch", PROBE_ARCH).rstrip("/")
+    return f"{url}/{PROBE_REPO}.db"
+
+
+def _timed_fetch(url: str, timeout: float) -> tuple[float, int]:
+    start = time.perf_counter()
+    size = 0
+    with urlopen(url, timeout=timeout) as response:
+        while chunk := response.read(64 * 1024):
+            size += len(chunk)
+    return time.perf_counter() - start, size
+
+
+def probe_latency(server: str, *, timeout: float = 5) -> MirrorResult:
+    """Time a fetch of the mirror's tiny ``lastsync`` file."""
+
+    result = MirrorResult(server)
+    try:
+        result.latency, _ = _timed_fetch(f"{_mirror_root(server)}lastsync", timeout)
+    except (URLError, OSError, ValueError) as exc:
+        result.error = str(exc)
+    return result
+
+
+def probe_download(result: MirrorResult, *, timeout: float = 10) -> MirrorResult:
+    """Time a fetch of the core sync database to estimate throughput."""
+
+    try:
+        result.download, result.size = _timed_fetch(_database_url(result.server), timeout)
+    except (URLError, OSError, ValueError) as exc:
+        result.error = str(exc)
+    return result
+
+
+def rank_mirrors(
+    servers: list[str],
+    *,
+    count: int = 10,
+    workers: int = 16,
+    timeout: float = 5,
+) -> list[MirrorResult]:
+    """
+    Probe ``servers`` concurrently and return the reachable ones, fastest
+    first. Every mirror gets the cheap latency probe; only the quickest few
+    are asked for the core database, which dominates real sync times.
+    """
+    if not servers:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(servers))) as pool:
+        results = list(pool.map(lambda server: probe_latency(server, timeout=timeout), servers))
+
+        reachable = sorted((r for r in results if r.ok), key=lambda r: r.latency)
+        finalists = reachable[: max(count * 3, 20)]
+        list(pool.map(lambda r: probe_download(r, timeout=timeout * 2), finalists))
+
+    ranked = sorted((r for r in finalists if r.ok), key=lambda r: r.score)
+    return ranked[:count]
+
+
+def render_mirrorlist(results: list[MirrorResult]) -> str:
+    lines = [
+        "# Generated by archy: mirrors ranked by measured latency and core.db download time",
+        "",
+    ]
+    for result in results:
+        speed = f"{result.size / result.download / 1024:.0f} KiB/s" if result.download else "n/a"
+        lines.append(f"# latency {result.latency * 1000:.0f} ms, {speed}")
+        lines.append(f"Server = {result.server}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_ranked_mirrorlist(
+    path: Path | str = MIRRORLIST_PATH,
+    *,
+    count: int = 10,
+    timeout: float = 5,
+) -> bool:
+    """
+    Rank the servers listed in ``path`` and rewrite it with the fastest
+    ``count`` mirrors. The original list is kept untouched when no mirror
+    answers.
+    """
+    path = Path(path)
+    runner = get_runner()
+    servers = parse_mirrorlist(runner.read_text(path))
+    print(f"Ranking {len(servers)} mirrors from {path}...")
+
+    ranked = rank_mirrors(servers, count=count, timeout=timeout)
+    if not ranked:
+        print("No mirror responded; keeping the existing mirrorlist.")
+        return False
+
+    for result in ranked:
+        print(f"  {result.score:6.2f}s  {result.server}")
+
+    runner.write_text(path, render_mirrorlist(ranked))
+    return True
+
+
+def rotate_mirrorlist(path: Path | str = MIRRORLIST_PATH) -> str | None:
+    """
+    Move the first active ``Server =`` line behind the last one so pacman
+    starts with the next mirror. Returns the new first server, or None when
+    the file lists fewer than two active mirrors.
+    """
+    path = Path(path)
+    runner = get_runner()
+    try:
+        lines = runner.read_text(path).splitlines()
+    except OSError:
+        return None
+
+    active = []
+    for index, line in enumerate(lines):
+        key, sep, value = line.strip().partition("=")
+        if sep and key.strip() == "Server":
+            active.append((index, value.strip()))
+
+    if len(active) < 2:
+        return None
+
+    first = lines.pop(active[0][0])
+    lines.insert(active[-1][0], first)
+
+    runner.write_text(path, "\n".join(lines) + "\n")
+    return active[1][1]
@@ -2,6 +2,7 @@ from .disk import Disk
 from .partition import Partition
 from .system import SystemSettings, User
 from .packages import PackageInstaller, PackageGroup
+from .options import InstallOptions
 
 __all__ = [
     "Disk",
@@ -10,4 +11,5 @@ __all__ = [
     "User",
     "PackageInstaller",
     "PackageGroup",
+    "InstallOptions",
 ]
@@ -1,18 +1,33 @@
-from dataclasses import dataclass
-from .partition import Partition
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from lib.gpt import DiskGeometry, GptLayout, plan_layout
+from .partition import Partition, parse_size, partition_device
 
 
 @dataclass
 class Disk:
+    """
+    A disk to partition: a block device under ``/dev/`` or an absolute path
+    to a disk image file, which is attached to a loop device (see
+    ``lib.loopdev``) before anything is written to it.
+    """
+
     device: str
     wipe: bool
     partitions: list[Partition]
+    # Size of the sparse file created when an image does not exist yet.
+    image_size: Optional[str] = None
+    # The loop device an image is attached to; None until then.
+    block_device: Optional[str] = field(default=None, repr=False, compare=False)
 
     @classmethod
     def from_config(cls, config: dict) -> "Disk":
         return cls(
             device=config["disk"],
             wipe=config["wipe"],
+            image_size=config.get("image_size"),
             partitions=[
                 Partition.from_config(part, config["disk"], index + 1)
                 for index, part in enumerate(config["partitions"])
@@ -24,9 +39,14 @@ class Disk:
         return [cls.from_config(disk) for disk in storage]
 
     def __post_init__(self):
-        if not self.device.startswith("/dev/"):
+        if not self.device.startswith("/dev/") and not Path(self.device).is_absolute():
             raise ValueError(f"Invalid disk device: {self.device}")
 
+        if self.image_size is not None:
+            if not self.is_image:
+                raise ValueError(f"image_size only applies to disk images, not {self.device}")
+            parse_size(self.image_size)
+
         # Allow disks without root — only check for duplicates inside THIS disk
         roots = [p for p in self.partitions if p.is_root()]
         if len(roots) > 1:
@@ -36,33 +56,34 @@ class Disk:
         if len(fills) > 1:
             raise ValueError("Only one 'fill' partition is allowed on a disk")
 
-    def partition_plan(self, disk_bytes: int): 
-        fixed = [] 
-        fill = None 
-        for p in self.partitions: 
-            size = p.size_bytes(disk_bytes) 
-            if size is None: 
-                fill = p 
-            else: 
-                fixed.append((p, size))
-
-        used = sum(size for _, size in fixed) 
-        if used > disk_bytes: 
-            raise ValueError("Partition sizes exceed disk size") 
-
-        plan = fixed[:]
-        if fill:
-            remaining = disk_bytes - used
-            if remaining <= 0:
-                raise ValueError("No space left for 'fill' partition")
-
-            # Let sgdisk allocate the remainder of the disk for the fill
-            # partition by leaving its size as ``None``. Calculating an exact
-            # byte size here can overshoot the last usable sector because
-            # sgdisk aligns partition starts and reserves space for GPT
-            # metadata, which leads to failures like exit code 4 when the end
-            # LBA is past the disk boundary. Keeping ``None`` preserves the
-            # ``0`` placeholder in the sgdisk command so it uses the disk's
-            # reported last-usable sector instead of our calculation.
-            plan.append((fill, None))
-        return plan
+    def partition_plan(self, geometry: DiskGeometry) -> GptLayout:
+        """
+        Exact first/last sectors of every partition, numbered in config
+        order, for a disk with ``geometry``. The ``fill`` partition gets
+        every aligned sector the others leave. Raises ValueError when the
+        layout does not fit.
+        """
+        sizes = [(p, p.size_bytes(geometry.size_bytes)) for p in self.partitions]
+
+        used = sum(size for _, size in sizes if size is not None)
+        if used > geometry.size_bytes:
+            raise ValueError("Partition sizes exceed disk size")
+
+        return plan_layout(geometry, sizes)
+
+    @property
+    def is_image(self) -> bool:
+        return not self.device.startswith("/dev/")
+
+    @property
+    def path(self) -> str:
+        """The block device to partition: the disk itself or an image's loop device."""
+
+        return self.block_device or self.device
+
+    def attach(self, block_device: str):
+        """Point the disk and its partitions at the loop device of an image."""
+
+        self.block_device = block_device
+        for index, partition in enumerate(self.partitions, start=1):
+            partition.dev_path = partition_device(block_device, index)
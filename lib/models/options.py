@@ -0,0 +1,81 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from lib.aur_rpc import DEFAULT_RPC_URL, DEFAULT_TTL_SECONDS
+from lib.retry import RetryPolicy, load_policies
+from .packages import PackageGroup, collect_packages
+
+DEFAULT_PACSTRAP_PACKAGES = [
+    "base",
+    "linux",
+    "linux-firmware",
+    "linux-headers",
+    "base-devel",
+    "sbctl",
+    "networkmanager",
+]
+
+
+@dataclass
+class InstallOptions:
+    """Installer behaviour configured under the optional ``install`` key."""
+
+    aur_rpc_url: str = DEFAULT_RPC_URL
+    aur_rpc_ttl: int = DEFAULT_TTL_SECONDS
+    package_cache: Optional[str] = None
+    package_seed: Optional[str] = None
+    prefetch: bool = False
+    rank_mirrors: bool = False
+    mirror_count: int = 10
+    pacstrap: List[str] = field(default_factory=lambda: list(DEFAULT_PACSTRAP_PACKAGES))
+    fold_pacman: bool = False
+    chroot_script: bool = False
+    retry: Dict[str, RetryPolicy] = field(default_factory=lambda: load_policies(None))
+
+    @classmethod
+    def from_config(cls, config: dict | None) -> "InstallOptions":
+        config = config or {}
+        if not isinstance(config, dict):
+            raise ValueError("'install' must be a mapping")
+
+        return cls(
+            aur_rpc_url=config.get("aur_rpc_url", DEFAULT_RPC_URL),
+            aur_rpc_ttl=config.get("aur_rpc_ttl", DEFAULT_TTL_SECONDS),
+            package_cache=config.get("package_cache"),
+            package_seed=config.get("package_seed"),
+            prefetch=config.get("prefetch", False),
+            rank_mirrors=config.get("rank_mirrors", False),
+            mirror_count=config.get("mirror_count", cls.mirror_count),
+            pacstrap=list(config.get("pacstrap", DEFAULT_PACSTRAP_PACKAGES)),
+            fold_pacman=config.get("fold_pacman", False),
+            chroot_script=config.get("chroot_script", False),
+            retry=load_policies(config.get("retry")),
+        )
+
+    def __post_init__(self):
+        if not isinstance(self.aur_rpc_ttl, int) or self.aur_rpc_ttl < 0:
+            raise ValueError(f"Invalid aur_rpc_ttl: {self.aur_rpc_ttl}")
+
+        if not isinstance(self.mirror_count, int) or self.mirror_count < 1:
+            raise ValueError(f"Invalid mirror_count: {self.mirror_count}")
+
+        # The live ISO's /tmp is RAM-backed; a full package set staged there
+        # can exhaust memory before pacstrap starts.
+        if self.prefetch and not self.package_cache:
+            raise ValueError("'install.prefetch' requires an on-disk 'install.package_cache' to download into")
+
+        if not self.pacstrap or not all(isinstance(pkg, str) for pkg in self.pacstrap):
+            raise ValueError("'install.pacstrap' must be a non-empty list of package names")
+
+    def pacstrap_packages(self, groups: list[PackageGroup], index=None) -> list[str]:
+        """
+        The deduplicated pacstrap targets. With ``fold_pacman``, the pacman
+        group packages that ``index`` (a ``lib.syncdb.SyncIndex``) resolves
+        are added. Without an index nothing is folded, since one unknown
+        name would abort the whole pacstrap transaction.
+        """
+        packages = list(self.pacstrap)
+        if self.fold_pacman and index is not None:
+            packages.extend(pkg for pkg in collect_packages(groups, "pacman") if index.resolves(pkg))
+
+        return list(dict.fromkeys(packages))
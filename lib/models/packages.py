@@ -1,12 +1,57 @@
 
 from pathlib import Path
+import os
 import subprocess
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from lib.process_helpers import *
+from lib.aur import (
+    DEFAULT_CACHE_LIMIT_BYTES,
+    AurCache,
+    SrcInfo,
+    build_waves,
+    default_build_jobs,
+    dependency_graph,
+    external_dependencies,
+)
+from lib.aur_rpc import AurRpcError
+from lib.mirrors import MIRRORLIST_PATH, rotate_mirrorlist
+from lib.runner import get_runner
+from lib.retry import (
+    STEP_AUR_FETCH,
+    STEP_FLATPAK,
+    STEP_PACMAN,
+    RetryPolicy,
+    describe_targets,
+    remove_stale_db_lock,
+    run_with_retry,
+)
 
 
 from dataclasses import dataclass
-from typing import Iterable, Optional
+from typing import Callable, Iterable, Optional
+
+
+def read_package_file(path: Path) -> list[str]:
+    with open(path) as f:
+        return [
+            line.strip()
+            for line in f
+            if line.strip() and not line.startswith("#")
+        ]
+
+
+def collect_packages(groups: list["PackageGroup"], kind: str) -> list[str]:
+    """Merge the ``kind`` (pacman, aur or flatpak) lists of every group, in order."""
+
+    packages: dict[str, None] = {}
+    for group in groups:
+        path = getattr(group, kind)
+        if path:
+            packages.update(dict.fromkeys(read_package_file(path)))
+
+    return list(packages)
 
 
 @dataclass
@@ -78,14 +123,53 @@ class PackageGroup:
         return groups
 
 class PackageInstaller:
-    def __init__(self, username: str, root_path: Path | str = "/mnt"):
+    """
+    Installs pacman, AUR and Flatpak packages into ``root_path``. Commands
+    that take the pacman database lock (``pacman -S``/``-U``) are serialized,
+    so the three backends can install from different threads at once.
+    """
+
+    # What the AUR and Flatpak installers run, beyond the pacstrap base.
+    AUR_TOOLS = ["git"]
+    FLATPAK_TOOLS = ["flatpak"]
+
+    def __init__(
+        self,
+        username: str,
+        root_path: Path | str = "/mnt",
+        *,
+        batch: bool = True,
+        aur_jobs: int | None = None,
+        aur_cache_limit: int | None = DEFAULT_CACHE_LIMIT_BYTES,
+        aur_client=None,
+        retry_policies: dict[str, RetryPolicy] | None = None,
+    ):
         """
         username is required for AUR installs
         root_path allows running installs either inside /mnt (default) or directly
         on the host system by setting it to "/".
+        batch installs each pacman package list in a single transaction and
+        bisects the list to find the offending packages when it fails, and
+        installs Flatpak apps with a single flatpak invocation.
+        aur_jobs caps concurrent makepkg builds; None sizes the pool from the
+        available cores and memory.
+        aur_cache_limit bounds the persistent AUR clone/build cache in bytes;
+        None disables eviction.
+        aur_client is an optional ``lib.aur_rpc.AurRpcClient`` used to drop
+        packages the AUR does not know before anything is cloned.
+        retry_policies maps ``lib.retry`` steps (pacman, aur_fetch, flatpak)
+        to the timeout and retry policy of their network-bound commands;
+        steps without one run once with no timeout.
         """
         self.username = username
         self.root_path = Path(root_path)
+        self.batch = batch
+        self.aur_jobs = aur_jobs
+        self.aur_cache_limit = aur_cache_limit
+        self.aur_client = aur_client
+        self.retry_policies = retry_policies or {}
+        self._flathub_ready = False
+        self._pacman_lock = threading.Lock()
 
     # -------------------------
     # Helpers
@@ -97,81 +181,189 @@ class PackageInstaller:
 
         return ["arch-chroot", str(self.root_path)]
 
-    def _run_in_chroot(self, args: list[str]) -> bool:
+    def _stream_in_chroot(self, args: list[str], *, label: Optional[str] = None) -> StreamResult:
+        if self.root_path == Path("/"):
+            return run_streaming(args, label=label, log_name=label)
+
+        return stream_in_chroot(self.root_path, args, label=label, log_name=label)
+
+    def _capture_in_chroot(self, args: list[str]) -> subprocess.CompletedProcess:
+        if self.root_path == Path("/"):
+            return run_captured(args)
+
+        return capture_in_chroot(self.root_path, args)
+
+    def _switch_mirror(self) -> Optional[str]:
+        return rotate_mirrorlist(self._host_path(str(MIRRORLIST_PATH)))
+
+    def _run_in_chroot(
+        self,
+        args: list[str],
+        *,
+        label: Optional[str] = None,
+        step: Optional[str] = None,
+        target: Optional[str] = None,
+    ) -> bool:
+        """
+        Run ``args`` in the target. With a ``step`` the command runs under
+        that step's retry policy, and ``target`` names it in retry messages.
+        """
         cmd = [*self._chroot_prefix(), *args]
-        cp = subprocess.run(
-            cmd,
-            text=True,
-            capture_output=True,
-        )
 
-        if cp.stdout:
-            print(cp.stdout, end="")
-        if cp.stderr:
-            print(cp.stderr, file=sys.stderr, end="")
+        if step is None:
+            result = self._stream_in_chroot(args, label=label)
+        else:
+            policy = self.retry_policies.get(step) or RetryPolicy()
+            result = run_with_retry(
+                lambda: self._stream_in_chroot(policy.wrap(args), label=label),
+                policy,
+                step=step,
+                target=target or label or " ".join(args[:2]),
+                switch_mirror=self._switch_mirror if step == STEP_PACMAN else None,
+                after_timeout=(lambda: remove_stale_db_lock(self.root_path)) if step == STEP_PACMAN else None,
+            )
 
-        if cp.returncode != 0:
-            print(f"Error running: {' '.join(cmd)} (exit code {cp.returncode})", file=sys.stderr)
+        if result.returncode != 0:
+            report_failure(cmd, result)
             return False
 
         return True
 
-    def _run_in_chroot_as_user(self, cmd: str) -> bool:
-        chroot_cmd = [*self._chroot_prefix()]
-
-        chroot_cmd.extend([
-            "sudo",
-            "-u",
-            self.username,
-            "bash",
-            "-lc",
-            cmd,
-        ])
-
-        cp = subprocess.run(
-            chroot_cmd,
-            text=True,
-            capture_output=True,
+    def _run_in_chroot_as_user(
+        self,
+        cmd: str,
+        *,
+        label: Optional[str] = None,
+        step: Optional[str] = None,
+        target: Optional[str] = None,
+    ) -> bool:
+        return self._run_in_chroot(
+            ["sudo", "-u", self.username, "bash", "-lc", cmd],
+            label=label,
+            step=step,
+            target=target,
         )
 
-        if cp.stdout:
-            print(cp.stdout, end="")
-        if cp.stderr:
-            print(cp.stderr, file=sys.stderr, end="")
+    def _run_pacman(self, args: list[str], *, target: str) -> bool:
+        """
+        Run a pacman transaction once no other thread holds the database.
+        With a pacman timeout, ``-S`` first downloads its packages with
+        ``-Sw`` under the retry policy and then installs them from the cache
+        without a timeout: killing pacman while it commits would leave
+        packages half unpacked. ``-U`` of local files is never timed out.
+        """
+        with self._pacman_lock:
+            if args[0] != "-S":
+                return self._run_in_chroot(["pacman", *args])
+
+            policy = self.retry_policies.get(STEP_PACMAN) or RetryPolicy()
+            if policy.timeout is None:
+                return self._run_in_chroot(["pacman", *args], step=STEP_PACMAN, target=target)
+
+            if not self._run_in_chroot(["pacman", "-Sw", *args[1:]], step=STEP_PACMAN, target=target):
+                return False
+            return self._run_in_chroot(["pacman", *args])
+
+    def _capture_in_chroot_as_user(self, cmd: str) -> Optional[str]:
+        args = ["sudo", "-u", self.username, "bash", "-lc", cmd]
+        chroot_cmd = [*self._chroot_prefix(), *args]
+
+        cp = self._capture_in_chroot(args)
 
         if cp.returncode != 0:
+            if cp.stderr:
+                print(cp.stderr, file=sys.stderr, end="")
             print(f"Error running: {' '.join(chroot_cmd)} (exit code {cp.returncode})", file=sys.stderr)
-            return False
+            return None
 
-        return True
+        return cp.stdout
+
+    def _installed_versions(self, packages: list[str]) -> dict[str, str]:
+        # pacman -Q exits non-zero when any name is missing but still lists
+        # the installed ones, so parse stdout regardless of the exit code.
+        cp = self._capture_in_chroot(["pacman", "-Q", *packages])
+
+        versions: dict[str, str] = {}
+        for line in cp.stdout.splitlines():
+            parts = line.split()
+            if len(parts) == 2:
+                versions[parts[0]] = parts[1]
+
+        return versions
+
+    def _host_path(self, path: str) -> Path:
+        """Translate a path inside the target system to the host's view of it."""
+
+        return self.root_path / Path(path).relative_to("/")
 
     def _read_package_file(self, path: Path) -> list[str]:
-        with open(path) as f:
-            return [
-                line.strip()
-                for line in f
-                if line.strip() and not line.startswith("#")
-            ]
+        return read_package_file(path)
+
+    def _bisect_install(
+        self,
+        targets: list[str],
+        install: Callable[[list[str]], bool],
+    ) -> list[str]:
+        """
+        Run ``install`` over all ``targets`` at once. pacman aborts the whole
+        transaction when any target fails, so on failure the list is split in
+        half and each half retried until the failing targets are isolated.
+        """
+        if install(targets):
+            return []
+
+        if len(targets) == 1:
+            return list(targets)
+
+        middle = len(targets) // 2
+        return [
+            *self._bisect_install(targets[:middle], install),
+            *self._bisect_install(targets[middle:], install),
+        ]
 
     # -------------------------
     # Install methods
     # -------------------------
 
+    def _install_pacman_batch(self, packages: list[str]) -> list[str]:
+        def install(chunk: list[str]) -> bool:
+            print(f"Installing {len(chunk)} pacman package(s): {' '.join(chunk)}")
+            return self._run_pacman(["-S", "--noconfirm", "--needed", *chunk], target=describe_targets(chunk))
+
+        return self._bisect_install(packages, install)
+
+    def install_tools(self, *, aur: bool = False, flatpak: bool = False) -> bool:
+        """
+        Install the programs the AUR (git) and Flatpak installers need, so
+        those can start without waiting for the pacman package lists.
+        """
+        tools = [*(self.AUR_TOOLS if aur else []), *(self.FLATPAK_TOOLS if flatpak else [])]
+        if not tools:
+            return True
+
+        installed = self._installed_versions(tools)
+        missing = [tool for tool in tools if tool not in installed]
+        if not missing:
+            return True
+
+        print(f"Installing package tools: {' '.join(missing)}")
+        return self._run_pacman(["-S", "--noconfirm", "--needed", *missing], target=describe_targets(missing))
+
     def install_pacman_packages(self, packages: list[str]) -> list[str]:
         if not packages:
             return []
 
+        if self.batch:
+            failures = self._install_pacman_batch(list(dict.fromkeys(packages)))
+            if failures:
+                print(f"Failed pacman packages: {', '.join(failures)}", file=sys.stderr)
+            return failures
+
         failures: list[str] = []
 
         for pkg in packages:
             print(f"Installing pacman package: {pkg}")
-            ok = self._run_in_chroot([
-                "pacman",
-                "-S",
-                "--noconfirm",
-                "--needed",
-                pkg,
-            ])
+            ok = self._run_pacman(["-S", "--noconfirm", "--needed", pkg], target=pkg)
             if not ok:
                 failures.append(pkg)
 
@@ -184,31 +376,207 @@ class PackageInstaller:
         packages = self._read_package_file(path)
         return self.install_pacman_packages(packages)
 
+    def _fetch_aur_package(self, pkg: str, aur_dir: str, cache: AurCache) -> Optional[SrcInfo]:
+        if cache.has_clone(pkg):
+            print(f"Updating cached AUR package: {pkg}")
+            ok = self._run_in_chroot_as_user(
+                f"""
+                set -e
+                cd {aur_dir}/{pkg}
+                git fetch --quiet origin
+                git reset --quiet --hard FETCH_HEAD
+                """,
+                step=STEP_AUR_FETCH,
+                target=pkg,
+            )
+        else:
+            print(f"Fetching AUR package: {pkg}")
+            ok = self._run_in_chroot_as_user(
+                f"""
+                set -e
+                cd {aur_dir}
+                rm -rf {pkg}
+                git clone https://aur.archlinux.org/{pkg}.git
+                """,
+                step=STEP_AUR_FETCH,
+                target=pkg,
+            )
+        if not ok:
+            return None
+
+        runner = get_runner()
+        srcinfo_path = self._host_path(f"{aur_dir}/{pkg}/.SRCINFO")
+        try:
+            return SrcInfo.parse(runner.read_text(srcinfo_path))
+        except (OSError, ValueError) as exc:
+            if runner.simulated:
+                # A replayed clone leaves nothing behind to read.
+                print(f"[replay] no .SRCINFO for AUR package {pkg}; assuming no AUR dependencies")
+                return SrcInfo(pkgbase=pkg, pkgnames=[pkg], pkgver="0", pkgrel="1")
+            print(f"No usable .SRCINFO for AUR package {pkg}: {exc}", file=sys.stderr)
+            return None
+
+    def _build_aur_package(
+        self,
+        pkg: str,
+        srcinfo: SrcInfo,
+        aur_dir: str,
+        make_jobs: int,
+    ) -> list[str]:
+        """
+        Build ``pkg`` without installing it and return its package files.
+        Packages already built for the current version are reused as is.
+        """
+        listing = self._capture_in_chroot_as_user(f"cd {aur_dir}/{pkg} && makepkg --packagelist")
+        if listing is None:
+            return []
+
+        # Skip debug packages; makepkg -i only installs the pkgname entries.
+        prefixes = tuple(f"{name}-{srcinfo.version}-" for name in srcinfo.pkgnames)
+        expected = [path for path in listing.split() if Path(path).name.startswith(prefixes)]
+
+        runner = get_runner()
+        if expected and all(runner.exists(self._host_path(path)) for path in expected):
+            print(f"Reusing cached build of AUR package: {pkg}")
+            return expected
+
+        print(f"Building AUR package: {pkg}")
+        ok = self._run_in_chroot_as_user(
+            f"cd {aur_dir}/{pkg} && MAKEFLAGS=-j{make_jobs} makepkg --noconfirm --cleanbuild --force",
+            label=pkg,
+        )
+        if not ok:
+            return []
+
+        artifacts = [path for path in expected if runner.exists(self._host_path(path))]
+        if not artifacts and runner.simulated:
+            # A replayed makepkg leaves no files behind; install what it would have built.
+            artifacts = expected or [
+                f"{aur_dir}/{pkg}/{name}-{srcinfo.version}-x86_64.pkg.tar.zst" for name in srcinfo.pkgnames
+            ]
+        if not artifacts:
+            print(f"makepkg produced no packages for AUR package {pkg}", file=sys.stderr)
+
+        return artifacts
+
+    def _build_aur_wave(
+        self,
+        wave: list[str],
+        srcinfos: dict[str, SrcInfo],
+        aur_dir: str,
+        jobs: int,
+    ) -> list[str]:
+        """
+        Build every package of ``wave`` concurrently, then install all of the
+        resulting packages with one ``pacman -U``. Returns the failed packages.
+        """
+        dependencies = external_dependencies(srcinfos, wave)
+        if dependencies:
+            print(f"Installing AUR build dependencies: {' '.join(dependencies)}")
+            if not self._run_pacman(
+                ["-S", "--noconfirm", "--needed", "--asdeps", *dependencies],
+                target=describe_targets(dependencies),
+            ):
+                print("Failed to install some AUR build dependencies", file=sys.stderr)
+
+        workers = min(jobs, len(wave))
+        make_jobs = max(1, (os.cpu_count() or 1) // workers)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            built = dict(zip(
+                wave,
+                pool.map(
+                    lambda pkg: self._build_aur_package(pkg, srcinfos[pkg], aur_dir, make_jobs),
+                    wave,
+                ),
+            ))
+
+        failures = [pkg for pkg in wave if not built[pkg]]
+
+        def install(chunk: list[str]) -> bool:
+            print(f"Installing {len(chunk)} built AUR package(s): {' '.join(chunk)}")
+            artifacts = [artifact for pkg in chunk for artifact in built[pkg]]
+            return self._run_pacman(["-U", "--noconfirm", "--needed", *artifacts], target=describe_targets(chunk))
+
+        installable = [pkg for pkg in wave if built[pkg]]
+        if installable:
+            failures.extend(self._bisect_install(installable, install))
+
+        return failures
+
     def install_aur_packages(self, packages: list[str]) -> list[str]:
+        """
+        Clone (or update the cached clone of) every package, order the builds
+        by the dependencies declared in their ``.SRCINFO`` files and build each
+        independent wave in parallel. Packages whose installed version already
+        matches the PKGBUILD are skipped.
+        """
         if not packages:
             return []
 
         aur_dir = f"/home/{self.username}/.cache/aur"
 
         self._run_in_chroot_as_user(f"mkdir -p {aur_dir}")
-
-        failures: list[str] = []
+        cache = AurCache(self._host_path(aur_dir), self.aur_cache_limit)
+
+        packages = list(dict.fromkeys(packages))
+        failed: set[str] = set()
+        srcinfos: dict[str, SrcInfo] = {}
+
+        if self.aur_client is not None:
+            # Without metadata every package is still cloned and built as usual.
+            try:
+                infos = self.aur_client.info(packages)
+            except AurRpcError as exc:
+                print(f"{exc}; continuing without AUR metadata", file=sys.stderr)
+            else:
+                for pkg, info in infos.items():
+                    if info is None:
+                        print(f"AUR package {pkg} not found in the AUR", file=sys.stderr)
+                        failed.add(pkg)
 
         for pkg in packages:
-            print(f"Installing AUR package: {pkg}")
-            ok = self._run_in_chroot_as_user(
-                f"""
-                set -e
-                cd {aur_dir}
-                rm -rf {pkg}
-                git clone https://aur.archlinux.org/{pkg}.git
-                cd {pkg}
-                makepkg -si --noconfirm
-                """
-            )
+            if pkg in failed:
+                continue
 
-            if not ok:
-                failures.append(pkg)
+            srcinfo = self._fetch_aur_package(pkg, aur_dir, cache)
+            if srcinfo is None:
+                failed.add(pkg)
+            else:
+                srcinfos[pkg] = srcinfo
+
+        cache.touch(list(srcinfos))
+
+        installed = self._installed_versions(list(srcinfos))
+        current = {pkg for pkg, info in srcinfos.items() if installed.get(pkg) == info.version}
+        for pkg in current:
+            print(f"AUR package {pkg} {installed[pkg]} is up to date; skipping build")
+
+        graph = dependency_graph(srcinfos)
+        waves, cyclic = build_waves(graph)
+        if cyclic:
+            print(f"Dependency cycle between AUR packages: {', '.join(cyclic)}", file=sys.stderr)
+            failed.update(cyclic)
+
+        jobs = self.aur_jobs or default_build_jobs()
+
+        for wave in waves:
+            blocked = [pkg for pkg in wave if graph[pkg] & failed]
+            for pkg in blocked:
+                print(f"Skipping AUR package {pkg}: a dependency failed to install", file=sys.stderr)
+            failed.update(blocked)
+
+            buildable = [pkg for pkg in wave if pkg not in failed and pkg not in current]
+            if buildable:
+                failed.update(self._build_aur_wave(buildable, srcinfos, aur_dir, jobs))
+
+        # The builds are done, so nothing needs protecting any more: this
+        # run's clones were touched last and only go once older ones are
+        # gone, and the cache never stays above its limit.
+        for pkg in cache.evict():
+            print(f"Evicted AUR cache entry: {pkg}")
+
+        failures = [pkg for pkg in packages if pkg in failed]
 
         if failures:
             print(f"Failed AUR packages: {', '.join(failures)}", file=sys.stderr)
@@ -219,31 +587,53 @@ class PackageInstaller:
         packages = self._read_package_file(path)
         return self.install_aur_packages(packages)
 
+    def add_flathub_remote(self) -> bool:
+        if not self._flathub_ready:
+            self._flathub_ready = self._run_in_chroot(
+                [
+                    "flatpak",
+                    "remote-add",
+                    "--if-not-exists",
+                    "flathub",
+                    "https://flathub.org/repo/flathub.flatpakrepo",
+                ],
+                step=STEP_FLATPAK,
+                target="flathub remote",
+            )
+
+        return self._flathub_ready
+
     def install_flatpak_packages(self, packages: list[str]) -> list[str]:
         if not packages:
             return []
 
         failures: list[str] = []
 
-        if not self._run_in_chroot([
-            "flatpak",
-            "remote-add",
-            "--if-not-exists",
-            "flathub",
-            "https://flathub.org/repo/flathub.flatpakrepo",
-        ]):
+        if not self.add_flathub_remote():
             print("Failed to configure flathub; skipping Flatpak installs", file=sys.stderr)
             return packages
 
+        packages = list(dict.fromkeys(packages))
+
+        if self.batch and len(packages) > 1:
+            # One invocation resolves and downloads shared runtimes once.
+            print(f"Installing {len(packages)} Flatpak apps: {' '.join(packages)}")
+            if self._run_in_chroot(
+                ["flatpak", "install", "-y", "flathub", *packages],
+                step=STEP_FLATPAK,
+                target=describe_targets(packages),
+            ):
+                return []
+
+            print("Batched Flatpak install failed; installing apps one at a time", file=sys.stderr)
+
         for pkg in packages:
             print(f"Installing Flatpak app: {pkg}")
-            ok = self._run_in_chroot([
-                "flatpak",
-                "install",
-                "-y",
-                "flathub",
-                pkg,
-            ])
+            ok = self._run_in_chroot(
+                ["flatpak", "install", "-y", "flathub", pkg],
+                step=STEP_FLATPAK,
+                target=pkg,
+            )
             if not ok:
                 failures.append(pkg)
 
@@ -5,12 +5,39 @@ from typing import Optional
 VALID_FS = {"ext4", "vfat", "btrfs", "xfs"}
 VALID_FLAGS = {"esp", "boot"}
 SIZE_SUFFIXES = {"K", "M", "G"}
+SIZE_FACTORS = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def parse_size(size: str) -> int:
+    """Bytes in a size such as ``512M`` or ``4G``."""
+
+    if len(size) < 2:
+        raise ValueError(f"Invalid size format: {size}")
+
+    value, suffix = size[:-1], size[-1].upper()
+    if not value.isdigit() or suffix not in SIZE_SUFFIXES:
+        raise ValueError(f"Invalid size format: {size}")
+
+    return int(value) * SIZE_FACTORS[suffix]
+
+
+def partition_device(parent_device: str, index: int) -> str:
+    """
+    Device path of partition ``index`` of ``parent_device``. The kernel puts
+    a ``p`` between a disk name ending in a digit and the partition number
+    (``nvme0n1p1``, ``loop0p1``, ``mmcblk0p1``) and appends it otherwise.
+    """
+    if parent_device[-1:].isdigit():
+        return f"{parent_device}p{index}"
+    return f"{parent_device}{index}"
 
 
 @dataclass
 class Partition:
     mount: str
-    dev_path: str
+    # Derived from the disk and index; left out of repr so an install
+    # journal does not depend on which loop device an image got.
+    dev_path: str = field(repr=False)
     size: str
     fs: Optional[str] = None
     flags: list[str] = field(default_factory=list)
@@ -19,17 +46,12 @@ class Partition:
     def from_config(cls, config: dict, parent_device: str, index: int) -> "Partition":
         """Create a Partition from a raw config entry.
 
-        The device naming for NVMe disks uses the ``p`` suffix, while other
-        devices simply append the partition number.
+        Disks whose name ends in a digit (NVMe, loop devices) use the ``p``
+        suffix, while other devices simply append the partition number.
         """
-        if "nvme" in parent_device:
-            dev_path = f"{parent_device}p{index}"
-        else:
-            dev_path = f"{parent_device}{index}"
-
         return cls(
             mount=config["mount"],
-            dev_path=dev_path,
+            dev_path=partition_device(parent_device, index),
             size=config["size"],
             fs=config.get("fs"),
             flags=config.get("flags", []),
@@ -48,12 +70,7 @@ class Partition:
 
         # --- SIZE VALIDATION ---
         if self.size != "fill":
-            if len(self.size) < 2:
-                raise ValueError(f"Invalid size format: {self.size}")
-
-            value, suffix = self.size[:-1], self.size[-1].upper()
-            if not value.isdigit() or suffix not in SIZE_SUFFIXES:
-                raise ValueError(f"Invalid size format: {self.size}")
+            parse_size(self.size)
 
         # --- FILESYSTEM RULES ---
         if self.mount == "swap":
@@ -85,11 +102,4 @@ class Partition:
         if self.size == "fill":
             return None
 
-        value = int(self.size[:-1])
-        unit = self.size[-1].upper()
-
-        return value * {
-            "K": 1024,
-            "M": 1024**2,
-            "G": 1024**3,
-        }[unit]
+        return parse_size(self.size)
@@ -0,0 +1,124 @@
+"""Install the pacman, AUR and Flatpak package lists side by side."""
+
+from __future__ import annotations
+
+import sys
+
+from lib.phases import DEFAULT_MAX_PARALLEL, RESOURCE_CHROOT, RESOURCE_NETWORK, PhaseScheduler
+
+BACKENDS = ("Pacman", "AUR", "Flatpak")
+
+
+class PackageCoordinator:
+    """
+    Add the package installs to a ``PhaseScheduler`` as three lanes that run
+    concurrently: the pacman lists, the AUR fetch/build/install pipeline and
+    the Flatpak installs. Only commands that take the pacman database lock
+    are serialized (by ``PackageInstaller``), so git clones, makepkg builds
+    and Flatpak downloads overlap with the pacman transactions.
+
+    A short ``package-tools`` phase first installs what the AUR and Flatpak
+    lanes run (git, flatpak), so neither waits for the pacman lists. Each
+    lane returns False when it left failures, so a resumed install retries it.
+    """
+
+    def __init__(self, installer, *, pacman: list[str], aur: list[str], flatpak: list[str]):
+        self.installer = installer
+        self.pacman = pacman
+        self.aur = aur
+        self.flatpak = flatpak
+        self.failures: dict[str, list[str]] = {}
+
+    def add_phases(
+        self,
+        scheduler: PhaseScheduler,
+        *,
+        requires: list[str] | None = None,
+        aur_requires: list[str] | None = None,
+        inputs: dict | None = None,
+    ):
+        """
+        ``requires`` are the phases every lane waits for (a ready chroot),
+        ``aur_requires`` the extra ones of the AUR lane (the build user).
+        ``inputs`` maps phase names to their journal inputs.
+        """
+        requires = list(requires or [])
+        inputs = inputs or {}
+        resources = {RESOURCE_NETWORK, RESOURCE_CHROOT}
+
+        # Cheap when everything is installed, so it runs again on resume.
+        scheduler.add("package-tools", self._install_tools, requires=requires, resources=resources, checkpoint=False)
+        scheduler.add(
+            "pacman-packages",
+            self._install_pacman,
+            requires=["package-tools"],
+            resources=resources,
+            inputs=inputs.get("pacman-packages"),
+        )
+        scheduler.add("flatpak-remote", self._add_flatpak_remote, requires=["package-tools"], resources=resources)
+        scheduler.add(
+            "flatpak-packages",
+            self._install_flatpak,
+            requires=["flatpak-remote"],
+            resources=resources,
+            inputs=inputs.get("flatpak-packages"),
+        )
+        scheduler.add(
+            "aur-packages",
+            self._install_aur,
+            requires=["package-tools", *(aur_requires or [])],
+            resources=resources,
+            inputs=inputs.get("aur-packages"),
+        )
+
+    def run(self, *, max_parallel: int = DEFAULT_MAX_PARALLEL) -> dict[str, list[str]]:
+        """Install everything with a scheduler of its own; returns the failures."""
+
+        scheduler = PhaseScheduler(max_parallel=max_parallel)
+        self.add_phases(scheduler)
+        scheduler.run_or_exit()
+        return self.merged_failures()
+
+    # -------------------------
+    # Lanes
+    # -------------------------
+
+    def _install_tools(self):
+        if not self.installer.install_tools(aur=bool(self.aur), flatpak=bool(self.flatpak)):
+            print("Failed to install package tools; AUR and Flatpak installs may fail", file=sys.stderr)
+
+    def _install_pacman(self):
+        self.failures["Pacman"] = self.installer.install_pacman_packages(self.pacman)
+        return not self.failures["Pacman"]
+
+    def _add_flatpak_remote(self):
+        if self.flatpak:
+            return self.installer.add_flathub_remote()
+
+    def _install_flatpak(self):
+        self.failures["Flatpak"] = self.installer.install_flatpak_packages(self.flatpak)
+        return not self.failures["Flatpak"]
+
+    def _install_aur(self):
+        self.failures["AUR"] = self.installer.install_aur_packages(self.aur)
+        return not self.failures["AUR"]
+
+    # -------------------------
+    # Reporting
+    # -------------------------
+
+    def merged_failures(self) -> dict[str, list[str]]:
+        return {backend: self.failures[backend] for backend in BACKENDS if self.failures.get(backend)}
+
+    def print_failures(self) -> bool:
+        """Print the failed packages of every backend; True when there were none."""
+
+        failures = self.merged_failures()
+        if not failures:
+            print("All package installations completed successfully.")
+            return True
+
+        print("Package installation completed with some failures:")
+        for backend, names in failures.items():
+            print(f"  {backend}: {', '.join(names)}")
+        return False
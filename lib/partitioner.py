@@ -1,137 +1,168 @@
-import json
+from concurrent.futures import ThreadPoolExecutor, wait
+import os
+import shutil
 import subprocess
-from pathlib import Path
-from typing import List
+import threading
+import time
+from typing import List, Optional
 
+from .block_inventory import BlockSnapshot, get_block_snapshot, refresh_block_snapshot
+from .gpt import DiskGeometry, GptLayout
+from .loopdev import attach_images
 from .models.disk import Disk
+from .models.partition import partition_device
+from .process_helpers import run_captured
+from .runner import get_runner
 
+# How long udev gets to create the nodes of a re-read partition table.
+DEVICE_WAIT_SECONDS = 30
 
-def _walk_block_children(block: dict):
-    yield block
-    for child in block.get("children", []):
-        yield from _walk_block_children(child)
 
-
-def unmount_disk_partitions(device: str):
+def unmount_disk_partitions(device: str, snapshot: Optional[BlockSnapshot] = None) -> bool:
     """
     Unmount and swapoff any partitions belonging to ``device`` so that new
-    partition tables and filesystems can be created safely.
+    partition tables and filesystems can be created safely. Returns True
+    when anything was unmounted, so the caller can refresh the snapshot.
     """
-    disk_name = Path(device).name
-    try:
-        result = subprocess.run(
-            ["lsblk", "-J", "-o", "NAME,MOUNTPOINT,TYPE"],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-    except subprocess.CalledProcessError as exc:
-        raise RuntimeError(f"Failed to query block devices: {exc.stderr}") from exc
+    snapshot = snapshot or get_block_snapshot()
+    disk = snapshot.get(device)
+    if not disk:
+        return False
 
-    info = json.loads(result.stdout)
-    target = next(
-        (dev for dev in info.get("blockdevices", []) if dev.get("name") == disk_name),
-        None,
-    )
-    if not target:
-        return
+    changed = False
+    for block in [disk, *snapshot.partitions(device)]:
+        if block.swap:
+            run_captured(["swapoff", block.path], check=True)
+            print(f"Disabled swap on {block.path}")
+            changed = True
 
-    for block in _walk_block_children(target):
-        mountpoint = block.get("mountpoint")
-        if not mountpoint:
-            continue
+        # Deepest first, so nested mounts come off before their parents.
+        for mountpoint in sorted(block.mountpoints, key=len, reverse=True):
+            run_captured(["umount", mountpoint], check=True)
+            print(f"Unmounted {block.path} from {mountpoint}")
+            changed = True
 
-        part_dev = f"/dev/{block['name']}"
-        if mountpoint == "[SWAP]":
-            subprocess.run(["swapoff", part_dev], check=True)
-            print(f"Disabled swap on {part_dev}")
-        else:
-            subprocess.run(["umount", part_dev], check=True)
-            print(f"Unmounted {part_dev} from {mountpoint}")
+    return changed
 
 
-def build_partition_actions(disk: Disk, dry_run=False):
+def validate_disks(disks: List[Disk], snapshot: Optional[BlockSnapshot] = None):
     """
-    Build (and optionally print) the sgdisk + filesystem creation commands
-    needed to partition the disk. No commands execute unless dry_run=False.
+    Check every block device disk before anything is asked or written: it
+    must exist as a whole, writable disk and its layout must fit. Image
+    disks are checked once they are attached. Raises ValueError.
     """
+    snapshot = snapshot or get_block_snapshot()
+    seen = set()
 
-    device = disk.device
-    wipe = disk.wipe
-    partitions = disk.partitions
+    for disk in disks:
+        if disk.is_image:
+            continue
 
-    # ---- Inline GPT type logic ----
-    def gpt_type_for(part):
-        if part.mount == "/boot":
-            return "ef00"  # EFI System Partition
-        if part.mount == "swap":
-            return "8200"  # Swap
-        return "8300"      # Normal Linux filesystem
-
-    # ---- Inline size formatter ----
-    def format_size(size_bytes):
-        if size_bytes is None:
-            return "0"  # fill-to-end
-        if size_bytes % (1024**3) == 0:
-            return f"+{size_bytes // (1024**3)}G"
-        if size_bytes % (1024**2) == 0:
-            return f"+{size_bytes // (1024**2)}M"
-        if size_bytes % 1024 == 0:
-            return f"+{size_bytes // 1024}K"
-        return f"+{size_bytes}"
-
-    # ---- Step 1: probe disk size ----
-    result = subprocess.run(
-        ["blockdev", "--getsize64", device],
-        capture_output=True,
-        text=True
+        block = snapshot.get(disk.device)
+        if block is None:
+            raise ValueError(f"Disk {disk.device} not found")
+        if block.is_partition:
+            raise ValueError(f"{disk.device} is a partition of /dev/{block.disk}, not a disk")
+        if block.read_only:
+            raise ValueError(f"Disk {disk.device} is read-only")
+        if block.name in seen:
+            raise ValueError(f"Disk {disk.device} is listed more than once")
+        seen.add(block.name)
+
+        disk.partition_plan(block.geometry)
+
+
+def gpt_type_for(part) -> str:
+    if part.mount == "/boot":
+        return "ef00"  # EFI System Partition
+    if part.mount == "swap":
+        return "8200"  # Swap
+    return "8300"      # Normal Linux filesystem
+
+
+def gpt_label_for(part) -> str:
+    return (
+        "boot" if part.mount == "/boot" else
+        "swap" if part.mount == "swap" else
+        "root" if part.mount == "/" else
+        part.mount.strip("/").replace("/", "_")
     )
-    disk_bytes = int(result.stdout.strip())
 
-    # ---- Step 2: determine sizes ----
-    plan = disk.partition_plan(disk_bytes)
 
-    actions = []
+def format_size(size_bytes: int) -> str:
+    for unit, factor in (("T", 1024**4), ("G", 1024**3), ("M", 1024**2), ("K", 1024)):
+        if size_bytes >= factor:
+            value = size_bytes / factor
+            return f"{value:.0f}{unit}" if size_bytes % factor == 0 else f"{value:.1f}{unit}"
+    return f"{size_bytes}B"
 
-    # ---- wipe disk if requested ----
-    if wipe:
-        actions.append({
-            "desc": "wipe disk",
-            "cmd": ["sgdisk", "--zap-all", device]
-        })
 
-    # ---- Step 3: build sgdisk partition creation commands ----
-    number = 1
-    for part, size_bytes in plan:
+def build_table_action(disk: Disk, layout: GptLayout) -> dict:
+    """
+    One ``sgdisk`` invocation that creates, types and labels every partition
+    of ``disk`` at the exact sectors of ``layout``. sgdisk applies its options in order and writes the GPT once
+    at the end, so the table is replaced in a single write (and a single
+    round of udev events) instead of one write per option.
+    """
+    cmd = ["sgdisk"]
+    details = []
+
+    if disk.wipe:
+        # --zap-all exits right after wiping; --clear starts a fresh GPT and
+        # carries on with the partitions below in the same write.
+        cmd.append("--clear")
+        details.append("new GPT (existing partitions are discarded)")
+
+    # The planner already aligned every start (including any alignment
+    # offset); sgdisk would otherwise round explicit starts up to its own
+    # alignment and write a table other than the validated one.
+    cmd.append("--set-alignment=1")
+
+    for extent in layout.extents:
+        part = extent.partition
+        number = extent.number
         part_type = gpt_type_for(part)
-        size_str = format_size(size_bytes)
-
-        label = (
-            "boot" if part.mount == "/boot" else
-            "swap" if part.mount == "swap" else
-            "root" if part.mount == "/" else
-            part.mount.strip("/").replace("/", "_")
+        label = gpt_label_for(part)
+
+        cmd.extend([
+            f"-n{number}:{extent.first_lba}:{extent.last_lba}",
+            f"-t{number}:{part_type}",
+            f"-c{number}:{label}",
+        ])
+        details.append(
+            f"partition {number}: {format_size(layout.size_bytes(extent))}, "
+            f"sectors {extent.first_lba}-{extent.last_lba}, type {part_type}, label {label} ({part.mount})"
         )
 
-        # 1. create the partition
-        actions.append({
-            "desc": f"create partition {number}",
-            "cmd": ["sgdisk", f"-n{number}:0:{size_str}", device]
-        })
+    cmd.append(disk.path)
+    return {"desc": "write partition table", "cmd": cmd, "details": details}
+
 
-        # 2. set type
-        actions.append({
-            "desc": f"set type for partition {number}",
-            "cmd": ["sgdisk", f"-t{number}:{part_type}", device]
-        })
+def build_partition_actions(disk: Disk, dry_run=False, snapshot: Optional[BlockSnapshot] = None):
+    """
+    Build (and optionally print) the sgdisk + filesystem creation commands
+    needed to partition the disk. No commands execute unless dry_run=False.
+    """
 
-        # 3. set label
-        actions.append({
-            "desc": f"label partition {number}",
-            "cmd": ["sgdisk", f"-c{number}:{label}", device]
-        })
+    device = disk.path
+    partitions = disk.partitions
 
-        number += 1
+    # ---- Step 1: read the disk geometry ----
+    geometry = (snapshot or get_block_snapshot()).geometry(device)
+    if geometry is None:
+        # Not a block device on this machine (a replayed install); assume
+        # 512-byte sectors on a disk of the recorded size.
+        result = run_captured(["blockdev", "--getsize64", device])
+        try:
+            geometry = DiskGeometry(size_bytes=int(result.stdout.strip()))
+        except ValueError:
+            raise ValueError(f"Unable to read the size of disk {device}: {result.stderr.strip() or 'no output'}") from None
+
+    # ---- Step 2: place every partition, validating the whole layout ----
+    layout = disk.partition_plan(geometry)
+
+    # ---- Step 3: write the whole partition table at once ----
+    actions = [build_table_action(disk, layout)]
 
     # Ensure the kernel re-reads the partition table before creating filesystems
     actions.append({
@@ -141,11 +172,10 @@ def build_partition_actions(disk: Disk, dry_run=False):
 
     # ---- Step 4: build filesystem creation commands ----
 
+    first_mkfs = len(actions)
     number = 1
     for part in partitions:
-        # derive partition device name
-        # nvme devices use p suffix
-        part_dev = f"{device}p{number}" if "nvme" in device else f"{device}{number}"
+        part_dev = partition_device(device, number)
 
         if part.mount == "swap":
             actions.append({
@@ -183,68 +213,141 @@ def build_partition_actions(disk: Disk, dry_run=False):
             raise ValueError(f"Unhandled filesystem type: {part.fs}")
 
         number += 1
-        
+
+    # Each filesystem is independent once the kernel has re-read the table,
+    # so partition_disks creates them concurrently. Every command ends with
+    # the partition it formats, whose node has to exist first.
+    for action in actions[first_mkfs:]:
+        action["parallel"] = True
+        action["device"] = action["cmd"][-1]
 
     return actions
 
 
+# Keeps the output of concurrently finishing actions from interleaving.
+_output_lock = threading.Lock()
 
-def partition_disks(disks: List[Disk], dry_run=True):
 
-    total_actions = []
+def run_partition_action(action: dict) -> subprocess.CompletedProcess:
+    """
+    Run one action and print its output as a single block once it finishes.
+    Raises ``subprocess.CalledProcessError`` on failure.
+    """
+    print(f"Running: {' '.join(action['cmd'])}")
+    try:
+        result = run_captured(action["cmd"], check=True, name=action["desc"])
+    except subprocess.CalledProcessError as exc:
+        with _output_lock:
+            print(f"Partitioning step failed: {action['desc']}")
+            print(f"Command: {' '.join(action['cmd'])}")
+            if exc.stdout:
+                print(f"stdout:\n{exc.stdout.strip()}")
+            if exc.stderr:
+                print(f"stderr:\n{exc.stderr.strip()}")
+        raise
+
+    output = "\n".join(text.strip() for text in (result.stdout, result.stderr) if text.strip())
+    if output:
+        with _output_lock:
+            print(f"--- {action['desc']}: {' '.join(action['cmd'])}")
+            print(output)
 
-    for disk in disks:
-        unmount_disk_partitions(disk.device)
-        actions = build_partition_actions(disk)
+    return result
 
-        print("\nDisk: " + disk.device)
-        for action in actions:
-            print(f"  #{action['desc']}")
-            print("    " + " ".join(action["cmd"]))
-        print("\n")
 
-        total_actions += actions
+def settle_udev(timeout: float = DEVICE_WAIT_SECONDS):
+    """Wait until udev has handled every queued event (new nodes, by-uuid links)."""
 
+    if get_runner().simulated or shutil.which("udevadm"):
+        run_captured(["udevadm", "settle", f"--timeout={timeout:g}"])
 
-    if not (input("confirm disk setup: (y or yes) ").lower() in ["yes","y"]):
-        print("exiting!!")
-        exit()
 
+def wait_for_devices(devices: list[str], timeout: float = DEVICE_WAIT_SECONDS):
+    """
+    Poll until every path in ``devices`` exists. partprobe returns before
+    udev has created the nodes of the new partitions. Raises RuntimeError
+    for nodes still missing after ``timeout`` seconds.
+    """
+    if get_runner().simulated:
+        return
+
+    deadline = time.monotonic() + timeout
+    missing = [device for device in devices if not os.path.exists(device)]
+    while missing:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Partition devices did not appear after {timeout:g}s: {', '.join(missing)}")
+        time.sleep(0.05)
+        missing = [device for device in missing if not os.path.exists(device)]
 
-    if not dry_run:
-        for action in total_actions:
-            print(f"Running: {' '.join(action['cmd'])}")
-            try:
-                result = subprocess.run(
-                    action["cmd"],
-                    capture_output=True,
-                    check=True,
-                    text=True,
-                )
-            except subprocess.CalledProcessError as exc:
-                print(f"Partitioning step failed: {action['desc']}")
-                print(f"Command: {' '.join(action['cmd'])}")
-                if exc.stdout:
-                    print(f"stdout:\n{exc.stdout.strip()}")
-                if exc.stderr:
-                    print(f"stderr:\n{exc.stderr.strip()}")
-                raise
-            else:
-                if result.stdout:
-                    print(result.stdout.strip())
-                if result.stderr:
-                    print(result.stderr.strip())
-            
-            
 
+def run_disk_actions(actions: list[dict]):
+    """
+    Run one disk's actions: the table write and partprobe in order, then,
+    once udev has settled and every partition node exists, every
+    ``parallel`` action (the mkfs runs) at once. Every started action
+    finishes before the first failure is raised.
+    """
+    for action in actions:
+        if not action.get("parallel"):
+            run_partition_action(action)
 
+    parallel = [action for action in actions if action.get("parallel")]
+    if not parallel:
+        return
 
+    settle_udev()
+    wait_for_devices([action["device"] for action in parallel if action.get("device")])
 
+    with ThreadPoolExecutor(max_workers=len(parallel), thread_name_prefix="mkfs") as pool:
+        futures = [pool.submit(run_partition_action, action) for action in parallel]
+        wait(futures)
 
-        
+    for future in futures:
+        future.result()
 
 
 
+def partition_disks(disks: List[Disk], dry_run=True):
 
-        
+    disk_actions = []
 
+    # Image disks are partitioned through their loop devices.
+    attach_images(disks)
+
+    snapshot = get_block_snapshot()
+    if any([unmount_disk_partitions(disk.path, snapshot) for disk in disks]):
+        snapshot = refresh_block_snapshot()
+
+    for disk in disks:
+        actions = build_partition_actions(disk, snapshot=snapshot)
+
+        print("\nDisk: " + disk.device + (f" (attached to {disk.block_device})" if disk.block_device else ""))
+        for action in actions:
+            concurrent = " (concurrent)" if action.get("parallel") else ""
+            print(f"  #{action['desc']}{concurrent}")
+            for detail in action.get("details", []):
+                print(f"    - {detail}")
+            print("    " + " ".join(action["cmd"]))
+        print("\n")
+
+        disk_actions.append(actions)
+
+
+    if not (input("confirm disk setup: (y or yes) ").lower() in ["yes","y"]):
+        print("exiting!!")
+        exit()
+
+
+    if not dry_run:
+        # Disks are independent chains: table write, partprobe, then mkfs.
+        with ThreadPoolExecutor(max_workers=len(disk_actions) or 1, thread_name_prefix="disk") as pool:
+            futures = [pool.submit(run_disk_actions, actions) for actions in disk_actions]
+            wait(futures)
+
+        # The new partitions and filesystems are visible once udev has
+        # handled the mkfs events.
+        settle_udev()
+        refresh_block_snapshot()
+
+        for future in futures:
+            future.result()
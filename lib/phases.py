@@ -0,0 +1,282 @@
+"""Run install phases as a dependency graph on a thread pool."""
+
+from __future__ import annotations
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+import sys
+import time
+import traceback
+from typing import Callable, Optional
+
+from lib.tracing import CATEGORY_PHASE, get_tracer
+
+# Resources a phase may declare. Exclusive ones are held by at most one
+# running phase; the others only document what a phase touches.
+RESOURCE_CHROOT = "chroot"
+RESOURCE_PACMAN = "pacman"
+RESOURCE_NETWORK = "network"
+RESOURCE_DISK = "disk"
+
+RESOURCES = {RESOURCE_CHROOT, RESOURCE_PACMAN, RESOURCE_NETWORK, RESOURCE_DISK}
+EXCLUSIVE_RESOURCES = {RESOURCE_PACMAN, RESOURCE_DISK}
+
+DEFAULT_MAX_PARALLEL = 4
+
+
+@dataclass
+class Phase:
+    name: str
+    run: Callable[[], object]
+    requires: list[str] = field(default_factory=list)
+    resources: set[str] = field(default_factory=set)
+    # Fingerprinted into the journal; a change makes a resumed install rerun the phase.
+    inputs: object = None
+    # False for phases that set up runtime state (mounts, processes) and
+    # must run again on every resume.
+    checkpoint: bool = True
+
+    def __post_init__(self):
+        unknown = set(self.resources) - RESOURCES
+        if unknown:
+            raise ValueError(f"Phase {self.name} uses unknown resources: {', '.join(sorted(unknown))}")
+
+
+@dataclass
+class PhaseResult:
+    name: str
+    start: float
+    end: float
+    error: Optional[BaseException] = None
+    skipped: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class PhaseScheduler:
+    """
+    Run phases as soon as everything they ``require`` has finished, up to
+    ``max_parallel`` at a time. A phase waits while another running phase
+    holds one of its exclusive resources (the pacman database lock, the
+    disks). Ready phases start in the order they were added, so
+    ``max_parallel=1`` reproduces a plain sequential install.
+
+    After the first failure no new phase is started; running phases finish
+    and the failure is reported.
+
+    With a ``journal`` (``lib.journal.InstallJournal``) every finished
+    checkpoint phase is recorded, and a phase already recorded with the same
+    inputs is skipped as long as none of the checkpoint phases it requires
+    ran again. A phase whose ``run`` returns False finished but stays
+    unrecorded, so a resume retries it.
+    """
+
+    def __init__(self, *, max_parallel: int = DEFAULT_MAX_PARALLEL, journal=None):
+        if max_parallel < 1:
+            raise ValueError(f"Invalid max_parallel: {max_parallel}")
+
+        self.max_parallel = max_parallel
+        self.journal = journal
+        self.phases: dict[str, Phase] = {}
+        self.results: dict[str, PhaseResult] = {}
+        self._started_at = 0.0
+        self._finished_at = 0.0
+
+    def add(
+        self,
+        name: str,
+        run: Callable[[], object],
+        *,
+        requires: list[str] | None = None,
+        resources: set[str] | None = None,
+        inputs: object = None,
+        checkpoint: bool = True,
+    ) -> Phase:
+        if name in self.phases:
+            raise ValueError(f"Duplicate phase: {name}")
+
+        phase = Phase(name, run, list(requires or []), set(resources or ()), inputs, checkpoint)
+        self.phases[name] = phase
+        return phase
+
+    def validate(self):
+        for phase in self.phases.values():
+            missing = [dep for dep in phase.requires if dep not in self.phases]
+            if missing:
+                raise ValueError(f"Phase {phase.name} requires unknown phases: {', '.join(missing)}")
+
+        # Depth-first search for cycles.
+        state: dict[str, int] = {}
+
+        def visit(name: str, path: list[str]):
+            if state.get(name) == 2:
+                return
+            if state.get(name) == 1:
+                cycle = path[path.index(name):] + [name]
+                raise ValueError(f"Phase dependency cycle: {' -> '.join(cycle)}")
+
+            state[name] = 1
+            for dep in self.phases[name].requires:
+                visit(dep, [*path, name])
+            state[name] = 2
+
+        for name in self.phases:
+            visit(name, [])
+
+    # -------------------------
+    # Execution
+    # -------------------------
+
+    def _run_phase(self, phase: Phase) -> PhaseResult:
+        start = time.perf_counter()
+        print(f"==> Phase {phase.name} started")
+        error = None
+        try:
+            complete = phase.run() is not False
+        except BaseException as exc:  # SystemExit from run_process_exit_on_fail included
+            error = exc
+            if not isinstance(exc, SystemExit):
+                traceback.print_exc()
+
+        end = time.perf_counter()
+        get_tracer().record(phase.name, CATEGORY_PHASE, start, end, returncode=0 if error is None else 1)
+        if error is None and complete and phase.checkpoint and self.journal is not None:
+            self.journal.mark_done(phase.name, phase.inputs, duration=end - start)
+
+        status = "done" if error is None else "FAILED"
+        print(f"==> Phase {phase.name} {status} in {end - start:.1f}s")
+        return PhaseResult(phase.name, start, end, error)
+
+    def _can_skip(self, phase: Phase) -> bool:
+        if self.journal is None or not phase.checkpoint:
+            return False
+
+        for dep in phase.requires:
+            if self.phases[dep].checkpoint and not self.results[dep].skipped:
+                return False
+
+        return self.journal.is_done(phase.name, phase.inputs)
+
+    def run(self) -> dict[str, PhaseResult]:
+        self.validate()
+
+        pending = list(self.phases.values())
+        running: dict[Future, Phase] = {}
+        held: set[str] = set()
+        failed = False
+        self._started_at = time.perf_counter()
+
+        with ThreadPoolExecutor(
+            max_workers=self.max_parallel,
+            thread_name_prefix="phase",
+        ) as pool:
+            while pending or running:
+                # Skipping a phase can make later ones ready; rescan until stable.
+                rescan = not failed
+                while rescan:
+                    rescan = False
+                    for phase in list(pending):
+                        if any(dep not in self.results for dep in phase.requires):
+                            continue
+                        if self._can_skip(phase):
+                            pending.remove(phase)
+                            now = time.perf_counter()
+                            self.results[phase.name] = PhaseResult(phase.name, now, now, skipped=True)
+                            print(f"==> Phase {phase.name} already done; skipping")
+                            rescan = True
+                            continue
+                        if len(running) >= self.max_parallel:
+                            continue
+                        exclusive = phase.resources & EXCLUSIVE_RESOURCES
+                        if exclusive & held:
+                            continue
+
+                        pending.remove(phase)
+                        held |= exclusive
+                        running[pool.submit(self._run_phase, phase)] = phase
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    phase = running.pop(future)
+                    held -= phase.resources & EXCLUSIVE_RESOURCES
+                    result = future.result()
+                    self.results[phase.name] = result
+                    failed = failed or not result.ok
+
+        self._finished_at = time.perf_counter()
+        return self.results
+
+    def run_or_exit(self) -> dict[str, PhaseResult]:
+        results = self.run()
+        self.print_summary()
+
+        failures = [result for result in results.values() if not result.ok]
+        if failures:
+            print(f"Install failed in phase: {', '.join(r.name for r in failures)}", file=sys.stderr)
+            skipped = [name for name in self.phases if name not in results]
+            if skipped:
+                print(f"Phases not run: {', '.join(skipped)}", file=sys.stderr)
+            sys.exit(1)
+
+        return results
+
+    # -------------------------
+    # Reporting
+    # -------------------------
+
+    def critical_path(self) -> list[PhaseResult]:
+        """
+        Walk back from the last phase to finish, each time to whatever held
+        it up: the latest-finishing dependency or holder of one of its
+        exclusive resources. The result is the chain that more parallelism
+        cannot shorten.
+        """
+        if not self.results:
+            return []
+
+        current = max(self.results.values(), key=lambda result: result.end)
+        chain = [current]
+
+        while True:
+            phase = self.phases[current.name]
+            exclusive = phase.resources & EXCLUSIVE_RESOURCES
+            blockers = [self.results[dep] for dep in phase.requires if dep in self.results]
+            blockers.extend(
+                result
+                for result in self.results.values()
+                if result is not current
+                and result.end <= current.start
+                and exclusive & self.phases[result.name].resources
+            )
+            if not blockers:
+                break
+
+            current = max(blockers, key=lambda result: result.end)
+            chain.append(current)
+
+        return list(reversed(chain))
+
+    def print_summary(self):
+        wall = self._finished_at - self._started_at
+        busy = sum(result.duration for result in self.results.values())
+
+        print("\nPhase timings:")
+        for result in sorted(self.results.values(), key=lambda r: r.start):
+            offset = result.start - self._started_at
+            status = "skipped" if result.skipped else "ok" if result.ok else "failed"
+            print(f"  {offset:7.1f}s +{result.duration:7.1f}s  {status:7}  {result.name}")
+
+        path = self.critical_path()
+        if path:
+            total = sum(result.duration for result in path)
+            print(f"Critical path ({total:.1f}s of {wall:.1f}s wall, {busy:.1f}s of phase work):")
+            print("  " + " -> ".join(f"{result.name} ({result.duration:.1f}s)" for result in path))
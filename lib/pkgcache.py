@@ -0,0 +1,83 @@
+"""Single pacman package cache shared by pacstrap and later installs."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+from lib.process_helpers import run_process_exit_on_fail
+from lib.runner import get_runner
+
+TARGET_CACHE_DIR = Path("var/cache/pacman/pkg")
+PACKAGE_SUFFIXES = (".pkg.tar.zst", ".pkg.tar.xz", ".pkg.tar.gz", ".pkg.tar")
+
+
+def is_package_file(path: Path) -> bool:
+    name = path.name.removesuffix(".sig")
+    return name.endswith(PACKAGE_SUFFIXES)
+
+
+class SharedPackageCache:
+    """
+    Point every pacman transaction of an install at one cache directory.
+
+    pacstrap stores packages in ``<root>/var/cache/pacman/pkg`` and pacman
+    inside ``arch-chroot`` reads the same directory, so sharing it only needs
+    ``host_dir`` (for example a USB stick or a directory reused across fleet
+    installs) bind-mounted over that path before pacstrap runs. Without
+    ``host_dir`` the target's own on-disk cache is used, which keeps downloads
+    off the live ISO's RAM-backed root.
+    """
+
+    def __init__(self, root_path: Path | str = "/mnt", host_dir: Path | str | None = None):
+        self.root_path = Path(root_path)
+        self.host_dir = Path(host_dir) if host_dir else None
+        self.target_dir = self.root_path / TARGET_CACHE_DIR
+        self._mounted = False
+
+    @property
+    def path(self) -> Path:
+        """Host path of the shared cache, usable as pacman's ``--cachedir``."""
+
+        return self.host_dir or self.target_dir
+
+    def prepare(self):
+        self.target_dir.mkdir(parents=True, exist_ok=True)
+
+        if self.host_dir and not self._mounted:
+            get_runner().makedirs(self.host_dir)
+            run_process_exit_on_fail(["mount", "--bind", str(self.host_dir), str(self.target_dir)])
+            self._mounted = True
+
+    def seed_from(self, source: Path | str) -> int:
+        """
+        Copy package files (and their signatures) from ``source`` into the
+        cache, skipping files that are already present with the same size.
+        Returns the number of files copied.
+        """
+        source = Path(source)
+        if not source.is_dir():
+            print(f"Package seed directory not found: {source}")
+            return 0
+
+        runner = get_runner()
+        runner.makedirs(self.path)
+        copied = 0
+
+        for package in sorted(source.rglob("*")):
+            if not package.is_file() or not is_package_file(package):
+                continue
+
+            destination = self.path / package.name
+            if destination.exists() and destination.stat().st_size == package.stat().st_size:
+                continue
+
+            runner.copy_file(package, destination)
+            copied += 1
+
+        print(f"Seeded {copied} package file(s) from {source} into {self.path}")
+        return copied
+
+    def release(self):
+        if self._mounted:
+            run_process_exit_on_fail(["umount", str(self.target_dir)])
+            self._mounted = False
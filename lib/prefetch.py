@@ -0,0 +1,119 @@
+"""Background download of the install's package set into a staging cache."""
+
+from __future__ import annotations
+
+import atexit
+from pathlib import Path
+import subprocess
+import tempfile
+import threading
+
+from lib.syncdb import DEFAULT_SYNC_DIR, load_sync_index
+
+DEFAULT_LOG_PATH = Path("/tmp/archy-prefetch.log")
+
+
+class PackagePrefetcher:
+    """
+    Download ``packages`` and all of their dependencies with ``pacman -Sw``
+    on a background thread so the network stays busy while the user answers
+    prompts and the disks are formatted.
+
+    Dependencies are resolved against an empty local database (sharing the
+    host's sync databases) so packages the live ISO already has installed are
+    still fetched for the target. pacman's output goes to ``log_path`` to keep
+    the interactive prompts readable.
+    """
+
+    def __init__(
+        self,
+        packages: list[str],
+        cache_dir: Path | str,
+        *,
+        log_path: Path | str = DEFAULT_LOG_PATH,
+        sync_dir: Path | str = DEFAULT_SYNC_DIR,
+    ):
+        self.packages = list(dict.fromkeys(packages))
+        self.cache_dir = Path(cache_dir)
+        self.log_path = Path(log_path)
+        self.sync_dir = Path(sync_dir)
+        self.skipped: list[str] = []
+        self._ok = False
+        self._lock = threading.Lock()
+        self._process: subprocess.Popen | None = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="package-prefetch", daemon=True)
+
+    def start(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        atexit.register(self.stop)
+        print(f"Prefetching {len(self.packages)} packages in the background (log: {self.log_path})")
+        self._thread.start()
+
+    def _spawn(self, cmd: list[str], log) -> int:
+        with self._lock:
+            if self._stopped:
+                return 1
+            log.write(f"$ {' '.join(cmd)}\n")
+            log.flush()
+            self._process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+
+        return self._process.wait()
+
+    def _run(self):
+        with open(self.log_path, "w") as log, tempfile.TemporaryDirectory(prefix="archy-dbpath-") as dbpath:
+            if self._spawn(["pacman", "-Sy", "--noconfirm"], log) != 0:
+                return
+
+            # pacman -Sw aborts on any unknown target, so drop those up front.
+            index = load_sync_index(self.sync_dir)
+            targets = self.packages
+            if index is not None:
+                self.skipped = index.missing(targets)
+                targets = [pkg for pkg in targets if pkg not in self.skipped]
+
+            if not targets:
+                self._ok = True
+                return
+
+            (Path(dbpath) / "local").mkdir()
+            (Path(dbpath) / "sync").symlink_to(self.sync_dir.resolve())
+
+            self._ok = self._spawn([
+                "pacman",
+                "-Sw",
+                "--noconfirm",
+                "--dbpath",
+                dbpath,
+                "--cachedir",
+                str(self.cache_dir),
+                *targets,
+            ], log) == 0
+
+    def wait(self) -> bool:
+        """Block until the download finishes and report whether it succeeded."""
+
+        if self._thread.is_alive():
+            print("Waiting for package prefetch to finish...")
+        self._thread.join()
+
+        if self.skipped:
+            print(f"Prefetch skipped unknown packages: {', '.join(self.skipped)}")
+
+        if self._ok:
+            print(f"Prefetched packages into {self.cache_dir}")
+        else:
+            print(f"Package prefetch failed; see {self.log_path}. Packages will be downloaded during install.")
+
+        return self._ok
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            if self._process and self._process.poll() is None:
+                self._process.terminate()
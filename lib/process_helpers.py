@@ -1,8 +1,211 @@
 
+import contextlib
 import subprocess
+from collections import deque
+from dataclasses import dataclass, field
 from typing import List, Optional
 from getpass import getpass
+from pathlib import Path
+import itertools
+import os
+import re
 import sys
+import threading
+import time
+
+from lib.runner import get_runner
+from lib.target_fs import TargetFilesystem
+from lib.tracing import CATEGORY_CHROOT, CATEGORY_COMMAND, get_tracer
+
+
+# -------------------------
+# Streaming runner
+# -------------------------
+
+# Every streamed command tees its full output to a numbered log in this directory.
+LOG_DIR = Path(os.environ.get("ARCHY_LOG_DIR", "/tmp/archy-logs"))
+
+# Where the new system is mounted while it is installed.
+TARGET_ROOT = Path(os.environ.get("ARCHY_TARGET_ROOT", "/mnt"))
+
+# Lines of recent output kept in memory for error reports.
+TAIL_LINES = 50
+
+_log_counter = itertools.count(1)
+_log_counter_lock = threading.Lock()
+
+
+@dataclass
+class StreamResult:
+    returncode: int
+    tail: list[str] = field(default_factory=list)
+    log_path: Optional[Path] = None
+
+
+def _command_words(process: list[str]) -> list[str]:
+    # Name commands after the command itself rather than the chroot wrapper.
+    args = process[2:] if process[:1] == ["arch-chroot"] else process
+    if args[:1] == ["timeout"]:
+        # Skip a retry policy's "timeout --kill-after=30 600" prefix.
+        args = [arg for arg in args[1:] if not arg.startswith("-")][1:]
+    return [Path(arg).name[:20] for arg in args if not arg.startswith("-")][:3]
+
+
+def _command_category(process: list[str]) -> str:
+    return CATEGORY_CHROOT if process[:1] == ["arch-chroot"] else CATEGORY_COMMAND
+
+
+def _log_path_for(process: list[str], name: Optional[str]) -> Path:
+    name = name or "-".join(_command_words(process))
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "-", name).strip("-")[:60] or "command"
+    with _log_counter_lock:
+        number = next(_log_counter)
+    return LOG_DIR / f"{number:03d}-{slug}.log"
+
+
+class OutputSink:
+    """
+    Destination for one command's output: timestamps each line, echoes it,
+    keeps the last ``TAIL_LINES`` lines and tees everything to a log file.
+    Closing the sink records the command's timing in the trace.
+    """
+
+    def __init__(
+        self,
+        process: list[str],
+        *,
+        label: Optional[str] = None,
+        log_name: Optional[str] = None,
+    ):
+        self.process = process
+        self.label = label
+        self.prefix = f"[{label}] " if label else ""
+        self.tail: deque[str] = deque(maxlen=TAIL_LINES)
+        self.output_bytes = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+        self.log_path: Optional[Path] = _log_path_for(process, log_name)
+        try:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            self._log = open(self.log_path, "w", errors="replace")
+        except OSError as exc:
+            print(f"Unable to open log {self.log_path}: {exc}", file=sys.stderr)
+            self._log, self.log_path = None, None
+
+        if self._log:
+            self._log.write(f"$ {' '.join(process)}\n")
+
+    def line(self, line: str, target=None):
+        line = line.rstrip("\n")
+        stamped = f"[{time.strftime('%H:%M:%S')}] {self.prefix}{line}"
+        with self._lock:
+            print(stamped, file=target or sys.stdout, flush=True)
+            self.output_bytes += len(line.encode(errors="replace")) + 1
+            self.tail.append(line)
+            if self._log:
+                self._log.write(stamped + "\n")
+
+    def close(self, returncode: int, *, cpu: Optional[tuple[float, float]] = None) -> StreamResult:
+        """``cpu`` is the (user, system) seconds used by the command, when known."""
+
+        words = _command_words(self.process)
+        get_tracer().record(
+            self.label or " ".join(words),
+            _command_category(self.process),
+            self.started,
+            time.perf_counter(),
+            returncode=returncode,
+            cpu=cpu,
+            output_bytes=self.output_bytes,
+            process=self.process,
+        )
+
+        if self._log:
+            self._log.write(f"# exit code {returncode}\n")
+            self._log.close()
+            self._log = None
+
+        return StreamResult(returncode=returncode, tail=list(self.tail), log_path=self.log_path)
+
+
+def run_streaming(
+    process: list[str],
+    *,
+    input: Optional[str] = None,
+    label: Optional[str] = None,
+    log_name: Optional[str] = None,
+) -> StreamResult:
+    """
+    Run ``process`` through the active ``lib.runner`` backend and forward
+    its stdout/stderr line by line as it arrives, prefixed with a timestamp
+    (and ``label`` when several commands stream at once). Only the last ``TAIL_LINES`` lines stay in memory; the full output
+    is written to a per-step log file under ``LOG_DIR``.
+    """
+    sink = OutputSink(process, label=label, log_name=log_name)
+    result = get_runner().run(
+        process,
+        input=input,
+        on_line=lambda line, is_stderr: sink.line(line, sys.stderr if is_stderr else sys.stdout),
+    )
+    return sink.close(result.returncode, cpu=result.cpu)
+
+
+def trace_captured(
+    process: list[str],
+    started: float,
+    *,
+    returncode: int,
+    cpu: Optional[tuple[float, float]] = None,
+    output: str = "",
+    name: Optional[str] = None,
+):
+    """Record a captured command, started at ``started``, in the trace."""
+
+    get_tracer().record(
+        name or " ".join(_command_words(process)),
+        _command_category(process),
+        started,
+        time.perf_counter(),
+        returncode=returncode,
+        cpu=cpu,
+        output_bytes=len(output.encode()),
+        process=process,
+    )
+
+
+def run_captured(
+    process: list[str],
+    *,
+    input: Optional[str] = None,
+    check: bool = False,
+    name: Optional[str] = None,
+) -> subprocess.CompletedProcess:
+    """
+    ``subprocess.run(process, capture_output=True, text=True)`` for short
+    commands whose output is parsed rather than shown, executed by the active
+    ``lib.runner`` backend and traced like streamed commands.
+    """
+    started = time.perf_counter()
+    result = get_runner().run(process, input=input)
+    returncode, cpu = result.returncode, result.cpu
+    stdout, stderr = result.stdout, result.stderr
+    trace_captured(process, started, returncode=returncode, cpu=cpu, output=stdout + stderr, name=name)
+
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, process, stdout, stderr)
+
+    return subprocess.CompletedProcess(process, returncode, stdout, stderr)
+
+
+def report_failure(process: list[str], result: StreamResult):
+    print(f"Error running: {' '.join(process)} (exit code {result.returncode})", file=sys.stderr)
+    if result.tail:
+        print(f"Last {len(result.tail)} line(s) of output:", file=sys.stderr)
+        for line in result.tail:
+            print(f"  {line}", file=sys.stderr)
+    if result.log_path:
+        print(f"Full output: {result.log_path}", file=sys.stderr)
 
 
 # -------------------------
@@ -18,35 +221,129 @@ def run_process_exit_on_fail(
         process = process.split(" ")
 
     print(f"Running command: {' '.join(process)}")
-    cp = subprocess.run(
-        process,
-        input=input,
-        text=True,
-        capture_output=True,
-    )
+    result = run_streaming(process, input=input)
 
-    if cp.stdout:
-        print(cp.stdout, end="")
-    if cp.stderr:
-        print(cp.stderr, file=sys.stderr, end="")
-
-    if cp.returncode != 0:
-        print(f"Error running: {' '.join(process)} (exit code {cp.returncode})", file=sys.stderr)
+    if result.returncode != 0:
+        report_failure(process, result)
         sys.exit(1)
 
 
+# Long-lived chroot sessions (see lib.chroot_session) keyed by root path.
+_chroot_sessions: dict[str, object] = {}
+
+
+def register_chroot_session(root: str | Path, session):
+    _chroot_sessions[str(Path(root))] = session
+
+
+def unregister_chroot_session(root: str | Path):
+    _chroot_sessions.pop(str(Path(root)), None)
+
+
+# Serializes the one-off arch-chroots used when a root has no session.
+_chroot_locks: dict[str, threading.Lock] = {}
+_chroot_locks_lock = threading.Lock()
+
+
+def _chroot_lock(root: str | Path):
+    # arch-chroot unmounts the target's /proc, /dev, /sys and /run by path
+    # when it exits, which would pull them from under a concurrent one.
+    # Simulated commands mount nothing, so replays keep their concurrency.
+    if get_runner().simulated:
+        return contextlib.nullcontext()
+    with _chroot_locks_lock:
+        return _chroot_locks.setdefault(str(Path(root)), threading.Lock())
+
+
+def stream_in_chroot(
+    root: str | Path,
+    process: list[str],
+    *,
+    input: Optional[str] = None,
+    label: Optional[str] = None,
+    log_name: Optional[str] = None,
+) -> StreamResult:
+    """
+    Run ``process`` inside ``root`` and stream its output, through the active
+    session for ``root`` when there is one. Without a session every command
+    gets its own ``arch-chroot``, one at a time.
+    """
+    session = _chroot_sessions.get(str(Path(root)))
+    if session is not None:
+        result = session.run(process, input=input, label=label, log_name=log_name)
+        if result is not None:
+            return result
+
+    with _chroot_lock(root):
+        return run_streaming(["arch-chroot", str(root), *process], input=input, label=label, log_name=log_name)
+
+
+def capture_in_chroot(
+    root: str | Path,
+    process: list[str],
+    *,
+    input: Optional[str] = None,
+) -> subprocess.CompletedProcess:
+    """``run_captured`` for a command inside ``root``; see ``stream_in_chroot``."""
+
+    session = _chroot_sessions.get(str(Path(root)))
+    if session is not None:
+        result = session.capture(process, input=input)
+        if result is not None:
+            return result
+
+    with _chroot_lock(root):
+        return run_captured(["arch-chroot", str(root), *process], input=input)
+
+
+# Script recorders (see lib.chroot_script) that collect chroot commands
+# instead of running them, keyed by root path.
+_chroot_recorders: dict[str, object] = {}
+
+
+def register_chroot_recorder(root: str | Path, recorder):
+    _chroot_recorders[str(Path(root))] = recorder
+
+
+def unregister_chroot_recorder(root: str | Path):
+    _chroot_recorders.pop(str(Path(root)), None)
+
+
 def chroot_process(
     process: List[str] | str,
     *,
     input: Optional[str] = None,
+    name: Optional[str] = None,
+    unless: Optional[List[str]] = None,
 ):
+    """
+    Run ``process`` inside ``TARGET_ROOT``. ``unless`` is a check command; when it
+    succeeds the step is already done and is skipped. ``name`` labels the
+    step when a chroot script is recording.
+    """
     if isinstance(process, str):
         process = process.split(" ")
 
-    run_process_exit_on_fail(
-        ["arch-chroot", "/mnt"] + process,
-        input=input,
-    )
+    recorder = _chroot_recorders.get(str(TARGET_ROOT))
+    if recorder is not None:
+        recorder.add(name or Path(process[0]).name, process, input=input, unless=unless)
+        return
+
+    cmd = ["arch-chroot", str(TARGET_ROOT)] + process
+
+    if unless:
+        check = capture_in_chroot(TARGET_ROOT, unless)
+        if check.returncode == 0:
+            print(f"Skipping (already done): {' '.join(cmd)}")
+            return
+
+    print(f"Running command: {' '.join(cmd)}")
+
+    result = stream_in_chroot(TARGET_ROOT, process, input=input)
+
+    if result.returncode != 0:
+        report_failure(cmd, result)
+        sys.exit(1)
 
 
 # -------------------------
@@ -77,6 +374,7 @@ def set_root_password(*, password: str | None = None):
     chroot_process(
         ["chpasswd"],
         input=f"root:{pw}\n",
+        name="root-password",
     )
     pw = None
 
@@ -90,7 +388,11 @@ def lock_root():
 # -------------------------
 
 def create_user(username: str):
-    chroot_process(["useradd", "-m", "-G", "wheel", username])
+    chroot_process(
+        ["useradd", "-m", "-G", "wheel", username],
+        name=f"create-user-{username}",
+        unless=["id", "-u", username],
+    )
 
 
 def set_user_password(username: str, *, password: str | None = None):
@@ -98,13 +400,10 @@ def set_user_password(username: str, *, password: str | None = None):
     chroot_process(
         ["chpasswd"],
         input=f"{username}:{pw}\n",
+        name=f"password-{username}",
     )
     pw = None
 
 
-def enable_wheel_sudo():
-    chroot_process([
-        "sed", "-i",
-        r"s/^# %wheel ALL=(ALL:ALL) ALL/%wheel ALL=(ALL:ALL) ALL/",
-        "/etc/sudoers"
-    ])
+def enable_wheel_sudo(*, root_path: Path | str = TARGET_ROOT):
+    TargetFilesystem(root_path).enable_wheel_sudo()
@@ -0,0 +1,320 @@
+"""Timeouts, retries and backoff for network-bound install steps."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field, fields
+import os
+from pathlib import Path
+import sys
+import threading
+import time
+from typing import Callable, Optional
+
+# Steps a policy can be configured for under ``install.retry`` in setup.yaml.
+STEP_PACSTRAP = "pacstrap"
+STEP_PACMAN = "pacman"
+STEP_AUR_FETCH = "aur_fetch"
+STEP_FLATPAK = "flatpak"
+
+STEPS = {STEP_PACSTRAP, STEP_PACMAN, STEP_AUR_FETCH, STEP_FLATPAK}
+DEFAULT_STEP = "default"
+
+RETRY_ON_NETWORK = "network"
+RETRY_ON_ANY = "any"
+
+# Exit codes of coreutils ``timeout``: the command ran out of time, or
+# ignored SIGTERM and was killed after the grace period.
+TIMEOUT_RETURNCODES = {124, 137}
+KILL_AFTER_SECONDS = 30
+
+# pacman's database lock, relative to the root it manages. A pacman killed
+# by a timeout leaves it behind and every later transaction refuses to run.
+PACMAN_DB_LOCK = Path("var/lib/pacman/db.lck")
+
+# Output that marks a failure as transient (lowercase). Anything else, such
+# as "target not found" or a file conflict, would fail the same way again.
+NETWORK_ERRORS = (
+    "failed retrieving file",
+    "failed to retrieve some files",
+    "could not resolve host",
+    "temporary failure in name resolution",
+    "connection timed out",
+    "connection refused",
+    "connection reset",
+    "network is unreachable",
+    "operation too slow",
+    "unable to access",
+    "the remote end hung up",
+    "early eof",
+    "could not connect",
+    "error downloading",
+    "unable to load summary from remote",
+)
+
+
+@dataclass
+class RetryPolicy:
+    """
+    How one kind of step is run. ``timeout`` bounds every attempt (None
+    waits forever); a timed out or network-failed attempt is retried up to
+    ``retries`` times, waiting ``backoff`` seconds before the first retry and
+    ``backoff_factor`` times longer before each further one, at most
+    ``max_backoff``. With ``retry_on: any`` every failure is retried.
+    ``switch_mirror`` moves the first pacman mirror to the end of the
+    mirrorlist before each retry.
+    """
+
+    timeout: Optional[float] = None
+    retries: int = 0
+    backoff: float = 5.0
+    backoff_factor: float = 2.0
+    max_backoff: float = 300.0
+    switch_mirror: bool = False
+    retry_on: str = RETRY_ON_NETWORK
+
+    @classmethod
+    def from_config(cls, config: dict | None, *, base: "RetryPolicy | None" = None) -> "RetryPolicy":
+        """Build a policy from a setup.yaml mapping; unset keys come from ``base``."""
+
+        config = config or {}
+        if not isinstance(config, dict):
+            raise ValueError("Retry policies must be mappings")
+
+        known = {f.name for f in fields(cls)}
+        unknown = set(config) - known
+        if unknown:
+            raise ValueError(f"Unknown retry settings: {', '.join(sorted(unknown))}")
+
+        values = {name: getattr(base, name) for name in known} if base else {}
+        values.update(config)
+        return cls(**values)
+
+    def __post_init__(self):
+        if self.timeout is not None and (not isinstance(self.timeout, (int, float)) or self.timeout <= 0):
+            raise ValueError(f"Invalid retry timeout: {self.timeout}")
+
+        if not isinstance(self.retries, int) or self.retries < 0:
+            raise ValueError(f"Invalid retry count: {self.retries}")
+
+        for name in ("backoff", "backoff_factor", "max_backoff"):
+            value = getattr(self, name)
+            if not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f"Invalid retry {name}: {value}")
+
+        if self.retry_on not in (RETRY_ON_NETWORK, RETRY_ON_ANY):
+            raise ValueError(f"Invalid retry_on: {self.retry_on} (use '{RETRY_ON_NETWORK}' or '{RETRY_ON_ANY}')")
+
+    def wrap(self, process: list[str]) -> list[str]:
+        """
+        Prefix ``process`` with coreutils ``timeout``. Chroot commands are
+        wrapped inside ``arch-chroot`` (and so also work through a chroot
+        session), leaving arch-chroot to unmount normally; pacstrap gets
+        SIGTERM first so it can clean up its own mounts. Only wrap commands
+        that are safe to kill: pacman and pacstrap only while downloading.
+        """
+        if self.timeout is None:
+            return process
+
+        return ["timeout", f"--kill-after={KILL_AFTER_SECONDS}", f"{self.timeout:g}", *process]
+
+    def delay(self, retry: int) -> float:
+        """Seconds to wait before retry number ``retry`` (1-based)."""
+
+        return min(self.backoff * self.backoff_factor ** (retry - 1), self.max_backoff)
+
+    def timed_out(self, returncode: int) -> bool:
+        return self.timeout is not None and returncode in TIMEOUT_RETURNCODES
+
+    def should_retry(self, returncode: int, tail: list[str]) -> bool:
+        if returncode == 0:
+            return False
+        if self.retry_on == RETRY_ON_ANY or self.timed_out(returncode):
+            return True
+
+        output = "\n".join(tail).lower()
+        return any(pattern in output for pattern in NETWORK_ERRORS)
+
+
+def load_policies(config: dict | None) -> dict[str, RetryPolicy]:
+    """
+    Parse ``install.retry``: an optional ``default`` policy plus per-step
+    overrides, each inheriting the default's settings.
+    """
+    config = config or {}
+    if not isinstance(config, dict):
+        raise ValueError("'install.retry' must be a mapping")
+
+    unknown = set(config) - STEPS - {DEFAULT_STEP}
+    if unknown:
+        raise ValueError(f"Unknown retry steps: {', '.join(sorted(unknown))} (known: {', '.join(sorted(STEPS))})")
+
+    default = RetryPolicy.from_config(config.get(DEFAULT_STEP))
+    return {step: RetryPolicy.from_config(config.get(step), base=default) for step in STEPS}
+
+
+def _file_in_use(path: Path) -> bool:
+    """Whether any process has ``path`` open, from /proc/<pid>/fd."""
+
+    target = os.path.realpath(path)
+    for fd_dir in Path("/proc").glob("[0-9]*/fd"):
+        try:
+            fds = list(fd_dir.iterdir())
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                if os.readlink(fd) == target:
+                    return True
+            except OSError:
+                continue
+    return False
+
+
+def remove_stale_db_lock(root_path: Path | str) -> bool:
+    """
+    Remove the pacman database lock under ``root_path`` when no process
+    holds it open (pacman keeps its lock file open while it runs). Returns
+    whether a stale lock was removed.
+    """
+    lock = Path(root_path) / PACMAN_DB_LOCK
+    if not lock.exists() or _file_in_use(lock):
+        return False
+
+    lock.unlink(missing_ok=True)
+    print(f"Removed stale pacman lock {lock}", file=sys.stderr)
+    return True
+
+
+def describe_targets(names: list[str], limit: int = 3) -> str:
+    if len(names) <= limit:
+        return ", ".join(names)
+    return f"{', '.join(names[:limit])} and {len(names) - limit} more"
+
+
+@dataclass
+class Attempt:
+    number: int
+    returncode: int
+    duration: float
+    timed_out: bool = False
+    # Mirror switched to before this attempt, if any.
+    mirror: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+    def describe(self) -> str:
+        if self.ok:
+            outcome = "ok"
+        elif self.timed_out:
+            outcome = "timed out"
+        else:
+            outcome = f"exit {self.returncode}"
+
+        text = f"#{self.number} {outcome} after {self.duration:.0f}s"
+        if self.mirror:
+            text += f" via {self.mirror}"
+        return text
+
+
+@dataclass
+class StepAttempts:
+    step: str
+    target: str
+    attempts: list[Attempt] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.attempts) and self.attempts[-1].ok
+
+
+class AttemptLog:
+    """Thread-safe record of every attempt of every retried step."""
+
+    def __init__(self):
+        self.steps: list[StepAttempts] = []
+        self._lock = threading.Lock()
+
+    def add(self, entry: StepAttempts):
+        with self._lock:
+            self.steps.append(entry)
+
+    def notable(self) -> list[StepAttempts]:
+        """Steps that needed a retry or timed out."""
+
+        with self._lock:
+            steps = list(self.steps)
+        return [s for s in steps if len(s.attempts) > 1 or any(a.timed_out for a in s.attempts)]
+
+    def summary(self) -> str:
+        lines = []
+        for entry in self.notable():
+            status = "ok" if entry.ok else "FAILED"
+            attempts = "; ".join(attempt.describe() for attempt in entry.attempts)
+            lines.append(f"  {entry.step} ({entry.target}): {status}: {attempts}")
+
+        if not lines:
+            return ""
+        return "\n".join(["Retried steps:", *lines])
+
+
+_attempt_log = AttemptLog()
+
+
+def get_attempt_log() -> AttemptLog:
+    return _attempt_log
+
+
+def run_with_retry(
+    attempt: Callable[[], object],
+    policy: RetryPolicy,
+    *,
+    step: str,
+    target: str,
+    switch_mirror: Optional[Callable[[], Optional[str]]] = None,
+    after_timeout: Optional[Callable[[], object]] = None,
+    sleep: Callable[[float], None] = time.sleep,
+):
+    """
+    Call ``attempt`` (which runs ``policy.wrap``-ed commands and returns a
+    result with ``returncode`` and ``tail``) until it succeeds, fails in a
+    way ``policy`` does not retry, or runs out of retries. ``after_timeout``
+    cleans up after a killed attempt before it is retried. Returns the last
+    result; every attempt is added to the attempt log.
+    """
+    entry = StepAttempts(step, target)
+    mirror = None
+
+    try:
+        for number in range(1, policy.retries + 2):
+            start = time.perf_counter()
+            result = attempt()
+            timed_out = policy.timed_out(result.returncode)
+            entry.attempts.append(
+                Attempt(number, result.returncode, time.perf_counter() - start, timed_out, mirror)
+            )
+
+            if number > policy.retries or not policy.should_retry(result.returncode, result.tail):
+                return result
+
+            delay = policy.delay(number)
+            reason = f"timed out after {policy.timeout:g}s" if timed_out else f"failed (exit {result.returncode})"
+            print(
+                f"{step} {target}: attempt {number} {reason}; "
+                f"retry {number} of {policy.retries} in {delay:.0f}s",
+                file=sys.stderr,
+            )
+
+            if timed_out and after_timeout is not None:
+                after_timeout()
+
+            mirror = None
+            if policy.switch_mirror and switch_mirror is not None:
+                mirror = switch_mirror()
+                if mirror:
+                    print(f"Switched to mirror {mirror}", file=sys.stderr)
+
+            sleep(delay)
+    finally:
+        get_attempt_log().add(entry)
@@ -0,0 +1,442 @@
+"""Pluggable command execution: real processes, recorded runs and replays."""
+
+from __future__ import annotations
+
+from collections import defaultdict, deque
+from dataclasses import dataclass
+import json
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import threading
+import time
+from typing import Callable, Optional
+
+from lib.target_fs import atomic_write_text
+
+RECORDING_VERSION = 2
+# Version 1 recordings kept each command's output inside its entry.
+SUPPORTED_RECORDING_VERSIONS = (1, RECORDING_VERSION)
+
+# Called with each output line (without its newline) and whether it came from stderr.
+LineCallback = Callable[[str, bool], None]
+
+
+@dataclass
+class RunResult:
+    returncode: int
+    stdout: str = ""
+    stderr: str = ""
+    cpu: Optional[tuple[float, float]] = None
+
+
+class Runner:
+    """
+    Executes one command to completion. With ``on_line`` the output is
+    streamed line by line to the callback and not collected; without it
+    stdout and stderr are returned in the result.
+    """
+
+    # Whether helpers may spawn long-lived processes outside ``run`` (the
+    # persistent chroot session, the background prefetch).
+    allow_direct = True
+    # Whether commands only pretend to run, so host checks that read real
+    # hardware state (EFI, mounts) must be skipped.
+    simulated = False
+
+    def run(
+        self,
+        process: list[str],
+        *,
+        input: Optional[str] = None,
+        on_line: Optional[LineCallback] = None,
+    ) -> RunResult:
+        raise NotImplementedError
+
+    # Host files the install reads or writes outside a command (the
+    # mirrorlist, AUR .SRCINFO files, built packages) go through these, so a
+    # recording captures what was read and a replay never writes outside
+    # its scratch target root.
+
+    def read_text(self, path: Path | str) -> str:
+        return Path(path).read_text()
+
+    def exists(self, path: Path | str) -> bool:
+        return Path(path).exists()
+
+    def write_text(self, path: Path | str, content: str, *, mode: int | None = None):
+        atomic_write_text(path, content, mode=mode)
+
+    def makedirs(self, path: Path | str):
+        Path(path).mkdir(parents=True, exist_ok=True)
+
+    def copy_file(self, source: Path | str, destination: Path | str):
+        shutil.copy2(source, destination)
+
+    def close(self):
+        pass
+
+
+class SubprocessRunner(Runner):
+    """Runs commands for real."""
+
+    def run(self, process, *, input=None, on_line=None) -> RunResult:
+        if input is not None:
+            stdin = subprocess.PIPE
+        else:
+            # Streamed commands keep the terminal, as a plain subprocess.run would.
+            stdin = None if on_line else subprocess.DEVNULL
+
+        proc = subprocess.Popen(
+            process,
+            stdin=stdin,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors="replace",
+            bufsize=1,
+        )
+
+        output: dict[bool, list[str]] = {False: [], True: []}
+
+        def read(stream, is_stderr: bool):
+            for line in stream:
+                if on_line:
+                    on_line(line.rstrip("\n"), is_stderr)
+                else:
+                    output[is_stderr].append(line)
+            stream.close()
+
+        readers = [
+            threading.Thread(target=read, args=(proc.stdout, False), daemon=True),
+            threading.Thread(target=read, args=(proc.stderr, True), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+
+        if input is not None:
+            try:
+                proc.stdin.write(input)
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        for reader in readers:
+            reader.join()
+
+        returncode, cpu = _wait_with_usage(proc)
+        return RunResult(returncode, "".join(output[False]), "".join(output[True]), cpu)
+
+
+def _wait_with_usage(proc: subprocess.Popen) -> tuple[int, Optional[tuple[float, float]]]:
+    """Reap ``proc`` with wait4 to get the CPU time of it and its children."""
+
+    try:
+        _, status, usage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        return proc.wait(), None
+
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, (usage.ru_utime, usage.ru_stime)
+
+
+def _normalize(process: list[str], target_root: Optional[str]) -> tuple[str, ...]:
+    if not target_root or target_root == "/":
+        return tuple(process)
+    return tuple(arg.replace(target_root, "<target>") for arg in process)
+
+
+class RecordingRunner(Runner):
+    """
+    Runs commands through ``inner`` and appends every call to a JSON-lines
+    file: the command, exit code, output, duration and CPU time. Streamed
+    output is written line by line as it arrives, tagged with the command's
+    id, so a long build never piles up in memory. File reads and existence
+    checks are recorded too. Command input (passwords) is never written,
+    only its size.
+    """
+
+    allow_direct = False
+
+    def __init__(self, path: Path | str, *, target_root: Path | str | None = None, inner: Runner | None = None):
+        self.path = Path(path)
+        self.inner = inner or SubprocessRunner()
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._next_id = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "w")
+        self._write({
+            "version": RECORDING_VERSION,
+            "recorded": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "target_root": str(target_root) if target_root else None,
+        })
+
+    def _write(self, entry: dict):
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def run(self, process, *, input=None, on_line=None) -> RunResult:
+        with self._lock:
+            self._next_id += 1
+            command_id = self._next_id
+
+        def record_line(line: str, is_stderr: bool):
+            self._write({"output": command_id, "stderr": int(is_stderr), "line": line})
+            on_line(line, is_stderr)
+
+        start = time.perf_counter()
+        result = self.inner.run(process, input=input, on_line=record_line if on_line else None)
+        duration = time.perf_counter() - start
+
+        self._write({
+            "id": command_id,
+            "process": list(process),
+            "input_bytes": len(input.encode()) if input is not None else None,
+            "start": round(start - self._started, 6),
+            "duration": round(duration, 6),
+            "returncode": result.returncode,
+            "cpu": result.cpu,
+            "streamed": bool(on_line),
+            "stdout": result.stdout,
+            "stderr": result.stderr,
+        })
+        return result
+
+    def read_text(self, path):
+        try:
+            content = self.inner.read_text(path)
+        except FileNotFoundError:
+            self._write({"query": "read", "path": str(path), "result": None})
+            raise
+        self._write({"query": "read", "path": str(path), "result": content})
+        return content
+
+    def exists(self, path):
+        result = self.inner.exists(path)
+        self._write({"query": "exists", "path": str(path), "result": result})
+        return result
+
+    def write_text(self, path, content, *, mode=None):
+        self.inner.write_text(path, content, mode=mode)
+
+    def makedirs(self, path):
+        self.inner.makedirs(path)
+
+    def copy_file(self, source, destination):
+        self.inner.copy_file(source, destination)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+# Output for queries whose result later code parses, served when the
+# recording has no matching entry. Keys are argument prefixes (after any
+# arch-chroot prefix).
+DEFAULT_DISK_BYTES = 64 * 1024**3
+REPLAY_QUERY_DEFAULTS: dict[tuple[str, ...], str] = {
+    ("blockdev", "--getsize64"): f"{DEFAULT_DISK_BYTES}\n",
+    ("blkid", "-s", "UUID", "-o", "value"): "00000000-0000-4000-8000-000000000000\n",
+    ("losetup", "--find", "--show"): "/dev/loop0\n",
+}
+
+
+class ReplayRunner(Runner):
+    """
+    Serves results from a recording instead of running anything.
+
+    Calls are matched to recorded ones by command line (with the recorded
+    target root mapped onto ``target_root``), in recorded order for repeated
+    commands, falling back to the next unused recording of the same program
+    and subcommand. ``latency`` is the simulated duration of every command;
+    None replays the recorded durations scaled by ``scale``. Unmatched
+    commands succeed with the output in ``REPLAY_QUERY_DEFAULTS`` or none,
+    or raise when ``strict``.
+
+    File reads and existence checks are answered from the recording, else
+    from this machine's files. Writes only happen inside ``target_root``,
+    which must be a scratch directory; anything else is reported and
+    skipped.
+    """
+
+    allow_direct = False
+    simulated = True
+
+    def __init__(
+        self,
+        path: Path | str,
+        *,
+        target_root: Path | str | None = None,
+        latency: Optional[float] = None,
+        scale: float = 1.0,
+        strict: bool = False,
+    ):
+        self.path = Path(path)
+        self.latency = latency
+        self.scale = scale
+        self.strict = strict
+        self.target_root = str(target_root) if target_root else None
+        self.unmatched: list[list[str]] = []
+        self._lock = threading.Lock()
+
+        entries = []
+        output: dict[int, list[tuple[int, str]]] = defaultdict(list)
+        queries: dict[tuple[str, str], deque] = defaultdict(deque)
+        with open(self.path) as f:
+            header = json.loads(f.readline())
+            if header.get("version") not in SUPPORTED_RECORDING_VERSIONS:
+                raise ValueError(f"Unsupported recording version in {self.path}: {header.get('version')}")
+            recorded_root = header.get("target_root")
+
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if "output" in entry:
+                    output[entry["output"]].append((entry["stderr"], entry["line"]))
+                elif "query" in entry:
+                    path = _normalize([entry["path"]], recorded_root)[0]
+                    queries[(entry["query"], path)].append(entry["result"])
+                else:
+                    entries.append(entry)
+
+        self._entries = entries
+        self._queries = queries
+        self._exact: dict[tuple, deque] = defaultdict(deque)
+        self._loose: dict[tuple, deque] = defaultdict(deque)
+        for entry in entries:
+            entry["used"] = False
+            if entry.pop("streamed", False):
+                entry["lines"] = output.pop(entry["id"], [])
+            key = _normalize(entry["process"], recorded_root)
+            self._exact[key].append(entry)
+            self._loose[self._loose_key(key)].append(entry)
+
+        print(f"Replaying {len(entries)} recorded commands from {self.path}")
+
+    @staticmethod
+    def _loose_key(key: tuple) -> tuple:
+        # "arch-chroot <target> pacman -S --needed a b" -> ("pacman", "a")
+        args = key[2:] if key[:1] == ("arch-chroot",) else key
+        if args[:1] == ("timeout",):
+            # "timeout --kill-after=30 600 pacman ..." from a retry policy.
+            args = [arg for arg in args[1:] if not arg.startswith("-")][1:]
+        words = [Path(arg).name for arg in args if not arg.startswith("-")]
+        return tuple(words[:2])
+
+    def _take(self, queue: deque) -> Optional[dict]:
+        while queue:
+            entry = queue.popleft()
+            if not entry["used"]:
+                entry["used"] = True
+                return entry
+        return None
+
+    def run(self, process, *, input=None, on_line=None) -> RunResult:
+        key = _normalize(process, self.target_root)
+        with self._lock:
+            entry = self._take(self._exact[key]) or self._take(self._loose[self._loose_key(key)])
+            if entry is None:
+                self.unmatched.append(list(process))
+
+        if entry is None:
+            if self.strict:
+                raise RuntimeError(f"No recorded result for: {' '.join(process)}")
+            print(f"[replay] no recording for {' '.join(process)}; assuming success")
+            return RunResult(0, stdout=self._default_output(process))
+
+        delay = self.latency if self.latency is not None else entry["duration"] * self.scale
+        if delay > 0:
+            time.sleep(delay)
+
+        cpu = tuple(entry["cpu"]) if entry.get("cpu") else None
+        if on_line:
+            lines = entry.get("lines")
+            if lines is None:
+                lines = [(0, line) for line in entry.get("stdout", "").splitlines()]
+                lines += [(1, line) for line in entry.get("stderr", "").splitlines()]
+            for is_stderr, line in lines:
+                on_line(line, bool(is_stderr))
+            return RunResult(entry["returncode"], cpu=cpu)
+
+        stdout = entry.get("stdout", "")
+        stderr = entry.get("stderr", "")
+        if not stdout and not stderr and entry.get("lines"):
+            stdout = "".join(f"{line}\n" for is_stderr, line in entry["lines"] if not is_stderr)
+            stderr = "".join(f"{line}\n" for is_stderr, line in entry["lines"] if is_stderr)
+        return RunResult(entry["returncode"], stdout, stderr, cpu)
+
+    @staticmethod
+    def _default_output(process: list[str]) -> str:
+        args = tuple(process[2:] if process[:1] == ["arch-chroot"] else process)
+        for prefix, output in REPLAY_QUERY_DEFAULTS.items():
+            if args[:len(prefix)] == prefix:
+                return output
+        return ""
+
+    def _recorded(self, query: str, path: Path | str):
+        """Pop the next recorded result of ``query`` for ``path``; KeyError when there is none."""
+
+        key = (query, _normalize([str(path)], self.target_root)[0])
+        with self._lock:
+            results = self._queries.get(key)
+            if not results:
+                raise KeyError(key)
+            return results.popleft()
+
+    def read_text(self, path):
+        try:
+            content = self._recorded("read", path)
+        except KeyError:
+            return super().read_text(path)
+        if content is None:
+            raise FileNotFoundError(f"{path} did not exist when recorded")
+        return content
+
+    def exists(self, path):
+        try:
+            return self._recorded("exists", path)
+        except KeyError:
+            return super().exists(path)
+
+    def _writable(self, path: Path | str) -> bool:
+        if self.target_root and Path(path).resolve().is_relative_to(Path(self.target_root).resolve()):
+            return True
+        print(f"[replay] not writing {path} outside the target root")
+        return False
+
+    def write_text(self, path, content, *, mode=None):
+        if self._writable(path):
+            super().write_text(path, content, mode=mode)
+
+    def makedirs(self, path):
+        if self._writable(path):
+            super().makedirs(path)
+
+    def copy_file(self, source, destination):
+        if self._writable(destination):
+            super().copy_file(source, destination)
+
+    def close(self):
+        unused = sum(1 for entry in self._entries if not entry["used"])
+        if self.unmatched or unused:
+            print(f"[replay] {len(self.unmatched)} commands had no recording; {unused} recordings were not used")
+
+
+_runner: Runner = SubprocessRunner()
+
+
+def get_runner() -> Runner:
+    return _runner
+
+
+def set_runner(runner: Runner) -> Runner:
+    """Install ``runner`` for every later command; returns the previous one."""
+
+    global _runner
+    previous, _runner = _runner, runner
+    return previous
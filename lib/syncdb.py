@@ -0,0 +1,241 @@
+"""Offline index of the pacman sync databases for pre-flight name checks."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import json
+from pathlib import Path
+import tarfile
+
+from lib.aur import strip_version
+from lib.models.packages import PackageGroup, read_package_file
+from lib.target_fs import atomic_write_text
+
+DEFAULT_SYNC_DIR = Path("/var/lib/pacman/sync")
+DEFAULT_PACMAN_CONF = Path("/etc/pacman.conf")
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "archy" / "syncdb-index.json"
+
+# Bump when the cached layout changes so stale caches are rebuilt.
+CACHE_VERSION = 2
+
+
+
+@dataclass
+class SyncIndex:
+    """Package names, provides and groups found in the sync databases."""
+
+    packages: dict[str, str] = field(default_factory=dict)
+    provides: dict[str, list[str]] = field(default_factory=dict)
+    groups: dict[str, list[str]] = field(default_factory=dict)
+
+    def resolves(self, name: str) -> bool:
+        """Return True when pacman could satisfy ``name`` as an install target."""
+
+        repo, _, bare = name.rpartition("/")
+        if repo:
+            return self.packages.get(bare) == repo
+
+        return name in self.packages or name in self.provides or name in self.groups
+
+    def missing(self, names: list[str]) -> list[str]:
+        return [name for name in names if not self.resolves(name)]
+
+    def to_dict(self) -> dict:
+        return {
+            "packages": self.packages,
+            "provides": self.provides,
+            "groups": self.groups,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SyncIndex":
+        return cls(
+            packages=data["packages"],
+            provides=data["provides"],
+            groups=data["groups"],
+        )
+
+
+def _parse_desc(text: str) -> dict[str, list[str]]:
+    """Parse a sync DB ``desc`` entry into ``{"%NAME%": [...], ...}``."""
+
+    sections: dict[str, list[str]] = {}
+    current: list[str] | None = None
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            current = None
+        elif line.startswith("%") and line.endswith("%"):
+            current = sections.setdefault(line, [])
+        elif current is not None:
+            current.append(line)
+
+    return sections
+
+
+def _index_database(path: Path, index: SyncIndex):
+    repo = path.name.removesuffix(".db")
+
+    with tarfile.open(path, "r:*") as archive:
+        for member in archive:
+            if not member.isfile() or not member.name.endswith("/desc"):
+                continue
+
+            handle = archive.extractfile(member)
+            if handle is None:
+                continue
+
+            desc = _parse_desc(handle.read().decode("utf-8", errors="replace"))
+            names = desc.get("%NAME%")
+            if not names:
+                continue
+
+            name = names[0]
+            index.packages.setdefault(name, repo)
+
+            for provided in desc.get("%PROVIDES%", []):
+                provided = strip_version(provided)
+                index.provides.setdefault(provided, []).append(name)
+
+            for group in desc.get("%GROUPS%", []):
+                index.groups.setdefault(group, []).append(name)
+
+
+def repo_order(pacman_conf: Path | str = DEFAULT_PACMAN_CONF) -> list[str] | None:
+    """
+    Repository names in the order of their ``[repo]`` sections in
+    ``pacman_conf``, which is the order pacman searches them. None when the
+    file cannot be read.
+    """
+    try:
+        text = Path(pacman_conf).read_text()
+    except OSError:
+        return None
+
+    repos: list[str] = []
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line.startswith("[") and line.endswith("]"):
+            name = line[1:-1].strip()
+            if name and name != "options" and name not in repos:
+                repos.append(name)
+
+    return repos
+
+
+def _ordered_databases(sync_dir: Path, pacman_conf: Path | str | None) -> list[Path]:
+    repos = repo_order(pacman_conf) if pacman_conf is not None else None
+    if repos is None:
+        return sorted(sync_dir.glob("*.db"))
+
+    # Databases of repositories no longer configured are not searched.
+    return [sync_dir / f"{repo}.db" for repo in repos if (sync_dir / f"{repo}.db").is_file()]
+
+
+def _database_key(databases: list[Path]) -> list[list]:
+    # A list, so a changed repository order invalidates the cache too.
+    return [[str(db), db.stat().st_mtime_ns] for db in databases]
+
+
+def load_sync_index(
+    sync_dir: Path | str = DEFAULT_SYNC_DIR,
+    *,
+    cache_path: Path | str | None = DEFAULT_CACHE_PATH,
+    pacman_conf: Path | str | None = DEFAULT_PACMAN_CONF,
+) -> SyncIndex | None:
+    """
+    Build (or load from cache) the index for the sync databases under
+    ``sync_dir``. Databases are read in the repository order of
+    ``pacman_conf``, so a name found in several repositories belongs to the
+    first one, as in pacman's lookup; without a readable ``pacman_conf``
+    every ``*.db`` is read in name order. The cache is invalidated whenever
+    a database is added, removed, reordered or re-synced. Returns ``None``
+    when no sync databases are present (for example before the first
+    ``pacman -Sy``).
+    """
+
+    databases = _ordered_databases(Path(sync_dir), pacman_conf)
+    if not databases:
+        return None
+
+    key = _database_key(databases)
+
+    if cache_path is not None:
+        cache_path = Path(cache_path)
+        try:
+            cached = json.loads(cache_path.read_text())
+        except (OSError, ValueError):
+            cached = None
+
+        if (
+            isinstance(cached, dict)
+            and cached.get("version") == CACHE_VERSION
+            and cached.get("databases") == key
+        ):
+            return SyncIndex.from_dict(cached["index"])
+
+    index = SyncIndex()
+    for db in databases:
+        try:
+            _index_database(db, index)
+        except (tarfile.TarError, OSError) as exc:
+            print(f"Skipping unreadable sync database {db}: {exc}")
+
+    if cache_path is not None:
+        payload = {"version": CACHE_VERSION, "databases": key, "index": index.to_dict()}
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write_text(cache_path, json.dumps(payload))
+        except OSError as exc:
+            print(f"Unable to cache sync index at {cache_path}: {exc}")
+
+    return index
+
+
+def find_missing_packages(
+    groups: list[PackageGroup],
+    index: SyncIndex,
+) -> dict[Path, list[str]]:
+    """Return the unresolvable entries of every group's pacman list, by file."""
+
+    missing: dict[Path, list[str]] = {}
+    for group in groups:
+        if not group.pacman:
+            continue
+
+        unresolved = index.missing(read_package_file(group.pacman))
+        if unresolved:
+            missing[group.pacman] = unresolved
+
+    return missing
+
+
+def preflight_package_groups(
+    groups: list[PackageGroup],
+    *,
+    sync_dir: Path | str = DEFAULT_SYNC_DIR,
+    cache_path: Path | str | None = DEFAULT_CACHE_PATH,
+    pacman_conf: Path | str | None = DEFAULT_PACMAN_CONF,
+) -> bool:
+    """
+    Check every pacman package list against the local sync databases and
+    report unknown names. Returns False only when names are missing; a host
+    without sync databases skips the check.
+    """
+
+    index = load_sync_index(sync_dir, cache_path=cache_path, pacman_conf=pacman_conf)
+    if index is None:
+        print(f"No sync databases found in {sync_dir}; skipping package name check.")
+        return True
+
+    missing = find_missing_packages(groups, index)
+    if not missing:
+        print("All pacman package names resolve against the sync databases.")
+        return True
+
+    print("Packages not found in the sync databases:")
+    for path, names in missing.items():
+        print(f"  {path}: {', '.join(names)}")
+
+    return False
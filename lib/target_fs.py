@@ -0,0 +1,154 @@
+"""Edit configuration files of the mounted target system directly from Python."""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import re
+import tempfile
+
+DEFAULT_FILE_MODE = 0o644
+SUDOERS_MODE = 0o440
+
+# "%wheel ALL=(ALL:ALL) ALL", optionally commented out, tolerant of spacing.
+_WHEEL_RULE = re.compile(r"^\s*(#\s*)?%wheel\s+ALL\s*=\s*\(ALL(:ALL)?\)\s+ALL\s*$")
+WHEEL_SUDO_LINE = "%wheel ALL=(ALL:ALL) ALL"
+
+
+def atomic_write_text(path: Path | str, content: str, *, mode: int | None = None):
+    """
+    Write ``content`` to a temporary file next to ``path`` and rename it into
+    place, so readers never see a half-written file. An existing file keeps
+    its mode; new files get ``mode`` or ``DEFAULT_FILE_MODE``.
+    """
+    path = Path(path)
+    if mode is None:
+        mode = path.stat().st_mode & 0o7777 if path.exists() else DEFAULT_FILE_MODE
+
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", dir=path.parent)
+    try:
+        with os.fdopen(fd, "w") as handle:
+            handle.write(content)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.chmod(tmp_name, mode)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+class TargetFilesystem:
+    """
+    Write files under ``root_path`` (the mounted install, ``/`` for the
+    running system, or a temporary directory) without spawning ``arch-chroot``.
+
+    Every write goes to a temporary file in the destination directory and is
+    renamed into place, so a crash never leaves a half-written config. An
+    existing file keeps its mode; new files get ``mode``.
+    """
+
+    def __init__(self, root_path: Path | str = "/mnt"):
+        self.root_path = Path(root_path)
+
+    def path(self, target: Path | str) -> Path:
+        """Host path of ``target``, an absolute path inside the target system."""
+
+        target = Path(target)
+        if not target.is_absolute():
+            raise ValueError(f"Target path must be absolute: {target}")
+        return self.root_path / target.relative_to("/")
+
+    def read_text(self, target: Path | str) -> str:
+        return self.path(target).read_text()
+
+    def write_text(self, target: Path | str, content: str, *, mode: int | None = None):
+        host_path = self.path(target)
+        host_path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(host_path, content, mode=mode)
+
+        print(f"Wrote {target}")
+
+    def symlink(self, link: Path | str, destination: str):
+        """Point ``link`` at ``destination`` (a path as seen inside the target)."""
+
+        host_path = self.path(link)
+        host_path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = host_path.with_name(f".{host_path.name}.{os.getpid()}")
+        tmp_path.unlink(missing_ok=True)
+        os.symlink(destination, tmp_path)
+        os.replace(tmp_path, host_path)
+
+        print(f"Linked {link} -> {destination}")
+
+    def edit_lines(self, target: Path | str, edit) -> bool:
+        """
+        Rewrite ``target`` with ``edit(lines) -> lines``; a missing file is
+        edited as empty. The file is left untouched when nothing changes.
+        Returns True when it was rewritten.
+        """
+        try:
+            original = self.read_text(target)
+        except FileNotFoundError:
+            original = ""
+
+        lines = edit(original.splitlines())
+        content = "\n".join(lines) + "\n"
+
+        if content == original:
+            return False
+
+        self.write_text(target, content)
+        return True
+
+    # -------------------------
+    # Structured editors
+    # -------------------------
+
+    def enable_locale(self, locale: str, path: Path | str = "/etc/locale.gen") -> bool:
+        """
+        Uncomment ``locale`` in ``locale.gen``. Only an entry whose locale
+        name matches exactly is enabled (``en_US.UTF-8`` does not enable
+        ``en_US.UTF-8@euro``); an unknown locale is appended.
+        """
+        charset = locale.split(".", 1)[1] if "." in locale else "ISO-8859-1"
+
+        def edit(lines: list[str]) -> list[str]:
+            for index, line in enumerate(lines):
+                fields = line.lstrip("#").split()
+                if not fields or fields[0] != locale:
+                    continue
+                # Skip prose comments such as "#  en_US.UTF-8 is the default".
+                if len(fields) != 2:
+                    continue
+                lines[index] = " ".join(fields)
+                return lines
+
+            return [*lines, f"{locale} {charset}"]
+
+        return self.edit_lines(path, edit)
+
+    def enable_wheel_sudo(self, path: Path | str = "/etc/sudoers") -> bool:
+        """
+        Enable the ``%wheel ALL=(ALL:ALL) ALL`` rule in ``sudoers``, appending
+        it when the file has no such line. The file keeps mode 0440.
+        """
+
+        def edit(lines: list[str]) -> list[str]:
+            matches = [index for index, line in enumerate(lines) if _WHEEL_RULE.match(line)]
+            if any(not lines[index].lstrip().startswith("#") for index in matches):
+                return lines
+
+            if matches:
+                lines[matches[0]] = WHEEL_SUDO_LINE
+                return lines
+
+            return [*lines, WHEEL_SUDO_LINE]
+
+        host_path = self.path(path)
+        if not host_path.exists():
+            self.write_text(path, f"{WHEEL_SUDO_LINE}\n", mode=SUDOERS_MODE)
+            return True
+
+        return self.edit_lines(path, edit)
@@ -0,0 +1,188 @@
+"""Record the timing of every command and install phase as a Chrome trace."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Optional
+
+from lib.target_fs import atomic_write_text
+
+CATEGORY_COMMAND = "command"
+CATEGORY_CHROOT = "chroot"
+CATEGORY_PHASE = "phase"
+
+# Command lines longer than this (pacman target lists) are cut in the trace.
+MAX_COMMAND_CHARS = 300
+
+
+@dataclass
+class TraceSpan:
+    name: str
+    category: str
+    start: float
+    end: float
+    thread_id: int
+    thread_name: str
+    returncode: Optional[int] = None
+    cpu_user: Optional[float] = None
+    cpu_system: Optional[float] = None
+    output_bytes: Optional[int] = None
+    command: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    @property
+    def cpu(self) -> Optional[float]:
+        if self.cpu_user is None or self.cpu_system is None:
+            return None
+        return self.cpu_user + self.cpu_system
+
+
+class Tracer:
+    """
+    Thread-safe collector of spans. Times are ``time.perf_counter`` values;
+    the export converts them to microseconds since the tracer was created,
+    which is what ``chrome://tracing`` and Perfetto expect.
+    """
+
+    def __init__(self):
+        self.spans: list[TraceSpan] = []
+        self._lock = threading.Lock()
+        self._epoch = time.perf_counter()
+        self._wall_epoch = time.time()
+
+    def record(
+        self,
+        name: str,
+        category: str,
+        start: float,
+        end: float,
+        *,
+        returncode: Optional[int] = None,
+        cpu: Optional[tuple[float, float]] = None,
+        output_bytes: Optional[int] = None,
+        process: Optional[list[str]] = None,
+    ) -> TraceSpan:
+        thread = threading.current_thread()
+        command = None
+        if process:
+            command = " ".join(process)
+            if len(command) > MAX_COMMAND_CHARS:
+                command = command[: MAX_COMMAND_CHARS - 3] + "..."
+
+        span = TraceSpan(
+            name=name,
+            category=category,
+            start=start,
+            end=end,
+            thread_id=thread.ident or 0,
+            thread_name=thread.name,
+            returncode=returncode,
+            cpu_user=cpu[0] if cpu else None,
+            cpu_system=cpu[1] if cpu else None,
+            output_bytes=output_bytes,
+            command=command,
+        )
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    # -------------------------
+    # Export
+    # -------------------------
+
+    def chrome_trace(self) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+
+        # Chrome wants small integer thread ids; keep first-seen order.
+        tids: dict[int, int] = {}
+        names: dict[int, str] = {}
+        for span in sorted(spans, key=lambda s: s.start):
+            if span.thread_id not in tids:
+                tids[span.thread_id] = len(tids) + 1
+                names[tids[span.thread_id]] = span.thread_name
+
+        pid = os.getpid()
+        events: list[dict] = [
+            {"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "archy"}},
+        ]
+        for tid, thread_name in names.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}})
+
+        for span in spans:
+            args = {
+                key: value
+                for key, value in (
+                    ("command", span.command),
+                    ("returncode", span.returncode),
+                    ("cpu_user_s", span.cpu_user),
+                    ("cpu_system_s", span.cpu_system),
+                    ("output_bytes", span.output_bytes),
+                )
+                if value is not None
+            }
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "pid": pid,
+                "tid": tids[span.thread_id],
+                "ts": round((span.start - self._epoch) * 1_000_000),
+                "dur": round(span.duration * 1_000_000),
+                "args": args,
+            })
+
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self._wall_epoch))},
+        }
+
+    def write_chrome_trace(self, path: Path | str) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(path, json.dumps(self.chrome_trace()))
+        return path
+
+    def summary(self, *, categories: Optional[set[str]] = None, limit: int = 25) -> str:
+        """A table of spans (optionally only ``categories``) sorted by duration, longest first."""
+
+        with self._lock:
+            spans = [span for span in self.spans if categories is None or span.category in categories]
+
+        spans.sort(key=lambda span: span.duration, reverse=True)
+        lines = [f"{'wall':>9} {'cpu':>9} {'rc':>4} {'output':>9}  {'kind':8} name"]
+        for span in spans[:limit]:
+            cpu = f"{span.cpu:8.1f}s" if span.cpu is not None else f"{'-':>9}"
+            rc = str(span.returncode) if span.returncode is not None else "-"
+            output = _format_bytes(span.output_bytes) if span.output_bytes is not None else "-"
+            lines.append(f"{span.duration:8.1f}s {cpu} {rc:>4} {output:>9}  {span.category:8} {span.name}")
+
+        if len(spans) > limit:
+            rest = sum(span.duration for span in spans[limit:])
+            lines.append(f"... {len(spans) - limit} more ({rest:.1f}s)")
+
+        return "\n".join(lines)
+
+
+def _format_bytes(size: int) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GiB"
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
@@ -0,0 +1,44 @@
+import json
+import os
+
+from lib.aur import AurCache
+
+
+def make_clone(cache: AurCache, pkg: str, size: int):
+    clone = cache.path / pkg
+    (clone / ".git").mkdir(parents=True)
+    (clone / "source.tar").write_bytes(os.urandom(size))
+
+
+def test_least_recently_used_clones_are_evicted_first(tmp_path):
+    cache = AurCache(tmp_path, limit_bytes=None)
+    for pkg in ["old", "newer", "newest"]:
+        make_clone(cache, pkg, 64 * 1024)
+    cache.touch(["old"])
+    cache.touch(["newer"])
+    cache.touch(["newest"])
+
+    cache.limit_bytes = 100 * 1024
+    assert cache.evict() == ["old", "newer"]
+    assert cache.has_clone("newest")
+    assert list(json.loads((tmp_path / AurCache.MANIFEST).read_text())) == ["newest"]
+
+
+def test_kept_clones_are_not_evicted(tmp_path):
+    cache = AurCache(tmp_path, limit_bytes=100 * 1024)
+    make_clone(cache, "building", 64 * 1024)
+    make_clone(cache, "idle", 64 * 1024)
+    cache.touch(["idle"])
+    cache.touch(["building"])
+
+    assert cache.evict(keep=["idle"]) == ["building"]
+    assert cache.has_clone("idle")
+    assert cache.evict(keep=["idle"]) == []
+
+
+def test_no_limit_evicts_nothing(tmp_path):
+    cache = AurCache(tmp_path, limit_bytes=None)
+    make_clone(cache, "pkg", 64 * 1024)
+
+    assert cache.evict() == []
+    assert AurCache(tmp_path / "missing").evict() == []
@@ -0,0 +1,145 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from lib.aur_rpc import MAX_QUERY_LENGTH, AurRpcClient, AurRpcError
+
+PACKAGES = {
+    "yay": {"Name": "yay", "PackageBase": "yay", "Version": "12.4.2-1", "Depends": ["pacman", "git"]},
+    "yay-bin": {"Name": "yay-bin", "PackageBase": "yay-bin", "Version": "12.4.2-1"},
+    "paru": {"Name": "paru", "Version": "2.0.4-1", "MakeDepends": ["cargo"], "OutOfDate": 1700000000},
+}
+
+
+class AurStub:
+    """A local AUR RPC endpoint that records every query it answers."""
+
+    def __init__(self):
+        self.queries: list[list[str]] = []
+        self.status = 200
+        self.error: str | None = None
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = urlsplit(self.path).query
+                names = parse_qs(query).get("arg[]", [])
+                stub.queries.append(names)
+
+                if stub.error:
+                    body = {"type": "error", "error": stub.error}
+                else:
+                    results = [PACKAGES[name] for name in names if name in PACKAGES]
+                    body = {"type": "multiinfo", "resultcount": len(results), "results": results}
+
+                data = json.dumps(body).encode()
+                self.send_response(stub.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/rpc/v5/info"
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def aur():
+    stub = AurStub()
+    yield stub
+    stub.close()
+
+
+def test_names_are_batched_into_one_request(aur, tmp_path):
+    client = AurRpcClient(aur.url, cache_path=tmp_path / "aur.json")
+
+    infos = client.info(["yay", "paru", "missing", "yay"])
+
+    assert aur.queries == [["yay", "paru", "missing"]]
+    assert list(infos) == ["yay", "paru", "missing"]
+    assert infos["yay"].depends == ["pacman", "git"]
+    assert infos["paru"].package_base == "paru"
+    assert infos["paru"].make_depends == ["cargo"]
+    assert infos["paru"].out_of_date == 1700000000
+    assert infos["missing"] is None
+
+
+def test_long_queries_are_split(aur):
+    names = [f"package-with-a-rather-long-name-{index:04d}" for index in range(300)]
+    client = AurRpcClient(aur.url, cache_path=None)
+
+    infos = client.info(names)
+
+    assert len(aur.queries) > 1
+    assert [name for query in aur.queries for name in query] == names
+    assert all(infos[name] is None for name in names)
+
+
+def test_cached_hits_and_misses_stay_offline_within_ttl(aur, tmp_path):
+    cache_path = tmp_path / "aur.json"
+    AurRpcClient(aur.url, cache_path=cache_path).info(["yay", "missing"])
+
+    # A new client (a later run) answers from the on-disk cache.
+    infos = AurRpcClient(aur.url, cache_path=cache_path).info(["missing", "yay"])
+
+    assert aur.queries == [["yay", "missing"]]
+    assert infos["yay"].version == "12.4.2-1"
+    assert infos["missing"] is None
+
+
+def test_only_stale_or_new_names_are_requested(aur, tmp_path):
+    cache_path = tmp_path / "aur.json"
+    AurRpcClient(aur.url, cache_path=cache_path).info(["yay"])
+
+    AurRpcClient(aur.url, cache_path=cache_path).info(["yay", "paru"])
+    AurRpcClient(aur.url, cache_path=cache_path, ttl=0).info(["yay"])
+
+    assert aur.queries == [["yay"], ["paru"], ["yay"]]
+
+
+def test_cache_of_another_endpoint_is_ignored(aur, tmp_path):
+    cache_path = tmp_path / "aur.json"
+    AurRpcClient(aur.url, cache_path=cache_path).info(["yay"])
+
+    assert AurRpcClient("http://127.0.0.1:1/elsewhere", cache_path=cache_path)._load_cache() == {}
+
+
+def test_rpc_error_response_raises(aur):
+    aur.error = "Too many package results."
+
+    with pytest.raises(AurRpcError, match="Too many package results"):
+        AurRpcClient(aur.url, cache_path=None).info(["yay"])
+
+
+def test_http_error_raises(aur):
+    aur.status = 503
+
+    with pytest.raises(AurRpcError, match="request failed"):
+        AurRpcClient(aur.url, cache_path=None).info(["yay"])
+
+
+def test_unreachable_endpoint_raises():
+    with pytest.raises(AurRpcError):
+        AurRpcClient("http://127.0.0.1:1/rpc/v5/info", cache_path=None, timeout=2).info(["yay"])
+
+
+def test_chunks_respect_the_query_limit():
+    client = AurRpcClient(cache_path=None)
+    names = [f"name-{index}" for index in range(2000)]
+
+    chunks = client._chunks(names)
+
+    assert [name for chunk in chunks for name in chunk] == names
+    assert all(len("&".join(f"arg%5B%5D={name}" for name in chunk)) <= MAX_QUERY_LENGTH for chunk in chunks)
@@ -0,0 +1,156 @@
+import random
+
+import pytest
+
+from lib.gpt import DiskGeometry, GptLayout, PartitionExtent, plan_layout
+
+MiB = 1024**2
+GiB = 1024**3
+
+
+def assert_layout(layout: GptLayout, sizes):
+    """Every extent is valid, aligned and exactly its requested size rounded up to sectors."""
+
+    geometry = layout.geometry
+    lss = geometry.logical_sector_size
+    offset = geometry.alignment_offset // lss
+    layout.validate()
+
+    assert [extent.number for extent in layout.extents] == list(range(1, len(sizes) + 1))
+    for extent, (_, size) in zip(layout.extents, sizes):
+        assert (extent.first_lba + offset) % geometry.alignment_sectors == 0
+        assert geometry.first_usable <= extent.first_lba <= extent.last_lba <= geometry.last_usable
+        if size is not None:
+            assert extent.sectors == -(-size // lss)
+
+
+def test_4kn_disk_uses_4k_sectors():
+    geometry = DiskGeometry(size_bytes=64 * GiB, logical_sector_size=4096, physical_sector_size=4096)
+    sizes = [("boot", 512 * MiB), ("root", None)]
+
+    layout = plan_layout(geometry, sizes)
+
+    assert geometry.entry_sectors == 4
+    assert geometry.first_usable == 6
+    assert geometry.alignment_sectors == 256
+    boot, root = layout.extents
+    assert boot.first_lba == 256
+    assert layout.size_bytes(boot) == 512 * MiB
+    assert root.first_lba == boot.last_lba + 1
+    assert root.last_lba == geometry.last_usable
+    assert_layout(layout, sizes)
+
+
+def test_alignment_offset_shifts_every_start():
+    # 512e drive whose first naturally aligned sector is LBA 7.
+    geometry = DiskGeometry(size_bytes=32 * GiB, alignment_offset=7 * 512)
+    sizes = [("boot", 300 * MiB), ("swap", 2 * GiB + 512), ("root", None)]
+
+    layout = plan_layout(geometry, sizes)
+
+    assert layout.extents[0].first_lba == 2048 - 7
+    assert_layout(layout, sizes)
+
+
+def test_fill_partition_not_last_packs_the_rest_at_the_end():
+    geometry = DiskGeometry(size_bytes=16 * GiB)
+    sizes = [("boot", 1 * GiB), ("root", None), ("swap", 4 * GiB), ("data", 100 * MiB + 1)]
+
+    layout = plan_layout(geometry, sizes)
+
+    boot, root, swap, data = layout.extents
+    assert data.last_lba <= geometry.last_usable
+    assert geometry.last_usable - data.last_lba < geometry.alignment_sectors
+    assert swap.last_lba == data.first_lba - 1
+    assert root.first_lba == boot.last_lba + 1
+    assert root.last_lba == swap.first_lba - 1
+    assert_layout(layout, sizes)
+
+
+def test_packed_at_end_after_a_leading_fill():
+    geometry = DiskGeometry(size_bytes=8 * GiB)
+    sizes = [("root", None), ("swap", 1 * GiB)]
+
+    layout = plan_layout(geometry, sizes)
+
+    root, swap = layout.extents
+    assert root.first_lba == 2048
+    assert root.last_lba == swap.first_lba - 1
+    assert_layout(layout, sizes)
+
+
+def test_packed_at_end_that_does_not_fit():
+    geometry = DiskGeometry(size_bytes=4 * GiB)
+
+    with pytest.raises(ValueError):
+        plan_layout(geometry, [("root", None), ("swap", 3 * GiB), ("data", 2 * GiB)])
+
+
+def test_no_space_left_for_fill():
+    geometry = DiskGeometry(size_bytes=4 * GiB)
+
+    with pytest.raises(ValueError, match="No space left"):
+        plan_layout(geometry, [("boot", 2 * GiB), ("root", None), ("swap", 2 * GiB)])
+
+
+def test_exact_fit_without_fill():
+    geometry = DiskGeometry(size_bytes=1 * GiB)
+    usable = (geometry.last_usable - 2048 + 1) * 512
+    sizes = [("boot", 256 * MiB), ("root", usable - 256 * MiB)]
+
+    layout = plan_layout(geometry, sizes)
+
+    assert layout.extents[-1].last_lba == geometry.last_usable
+    assert_layout(layout, sizes)
+
+    with pytest.raises(ValueError):
+        plan_layout(geometry, [("boot", 256 * MiB), ("root", usable - 256 * MiB + 1)])
+
+
+def test_only_one_fill_partition():
+    with pytest.raises(ValueError, match="Only one 'fill'"):
+        plan_layout(DiskGeometry(size_bytes=8 * GiB), [("a", None), ("b", None)])
+
+
+def test_validate_rejects_bad_extents():
+    geometry = DiskGeometry(size_bytes=1 * GiB)
+
+    misaligned = GptLayout(geometry, (PartitionExtent(1, None, 2049, 4095),))
+    with pytest.raises(ValueError, match="not aligned"):
+        misaligned.validate()
+
+    overlapping = GptLayout(geometry, (
+        PartitionExtent(1, None, 2048, 8191),
+        PartitionExtent(2, None, 6144, 10239),
+    ))
+    with pytest.raises(ValueError, match="overlaps"):
+        overlapping.validate()
+
+    too_long = GptLayout(geometry, (PartitionExtent(1, None, 2048, geometry.last_usable + 1),))
+    with pytest.raises(ValueError, match="past the last usable"):
+        too_long.validate()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_layouts_are_valid_or_rejected(seed):
+    rng = random.Random(seed)
+
+    for _ in range(50):
+        lss = rng.choice([512, 4096])
+        geometry = DiskGeometry(
+            size_bytes=rng.randrange(64 * MiB, 64 * GiB) // lss * lss,
+            logical_sector_size=lss,
+            physical_sector_size=rng.choice([lss, 4096]) if lss == 512 else 4096,
+            alignment_offset=rng.choice([0, 0, 7 * 512]) if lss == 512 else 0,
+            optimal_io_size=rng.choice([0, 0, 64 * 1024, 3 * MiB]),
+        )
+        count = rng.randint(1, 5)
+        sizes = [(index, rng.randrange(1, geometry.size_bytes // count)) for index in range(count)]
+        if rng.random() < 0.7:
+            sizes[rng.randrange(count)] = (None, None)
+
+        try:
+            layout = plan_layout(geometry, sizes)
+        except ValueError:
+            continue
+        assert_layout(layout, sizes)
@@ -0,0 +1,70 @@
+import json
+
+from lib.journal import JOURNAL_PATH, JOURNAL_VERSION, InstallJournal, fingerprint
+
+
+def test_fingerprint_is_stable_and_sensitive_to_inputs():
+    assert fingerprint({"a": 1, "b": [1, 2]}) == fingerprint({"b": [1, 2], "a": 1})
+    assert fingerprint({"a": 1}) != fingerprint({"a": 2})
+    assert fingerprint(["base", "linux"]) != fingerprint(["linux", "base"])
+    assert fingerprint(None) == fingerprint(None)
+    # Values JSON cannot encode are fingerprinted by repr.
+    assert fingerprint({"path": object}) == fingerprint({"path": object})
+
+
+def test_entries_stay_in_memory_until_attached(tmp_path):
+    journal = InstallJournal(tmp_path)
+    journal.mark_done("partition", {"disk": "/dev/vda"}, duration=1.23456)
+
+    assert journal.is_done("partition", {"disk": "/dev/vda"})
+    assert not (tmp_path / JOURNAL_PATH).exists()
+
+    journal.attach()
+
+    data = json.loads((tmp_path / JOURNAL_PATH).read_text())
+    assert data["version"] == JOURNAL_VERSION
+    assert data["phases"]["partition"]["inputs"] == fingerprint({"disk": "/dev/vda"})
+    assert data["phases"]["partition"]["duration"] == 1.235
+
+
+def test_is_done_compares_the_inputs(tmp_path):
+    journal = InstallJournal(tmp_path)
+    journal.mark_done("pacstrap", ["base"])
+
+    assert journal.is_done("pacstrap", ["base"])
+    assert not journal.is_done("pacstrap", ["base", "linux"])
+    assert not journal.is_done("fstab")
+
+
+def test_load_merges_with_phases_finished_before_mounting(tmp_path):
+    first = InstallJournal(tmp_path)
+    first.attach()
+    first.mark_done("pacstrap", ["base"])
+    first.mark_done("partition", "old")
+
+    resumed = InstallJournal(tmp_path)
+    resumed.mark_done("partition", "new")
+    assert resumed.load()
+
+    # The in-memory entry of this run wins over the stored one.
+    assert resumed.attached
+    assert resumed.is_done("pacstrap", ["base"])
+    assert resumed.is_done("partition", "new")
+    assert not resumed.is_done("partition", "old")
+
+
+def test_missing_unreadable_or_foreign_journals_are_ignored(tmp_path, capsys):
+    journal = InstallJournal(tmp_path)
+    assert not journal.load()
+
+    path = tmp_path / JOURNAL_PATH
+    path.parent.mkdir(parents=True)
+    path.write_text("{not json")
+    assert not journal.load()
+    assert "unreadable" in capsys.readouterr().out
+
+    path.write_text(json.dumps({"version": JOURNAL_VERSION + 1, "phases": {"partition": {}}}))
+    assert not journal.load()
+    assert "unknown version" in capsys.readouterr().out
+    assert journal.phases == {}
+    assert not journal.attached
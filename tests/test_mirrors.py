@@ -0,0 +1,146 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+import pytest
+
+from lib.mirrors import parse_mirrorlist, rank_mirrors, rotate_mirrorlist, write_ranked_mirrorlist
+
+
+class MirrorStub:
+    """A local mirror that answers ``lastsync`` and ``core.db`` after ``delay`` seconds."""
+
+    def __init__(self, delay: float = 0.0, *, database: bool = True):
+        stub = self
+        self.delay = delay
+        self.database = database
+        self.paths: list[str] = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.paths.append(self.path)
+                time.sleep(stub.delay)
+
+                if self.path == "/lastsync":
+                    data = b"1700000000\n"
+                elif self.path == "/core/os/x86_64/core.db" and stub.database:
+                    data = b"\0" * 256 * 1024
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/$repo/os/$arch"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def mirrors():
+    started: list[MirrorStub] = []
+
+    def start(delay: float = 0.0, **kwargs) -> MirrorStub:
+        stub = MirrorStub(delay, **kwargs)
+        started.append(stub)
+        return stub
+
+    yield start
+    for stub in started:
+        stub.close()
+
+
+# Nothing listens on port 1, so connections are refused at once.
+DEAD_MIRROR = "http://127.0.0.1:1/$repo/os/$arch"
+
+
+def test_parse_mirrorlist_includes_commented_servers_once():
+    text = """
+    ## Germany
+    #Server = https://a.example/$repo/os/$arch
+    Server = https://b.example/$repo/os/$arch
+    Server=https://a.example/$repo/os/$arch
+    Include = /etc/pacman.d/other
+    """
+
+    assert parse_mirrorlist(text) == ["https://a.example/$repo/os/$arch", "https://b.example/$repo/os/$arch"]
+
+
+def test_mirrors_are_ranked_by_measured_time(mirrors):
+    slow, fast, medium = mirrors(0.3), mirrors(0.0), mirrors(0.1)
+
+    ranked = rank_mirrors([slow.url, DEAD_MIRROR, fast.url, medium.url], timeout=2)
+
+    assert [result.server for result in ranked] == [fast.url, medium.url, slow.url]
+    assert all(result.size == 256 * 1024 for result in ranked)
+    assert "/lastsync" in fast.paths
+    assert "/core/os/x86_64/core.db" in fast.paths
+
+
+def test_probes_run_concurrently(mirrors):
+    stubs = [mirrors(0.3) for _ in range(6)]
+
+    start = time.perf_counter()
+    ranked = rank_mirrors([stub.url for stub in stubs], timeout=2)
+
+    # Two rounds of 0.3s probes, not twelve.
+    assert len(ranked) == 6
+    assert time.perf_counter() - start < 6 * 0.3
+
+
+def test_mirrors_without_a_database_or_too_slow_are_dropped(mirrors):
+    good, no_db, too_slow = mirrors(), mirrors(database=False), mirrors(1.0)
+
+    ranked = rank_mirrors([no_db.url, too_slow.url, good.url], timeout=0.5)
+
+    assert [result.server for result in ranked] == [good.url]
+
+
+def test_count_limits_the_result(mirrors):
+    stubs = [mirrors(0.05 * index) for index in range(4)]
+
+    ranked = rank_mirrors([stub.url for stub in stubs], count=2, timeout=2)
+
+    assert [result.server for result in ranked] == [stubs[0].url, stubs[1].url]
+
+
+def test_write_ranked_mirrorlist(mirrors, tmp_path):
+    slow, fast = mirrors(0.2), mirrors()
+    path = tmp_path / "mirrorlist"
+    path.write_text(f"#Server = {slow.url}\nServer = {DEAD_MIRROR}\n#Server = {fast.url}\n")
+
+    assert write_ranked_mirrorlist(path, count=5, timeout=2)
+
+    assert parse_mirrorlist(path.read_text()) == [fast.url, slow.url]
+    assert path.read_text().startswith("# Generated by archy")
+
+
+def test_write_ranked_mirrorlist_keeps_the_list_when_nothing_answers(tmp_path):
+    path = tmp_path / "mirrorlist"
+    original = f"Server = {DEAD_MIRROR}\n"
+    path.write_text(original)
+
+    assert not write_ranked_mirrorlist(path, timeout=1)
+    assert path.read_text() == original
+
+
+def test_rotate_mirrorlist(tmp_path):
+    path = tmp_path / "mirrorlist"
+    path.write_text("# header\nServer = https://a\n#Server = https://off\nServer = https://b\nServer = https://c\n")
+
+    assert rotate_mirrorlist(path) == "https://b"
+    assert path.read_text() == "# header\n#Server = https://off\nServer = https://b\nServer = https://c\nServer = https://a\n"
+
+    path.write_text("Server = https://only\n")
+    assert rotate_mirrorlist(path) is None
+    assert rotate_mirrorlist(tmp_path / "missing") is None
@@ -0,0 +1,36 @@
+from lib.gpt import DiskGeometry
+from lib.models import Disk, Partition
+from lib.partitioner import build_table_action
+
+GiB = 1024**3
+
+
+def make_disk(device: str, *configs: dict) -> Disk:
+    return Disk(
+        device=device,
+        wipe=True,
+        partitions=[Partition.from_config(config, device, index) for index, config in enumerate(configs, 1)],
+    )
+
+
+def test_table_action_writes_the_planned_sectors():
+    # 512e drive whose first naturally aligned sector is LBA 7.
+    geometry = DiskGeometry(size_bytes=32 * GiB, alignment_offset=7 * 512)
+    disk = make_disk(
+        "/dev/sda",
+        {"mount": "/boot", "fs": "vfat", "size": "512M"},
+        {"mount": "swap", "size": "2G"},
+        {"mount": "/", "fs": "ext4", "size": "fill"},
+    )
+    layout = disk.partition_plan(geometry)
+
+    cmd = build_table_action(disk, layout)["cmd"]
+
+    # sgdisk must not re-align the starts the planner chose.
+    assert "--set-alignment=1" in cmd
+    assert not [arg for arg in cmd if arg.startswith("--set-alignment=") and arg != "--set-alignment=1"]
+    assert layout.extents[0].first_lba == 2041
+    for extent in layout.extents:
+        assert f"-n{extent.number}:{extent.first_lba}:{extent.last_lba}" in cmd
+    assert cmd[0] == "sgdisk"
+    assert cmd[-1] == "/dev/sda"
@@ -0,0 +1,230 @@
+import threading
+import time
+
+import pytest
+
+from lib.journal import InstallJournal
+from lib.phases import (
+    RESOURCE_CHROOT,
+    RESOURCE_DISK,
+    RESOURCE_NETWORK,
+    RESOURCE_PACMAN,
+    PhaseResult,
+    PhaseScheduler,
+)
+
+
+class Recorder:
+    """Trivial phase callables that log when they run and how many overlap."""
+
+    def __init__(self):
+        self.events: list[tuple[str, str]] = []
+        self.running: set[str] = set()
+        self.overlaps: list[set[str]] = []
+        self._lock = threading.Lock()
+
+    def phase(self, name: str, seconds: float = 0.0, *, result=None, fail: bool = False):
+        def run():
+            with self._lock:
+                self.events.append(("start", name))
+                self.running.add(name)
+                self.overlaps.append(set(self.running))
+            time.sleep(seconds)
+            with self._lock:
+                self.running.discard(name)
+                self.events.append(("end", name))
+            if fail:
+                raise RuntimeError(f"{name} failed")
+            return result
+
+        return run
+
+    def ran(self) -> list[str]:
+        return [name for event, name in self.events if event == "start"]
+
+    def index(self, event: str, name: str) -> int:
+        return self.events.index((event, name))
+
+
+def test_phases_wait_for_their_requirements():
+    recorder = Recorder()
+    scheduler = PhaseScheduler(max_parallel=4)
+    scheduler.add("mount", recorder.phase("mount", 0.05))
+    scheduler.add("pacstrap", recorder.phase("pacstrap", 0.1), requires=["mount"])
+    scheduler.add("fstab", recorder.phase("fstab", 0.02), requires=["mount"])
+    scheduler.add("bootloader", recorder.phase("bootloader"), requires=["pacstrap", "fstab"])
+
+    results = scheduler.run()
+
+    assert all(result.ok for result in results.values())
+    assert recorder.index("end", "mount") < recorder.index("start", "pacstrap")
+    assert recorder.index("end", "mount") < recorder.index("start", "fstab")
+    assert recorder.index("end", "pacstrap") < recorder.index("start", "bootloader")
+    assert recorder.index("end", "fstab") < recorder.index("start", "bootloader")
+    # Independent phases run side by side.
+    assert {"pacstrap", "fstab"} in recorder.overlaps
+
+
+def test_one_at_a_time_runs_in_the_order_added():
+    recorder = Recorder()
+    scheduler = PhaseScheduler(max_parallel=1)
+    for name in ["a", "b", "c", "d"]:
+        scheduler.add(name, recorder.phase(name))
+    scheduler.add("e", recorder.phase("e"), requires=["a"])
+
+    scheduler.run()
+
+    assert recorder.ran() == ["a", "b", "c", "d", "e"]
+    assert max(len(running) for running in recorder.overlaps) == 1
+
+
+def test_exclusive_resources_serialize_phases():
+    recorder = Recorder()
+    scheduler = PhaseScheduler(max_parallel=4)
+    scheduler.add("pacman-1", recorder.phase("pacman-1", 0.05), resources={RESOURCE_PACMAN})
+    scheduler.add("pacman-2", recorder.phase("pacman-2", 0.05), resources={RESOURCE_PACMAN, RESOURCE_NETWORK})
+    scheduler.add("disk", recorder.phase("disk", 0.05), resources={RESOURCE_DISK})
+    scheduler.add("chroot-1", recorder.phase("chroot-1", 0.05), resources={RESOURCE_CHROOT})
+    scheduler.add("chroot-2", recorder.phase("chroot-2", 0.05), resources={RESOURCE_CHROOT})
+
+    scheduler.run()
+
+    assert not any({"pacman-1", "pacman-2"} <= running for running in recorder.overlaps)
+    # Other exclusive resources and shared ones do not wait for pacman.
+    assert any({"pacman-1", "disk"} <= running for running in recorder.overlaps)
+    assert any({"chroot-1", "chroot-2"} <= running for running in recorder.overlaps)
+
+
+def test_no_phase_starts_after_a_failure(capsys):
+    recorder = Recorder()
+    scheduler = PhaseScheduler(max_parallel=2)
+    scheduler.add("partition", recorder.phase("partition", fail=True))
+    scheduler.add("slow", recorder.phase("slow", 0.1))
+    scheduler.add("mount", recorder.phase("mount"), requires=["partition"])
+    scheduler.add("after-slow", recorder.phase("after-slow"), requires=["slow"])
+
+    with pytest.raises(SystemExit) as exit_info:
+        scheduler.run_or_exit()
+
+    assert exit_info.value.code == 1
+    # The running phase finishes; nothing new starts.
+    assert recorder.ran() == ["partition", "slow"]
+    assert scheduler.results["slow"].ok
+    assert isinstance(scheduler.results["partition"].error, RuntimeError)
+    err = capsys.readouterr().err
+    assert "Install failed in phase: partition" in err
+    assert "Phases not run: mount, after-slow" in err
+
+
+def test_invalid_graphs_are_rejected():
+    scheduler = PhaseScheduler()
+    scheduler.add("a", lambda: None, requires=["missing"])
+    with pytest.raises(ValueError, match="unknown phases: missing"):
+        scheduler.run()
+
+    scheduler = PhaseScheduler()
+    scheduler.add("a", lambda: None, requires=["c"])
+    scheduler.add("b", lambda: None, requires=["a"])
+    scheduler.add("c", lambda: None, requires=["b"])
+    with pytest.raises(ValueError, match="cycle: a -> c -> b -> a"):
+        scheduler.validate()
+
+    with pytest.raises(ValueError, match="Duplicate phase"):
+        scheduler.add("a", lambda: None)
+    with pytest.raises(ValueError, match="unknown resources: gpu"):
+        scheduler.add("d", lambda: None, resources={"gpu"})
+    with pytest.raises(ValueError, match="max_parallel"):
+        PhaseScheduler(max_parallel=0)
+
+
+def install_graph(recorder: Recorder, journal: InstallJournal, *, pacstrap_inputs=("base",), users_result=None):
+    scheduler = PhaseScheduler(max_parallel=1, journal=journal)
+    scheduler.add("partition", recorder.phase("partition"), inputs={"disk": "/dev/vda"})
+    scheduler.add("mount", recorder.phase("mount"), requires=["partition"], checkpoint=False)
+    scheduler.add("pacstrap", recorder.phase("pacstrap"), requires=["mount"], inputs=list(pacstrap_inputs))
+    scheduler.add("fstab", recorder.phase("fstab"), requires=["pacstrap"])
+    scheduler.add("users", recorder.phase("users", result=users_result), requires=["mount"], inputs=["archy"])
+    return scheduler
+
+
+def test_resume_skips_journaled_phases(tmp_path):
+    journal = InstallJournal(tmp_path)
+    journal.attach()
+    install_graph(Recorder(), journal).run()
+
+    resumed = InstallJournal(tmp_path)
+    assert resumed.load()
+    recorder = Recorder()
+    results = install_graph(recorder, resumed).run()
+
+    # Runtime setup runs again; its dependents can still be skipped.
+    assert recorder.ran() == ["mount"]
+    assert [name for name, result in results.items() if result.skipped] == ["partition", "pacstrap", "fstab", "users"]
+
+
+def test_changed_inputs_rerun_the_phase_and_its_dependents(tmp_path):
+    journal = InstallJournal(tmp_path)
+    journal.attach()
+    install_graph(Recorder(), journal).run()
+
+    resumed = InstallJournal(tmp_path)
+    resumed.load()
+    recorder = Recorder()
+    install_graph(recorder, resumed, pacstrap_inputs=("base", "linux")).run()
+
+    # fstab's inputs are unchanged, but the pacstrap it depends on ran again.
+    assert recorder.ran() == ["mount", "pacstrap", "fstab"]
+    assert resumed.is_done("pacstrap", ["base", "linux"])
+    assert not resumed.is_done("pacstrap", ["base"])
+
+
+def test_phase_returning_false_is_retried_on_resume(tmp_path):
+    journal = InstallJournal(tmp_path)
+    journal.attach()
+    install_graph(Recorder(), journal, users_result=False).run()
+
+    assert not journal.is_done("users", ["archy"])
+    assert not journal.is_done("mount")
+
+    resumed = InstallJournal(tmp_path)
+    resumed.load()
+    recorder = Recorder()
+    install_graph(recorder, resumed).run()
+
+    assert recorder.ran() == ["mount", "users"]
+
+
+def test_critical_path_follows_dependencies_and_exclusive_resources():
+    scheduler = PhaseScheduler()
+    scheduler.add("partition", lambda: None, resources={RESOURCE_DISK})
+    scheduler.add("mirrors", lambda: None, resources={RESOURCE_NETWORK})
+    scheduler.add("pacstrap", lambda: None, requires=["partition", "mirrors"], resources={RESOURCE_PACMAN})
+    scheduler.add("flatpak", lambda: None, requires=["partition"])
+    scheduler.add("aur", lambda: None, requires=["partition"], resources={RESOURCE_PACMAN})
+    scheduler.add("dotfiles", lambda: None, requires=["partition"])
+    # Timings as a run would have produced them: aur waited on pacstrap's
+    # pacman lock, not on its requirement.
+    scheduler.results = {
+        "partition": PhaseResult("partition", 0.0, 1.0),
+        "mirrors": PhaseResult("mirrors", 0.0, 3.0),
+        "pacstrap": PhaseResult("pacstrap", 3.0, 10.0),
+        "flatpak": PhaseResult("flatpak", 1.0, 12.0),
+        "aur": PhaseResult("aur", 10.0, 15.0),
+        "dotfiles": PhaseResult("dotfiles", 1.0, 2.0),
+    }
+
+    assert [result.name for result in scheduler.critical_path()] == ["mirrors", "pacstrap", "aur"]
+    assert PhaseScheduler().critical_path() == []
+
+
+def test_summary_reports_the_critical_path(capsys):
+    recorder = Recorder()
+    scheduler = PhaseScheduler()
+    scheduler.add("short", recorder.phase("short"))
+    scheduler.add("long", recorder.phase("long", 0.05))
+    scheduler.add("last", recorder.phase("last"), requires=["long"])
+
+    scheduler.run_or_exit()
+
+    assert [result.name for result in scheduler.critical_path()] == ["long", "last"]
+    assert "Critical path" in capsys.readouterr().out
@@ -0,0 +1,160 @@
+import io
+import json
+import os
+from pathlib import Path
+import tarfile
+
+from lib.models.packages import PackageGroup
+from lib.syncdb import SyncIndex, find_missing_packages, load_sync_index, preflight_package_groups, repo_order
+
+
+def desc(name: str, *, provides=(), groups=()) -> str:
+    lines = ["%FILENAME%", f"{name}-1.0-1-x86_64.pkg.tar.zst", "", "%NAME%", name, "", "%VERSION%", "1.0-1", ""]
+    if provides:
+        lines += ["%PROVIDES%", *provides, ""]
+    if groups:
+        lines += ["%GROUPS%", *groups, ""]
+    return "\n".join(lines)
+
+
+def write_db(path: Path, packages: dict[str, str]):
+    """Write a sync database: a gzipped tar with one ``<name>-<version>/desc`` per package."""
+
+    with tarfile.open(path, "w:gz") as archive:
+        for name, text in packages.items():
+            data = text.encode()
+            member = tarfile.TarInfo(f"{name}-1.0-1/desc")
+            member.size = len(data)
+            archive.addfile(member, io.BytesIO(data))
+
+
+def make_sync_dir(tmp_path: Path) -> Path:
+    sync_dir = tmp_path / "sync"
+    sync_dir.mkdir()
+    write_db(sync_dir / "core.db", {
+        "bash": desc("bash", provides=["sh"]),
+        "linux": desc("linux", groups=["kernels"]),
+    })
+    write_db(sync_dir / "extra.db", {
+        "bash": desc("bash"),
+        "pipewire-pulse": desc("pipewire-pulse", provides=["pulse-native-provider", "pulseaudio=17.0"]),
+        "xorg-server": desc("xorg-server", groups=["xorg"]),
+        "xorg-xinit": desc("xorg-xinit", groups=["xorg"]),
+    })
+    return sync_dir
+
+
+def test_index_resolves_names_provides_and_groups(tmp_path):
+    index = load_sync_index(make_sync_dir(tmp_path), cache_path=None, pacman_conf=None)
+
+    assert index.packages == {"bash": "core", "linux": "core", "pipewire-pulse": "extra", "xorg-server": "extra", "xorg-xinit": "extra"}
+    assert index.resolves("bash")
+    assert index.resolves("sh")
+    assert index.resolves("pulseaudio")
+    assert index.resolves("xorg")
+    assert index.resolves("kernels")
+    assert index.groups["xorg"] == ["xorg-server", "xorg-xinit"]
+    # Without a pacman.conf the first repository in name order wins.
+    assert index.resolves("core/bash")
+    assert not index.resolves("extra/bash")
+    assert index.missing(["bash", "no-such-package", "extra/linux"]) == ["no-such-package", "extra/linux"]
+
+
+def test_pacman_conf_repo_order_wins_over_names(tmp_path):
+    sync_dir = make_sync_dir(tmp_path)
+    write_db(sync_dir / "aaa-testing.db", {"bash": desc("bash"), "linux": desc("linux")})
+    write_db(sync_dir / "removed.db", {"gone": desc("gone")})
+    pacman_conf = tmp_path / "pacman.conf"
+    pacman_conf.write_text(
+        "[options]\nArchitecture = auto\n\n"
+        "#[core-testing]\n"
+        "[core]\nInclude = /etc/pacman.d/mirrorlist\n\n"
+        "[extra]\nInclude = /etc/pacman.d/mirrorlist\n\n"
+        "[aaa-testing] # sorts before core\nServer = file:///srv/repo\n\n"
+        "[multilib]\nInclude = /etc/pacman.d/mirrorlist\n"
+    )
+
+    assert repo_order(pacman_conf) == ["core", "extra", "aaa-testing", "multilib"]
+    assert repo_order(tmp_path / "missing.conf") is None
+
+    index = load_sync_index(sync_dir, cache_path=None, pacman_conf=pacman_conf)
+
+    assert index.packages["bash"] == "core"
+    assert index.packages["linux"] == "core"
+    assert index.resolves("core/linux")
+    assert not index.resolves("aaa-testing/linux")
+    # Databases of repositories missing from pacman.conf are not searched.
+    assert not index.resolves("gone")
+
+    # Without pacman.conf the name order puts the testing repository first.
+    fallback = load_sync_index(sync_dir, cache_path=None, pacman_conf=tmp_path / "missing.conf")
+    assert fallback.packages["bash"] == "aaa-testing"
+
+
+def test_cache_follows_the_repo_order(tmp_path):
+    sync_dir = make_sync_dir(tmp_path)
+    cache_path = tmp_path / "cache" / "index.json"
+    pacman_conf = tmp_path / "pacman.conf"
+
+    pacman_conf.write_text("[core]\n[extra]\n")
+    assert load_sync_index(sync_dir, cache_path=cache_path, pacman_conf=pacman_conf).packages["bash"] == "core"
+
+    pacman_conf.write_text("[extra]\n[core]\n")
+    assert load_sync_index(sync_dir, cache_path=cache_path, pacman_conf=pacman_conf).packages["bash"] == "extra"
+
+
+def test_no_databases(tmp_path):
+    assert load_sync_index(tmp_path, cache_path=None, pacman_conf=None) is None
+
+
+def test_unreadable_database_is_skipped(tmp_path):
+    sync_dir = make_sync_dir(tmp_path)
+    (sync_dir / "broken.db").write_bytes(b"not a tarball")
+
+    index = load_sync_index(sync_dir, cache_path=None, pacman_conf=None)
+
+    assert index.resolves("linux")
+
+
+def test_cache_is_reused_until_a_database_changes(tmp_path):
+    sync_dir = make_sync_dir(tmp_path)
+    cache_path = tmp_path / "cache" / "index.json"
+
+    first = load_sync_index(sync_dir, cache_path=cache_path, pacman_conf=None)
+    assert json.loads(cache_path.read_text())["index"] == first.to_dict()
+
+    # A cache hit is served without reading the databases.
+    payload = json.loads(cache_path.read_text())
+    payload["index"]["packages"]["from-cache"] = "core"
+    cache_path.write_text(json.dumps(payload))
+    assert load_sync_index(sync_dir, cache_path=cache_path, pacman_conf=None).resolves("from-cache")
+
+    # A re-synced database (new mtime) invalidates it.
+    write_db(sync_dir / "core.db", {"bash": desc("bash"), "zsh": desc("zsh")})
+    stat = (sync_dir / "core.db").stat()
+    os.utime(sync_dir / "core.db", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    index = load_sync_index(sync_dir, cache_path=cache_path, pacman_conf=None)
+    assert index.resolves("zsh")
+    assert not index.resolves("from-cache")
+    assert not index.resolves("linux")
+
+
+def test_preflight_reports_missing_names(tmp_path, capsys):
+    sync_dir = make_sync_dir(tmp_path)
+    pacman = tmp_path / "pacman.txt"
+    pacman.write_text("# base\nbash\nxorg\nnot-a-package\n")
+    groups = [PackageGroup(pacman=pacman)]
+
+    assert find_missing_packages(groups, load_sync_index(sync_dir, cache_path=None, pacman_conf=None)) == {pacman: ["not-a-package"]}
+    assert not preflight_package_groups(groups, sync_dir=sync_dir, cache_path=None, pacman_conf=None)
+    assert "not-a-package" in capsys.readouterr().out
+
+    pacman.write_text("bash\n")
+    assert preflight_package_groups(groups, sync_dir=sync_dir, cache_path=None, pacman_conf=None)
+    assert preflight_package_groups(groups, sync_dir=tmp_path / "empty", cache_path=None, pacman_conf=None)
+
+
+def test_index_round_trips_through_dict():
+    index = SyncIndex(packages={"a": "core"}, provides={"b": ["a"]}, groups={"g": ["a"]})
+
+    assert SyncIndex.from_dict(json.loads(json.dumps(index.to_dict()))) == index
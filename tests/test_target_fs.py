@@ -0,0 +1,135 @@
+import os
+import stat
+
+import pytest
+
+from lib.target_fs import SUDOERS_MODE, WHEEL_SUDO_LINE, TargetFilesystem, atomic_write_text
+
+
+def mode(path) -> int:
+    return stat.S_IMODE(os.lstat(path).st_mode)
+
+
+@pytest.fixture
+def target(tmp_path):
+    return TargetFilesystem(tmp_path)
+
+
+def test_atomic_write_replaces_the_file_and_leaves_no_temporaries(tmp_path):
+    path = tmp_path / "config"
+
+    atomic_write_text(path, "first\n")
+    assert path.read_text() == "first\n"
+    assert mode(path) == 0o644
+
+    os.chmod(path, 0o600)
+    inode = path.stat().st_ino
+    atomic_write_text(path, "second\n")
+
+    assert path.read_text() == "second\n"
+    # A new file renamed over the old one, which keeps its mode.
+    assert path.stat().st_ino != inode
+    assert mode(path) == 0o600
+    assert os.listdir(tmp_path) == ["config"]
+
+
+def test_failed_write_keeps_the_original(tmp_path, monkeypatch):
+    path = tmp_path / "config"
+    path.write_text("original\n")
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError, match="disk full"):
+        atomic_write_text(path, "new\n")
+
+    assert path.read_text() == "original\n"
+    assert os.listdir(tmp_path) == ["config"]
+
+
+def test_write_text_creates_parents_under_the_root(target, tmp_path):
+    target.write_text("/etc/vconsole.conf", "KEYMAP=us\n", mode=0o600)
+
+    assert (tmp_path / "etc" / "vconsole.conf").read_text() == "KEYMAP=us\n"
+    assert mode(tmp_path / "etc" / "vconsole.conf") == 0o600
+
+    with pytest.raises(ValueError, match="must be absolute"):
+        target.write_text("etc/hostname", "archy\n")
+
+
+def test_edit_lines(target, tmp_path):
+    # A missing file is edited as empty.
+    assert target.edit_lines("/etc/hosts", lambda lines: [*lines, "127.0.0.1 localhost"])
+    assert (tmp_path / "etc" / "hosts").read_text() == "127.0.0.1 localhost\n"
+
+    # An edit that changes nothing does not rewrite the file.
+    inode = (tmp_path / "etc" / "hosts").stat().st_ino
+    assert not target.edit_lines("/etc/hosts", lambda lines: lines)
+    assert (tmp_path / "etc" / "hosts").stat().st_ino == inode
+
+    assert target.edit_lines("/etc/hosts", lambda lines: [line.replace("localhost", "archy") for line in lines])
+    assert target.read_text("/etc/hosts") == "127.0.0.1 archy\n"
+
+
+def test_enable_locale_uncomments_only_the_exact_entry(target):
+    target.write_text("/etc/locale.gen", (
+        "#  en_US.UTF-8 UTF-8 is the usual choice\n"
+        "#en_US.UTF-8@euro UTF-8\n"
+        "#en_US.UTF-8 UTF-8\n"
+        "#en_US ISO-8859-1\n"
+    ))
+
+    assert target.enable_locale("en_US.UTF-8")
+    assert target.read_text("/etc/locale.gen") == (
+        "#  en_US.UTF-8 UTF-8 is the usual choice\n"
+        "#en_US.UTF-8@euro UTF-8\n"
+        "en_US.UTF-8 UTF-8\n"
+        "#en_US ISO-8859-1\n"
+    )
+    assert not target.enable_locale("en_US.UTF-8")
+
+
+def test_enable_locale_appends_an_unknown_locale(target):
+    target.write_text("/etc/locale.gen", "#de_DE.UTF-8 UTF-8\n")
+
+    assert target.enable_locale("sv_SE.UTF-8")
+    assert target.enable_locale("en_US")
+    assert target.read_text("/etc/locale.gen") == "#de_DE.UTF-8 UTF-8\nsv_SE.UTF-8 UTF-8\nen_US ISO-8859-1\n"
+
+
+def test_enable_wheel_sudo_creates_the_file_with_mode_0440(target, tmp_path):
+    assert target.enable_wheel_sudo()
+
+    assert target.read_text("/etc/sudoers") == f"{WHEEL_SUDO_LINE}\n"
+    assert mode(tmp_path / "etc" / "sudoers") == SUDOERS_MODE == 0o440
+
+
+def test_enable_wheel_sudo_uncomments_the_rule_and_keeps_0440(target, tmp_path):
+    target.write_text("/etc/sudoers", (
+        "root ALL=(ALL:ALL) ALL\n"
+        "# %wheel ALL=(ALL:ALL) NOPASSWD: ALL\n"
+        "# %wheel  ALL=(ALL)  ALL\n"
+    ), mode=SUDOERS_MODE)
+
+    assert target.enable_wheel_sudo()
+
+    assert target.read_text("/etc/sudoers") == (
+        "root ALL=(ALL:ALL) ALL\n"
+        "# %wheel ALL=(ALL:ALL) NOPASSWD: ALL\n"
+        f"{WHEEL_SUDO_LINE}\n"
+    )
+    assert mode(tmp_path / "etc" / "sudoers") == 0o440
+    # Already enabled: nothing to do.
+    assert not target.enable_wheel_sudo()
+
+
+def test_symlink_replaces_an_existing_link(target, tmp_path):
+    target.symlink("/etc/localtime", "/usr/share/zoneinfo/UTC")
+    target.symlink("/etc/localtime", "/usr/share/zoneinfo/Europe/Stockholm")
+
+    link = tmp_path / "etc" / "localtime"
+    assert link.is_symlink()
+    # The destination is a path inside the target, not on the host.
+    assert os.readlink(link) == "/usr/share/zoneinfo/Europe/Stockholm"
+    assert os.listdir(tmp_path / "etc") == ["localtime"]